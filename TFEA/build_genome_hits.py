@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''This file contains scripts to build a genome hits index (see genome_hits
+    module) from a genome fasta file and a .meme motif database. The genome is
+    split into chunks which are scanned in parallel across cpus or across
+    SLURM array tasks. The resulting index can be given to TFEA using
+    --genomehits with --scanner 'genome hits'.
+
+    When run as a SLURM array, each task scans its share of chunks and a final
+    job run with --merge combines them into the index.
+'''
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import os
+import sys
+import shutil
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+from TFEA import scanner
+from TFEA import genome_hits
+from TFEA import genome_fasta
+from TFEA import multiprocess
+from TFEA import exceptions
+
+#Main Function
+#==============================================================================
+def main():
+    '''Main executable script
+    '''
+    parser = parse_arguments()
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    inputs = vars(parser.parse_args())
+    output = Path(inputs['output'])
+    partdir = output / 'parts'
+    tempdir = output / 'temp_files'
+    partdir.mkdir(exist_ok=True, parents=True)
+    tempdir.mkdir(exist_ok=True, parents=True)
+
+    if inputs['singlemotif'] is not None:
+        motif_list = inputs['singlemotif'].split(',')
+    else:
+        motif_list = scanner.fimo_motif_names(motifdatabase=inputs['motifs'])
+    sizes = genome_fasta.chrom_sizes(genomefasta=inputs['genomefasta'])
+    chunks = genome_chunks(sizes=sizes, chunk_size=inputs['chunk_size'])
+
+    if not inputs['merge']:
+        task_chunks = chunks[inputs['task']::inputs['tasks']]
+        print("Scanning " + str(len(task_chunks)) + " genome chunks...",
+                file=sys.stderr)
+        scan_keywords = scan_settings(motif_list=motif_list,
+                                        motifdatabase=inputs['motifs'],
+                                        background_file=inputs['background'],
+                                        thresh=inputs['fimo_thresh'],
+                                        scanner_option=inputs['scanner'],
+                                        pwm_scan=inputs['pwm_scan'])
+        multiprocess.main(function=scan_chunk, args=task_chunks,
+                            kwargs=dict(motif_list=motif_list,
+                                        genomefasta=inputs['genomefasta'],
+                                        sizes=sizes, partdir=partdir, 
+                                        tempdir=tempdir,
+                                        **scan_keywords),
+                            cpus=inputs['cpus'])
+
+    if inputs['merge'] or inputs['tasks'] == 1:
+        missing = [chunk for chunk in chunks
+                    if not part_file(partdir=partdir, chunk=chunk).exists()]
+        if len(missing) != 0:
+            raise exceptions.FileEmptyError(str(len(missing)) + " genome "
+                                            "chunks have not been scanned.")
+        print("Merging genome chunks...", file=sys.stderr)
+        motifs = multiprocess.main(function=merge_motif,
+                                    args=list(enumerate(motif_list)),
+                                    kwargs=dict(chunks=chunks,
+                                                partdir=partdir,
+                                                index_dir=output),
+                                    cpus=inputs['cpus'])
+        genome_hits.write_index_file(index_dir=output, motifs=dict(motifs))
+        shutil.rmtree(partdir)
+        shutil.rmtree(tempdir)
+
+#Secondary Functions
+#==============================================================================
+def parse_arguments():
+    '''Parse user arguments
+    '''
+    parser = argparse.ArgumentParser(description=("Build a genome hits index "
+                                                    "for use with --scanner "
+                                                    "'genome hits'"))
+    parser.add_argument('--output', '-o', required=True, help=("Full path to "
+                        "the output index directory."))
+    parser.add_argument('--genomefasta', '-g', required=True, help=("Full "
+                        "path to a fasta file for the genome of interest."))
+    parser.add_argument('--motifs', '-m', required=True, help=("Full path to "
+                        "a .meme formatted motif database."))
+    parser.add_argument('--scanner', choices=['fimo', 'numpy'],
+                        default='fimo', help=("Scanning method. Default: "
+                        "fimo"))
+    parser.add_argument('--pwm_scan', choices=['full', 'lookahead'],
+                        default='lookahead', help=("Scanning algorithm for "
+                        "the 'numpy' scanner. Default: lookahead"))
+    parser.add_argument('--fimo_thresh', default=1e-6, type=float,
+                        help=("P-value threshold for calling motif hits. "
+                        "Default: 1e-6"))
+    parser.add_argument('--background', default=None, help=("Full path to "
+                        "a markov background file. Default: the background "
+                        "within the motif database"))
+    parser.add_argument('--singlemotif', default=None, help=("Build the index "
+                        "for a subset of motifs. Can be a single motif or a "
+                        "comma-separated list of motifs."))
+    parser.add_argument('--chunk_size', default=10000000, type=int,
+                        help=("Size in bp of the genome chunks scanned by "
+                        "each process. Default: 10000000"))
+    parser.add_argument('--cpus', default=1, type=int, help=("Number of "
+                        "processes to use. Default: 1"))
+    parser.add_argument('--task', type=int,
+                        default=(int(os.environ.get('SLURM_ARRAY_TASK_ID', 0))
+                                - int(os.environ.get('SLURM_ARRAY_TASK_MIN', 0))),
+                        help=("Index of this task when splitting chunks "
+                        "across jobs (0-based). Default: "
+                        "$SLURM_ARRAY_TASK_ID - $SLURM_ARRAY_TASK_MIN or 0"))
+    parser.add_argument('--tasks', type=int,
+                        default=int(os.environ.get('SLURM_ARRAY_TASK_COUNT',
+                                                    1)),
+                        help=("Total number of tasks when splitting chunks "
+                        "across jobs. If greater than 1, run once more with "
+                        "--merge after all tasks complete. Default: "
+                        "$SLURM_ARRAY_TASK_COUNT or 1"))
+    parser.add_argument('--merge', action='store_true', help=("Combine "
+                        "scanned chunks from all tasks into the index."))
+    return parser
+
+#==============================================================================
+def genome_chunks(sizes=None, chunk_size=None):
+    '''Splits a genome into chunks of at most chunk_size bp
+
+    Parameters
+    ----------
+    sizes : dict
+        chromosome names as keys and sizes as values
+
+    Returns
+    -------
+    chunks : list
+        (chrom, start, stop) tuples
+    '''
+    chunks = list()
+    for chrom, size in sizes.items():
+        for start in range(0, size, chunk_size):
+            chunks.append((chrom, start, min(start + chunk_size, size)))
+
+    return chunks
+
+#==============================================================================
+def scan_settings(motif_list=None, motifdatabase=None, background_file=None,
+                    thresh=None, scanner_option=None, pwm_scan='full'):
+    '''Returns keyword arguments for scanner.scan_intervals shared by all
+        chunks
+    '''
+    pwms = scanner.meme_pssms(motifdatabase=motifdatabase, motifs=motif_list)
+    pad = max([len(pssm) for pssm, _ in pwms.values()]) - 1
+    if scanner_option == 'numpy':
+        pwm_list = scanner.numpy_pwms(motif_list=motif_list,
+                                        fimo_motifs=motifdatabase,
+                                        background_file=background_file,
+                                        fimo_thresh=thresh)
+        pwms = dict((motif, (log_odds, cutoff))
+                    for motif, log_odds, cutoff in pwm_list)
+    else:
+        pwms = None
+
+    return dict(pad=pad, scanner_option=scanner_option,
+                bg_file=background_file, motifdatabase=motifdatabase,
+                thresh=thresh, pwms=pwms, pwm_scan=pwm_scan)
+
+#==============================================================================
+def part_file(partdir=None, chunk=None):
+    chrom, start, stop = chunk
+    return Path(partdir) / f'{chrom}_{start}_{stop}.npz'
+
+#==============================================================================
+def scan_chunk(chunk, motif_list=None, genomefasta=None, sizes=None, 
+                partdir=None, tempdir=None, pad=None, scanner_option=None, bg_file=None,
+                motifdatabase=None, thresh=None, pwms=None, pwm_scan='full'):
+    '''Scans a single genome chunk for all motifs and saves hits to a part
+        file. Chunks are extended by pad so that hits starting near the end 
+        of a chunk are found. Chunks that have already been scanned are 
+        skipped so that interrupted builds can be resumed.
+    '''
+    outfile = part_file(partdir=partdir, chunk=chunk)
+    if outfile.exists():
+        return
+    chrom, start, stop = chunk
+    _, hits = scanner.scan_intervals(motifs=motif_list,
+                                    intervals={chrom: (np.array([start]),
+                                        np.array([min(stop + pad, 
+                                                        sizes[chrom])]))},
+                                    genomefasta=genomefasta, tempdir=tempdir,
+                                    pad=0, scanner=scanner_option,
+                                    bg_file=bg_file,
+                                    motifdatabase=motifdatabase,
+                                    thresh=thresh, pwms=pwms,
+                                    pwm_scan=pwm_scan)
+    arrays = dict()
+    empty = np.zeros(0, dtype=np.int64)
+    for i, motif in enumerate(motif_list):
+        #The index does not store strands
+        starts, stops, scores, _ = hits[motif].get(chrom, (empty, empty, 
+                                                            empty, empty))
+        #Hits starting within the padding are kept by the next chunk
+        keep = (starts >= start) & (starts < stop)
+        arrays[f'{i}_start'] = starts[keep]
+        arrays[f'{i}_stop'] = stops[keep]
+        arrays[f'{i}_score'] = scores[keep]
+
+    tmp_file = outfile.with_suffix('.tmp.npz')
+    np.savez(tmp_file, **arrays)
+    os.replace(tmp_file, outfile)
+
+#==============================================================================
+def merge_motif(motif, chunks=None, partdir=None, index_dir=None):
+    '''Combines hits for a single motif from all chunk part files and writes
+        them to the index
+
+    Parameters
+    ----------
+    motif : tuple
+        (motif index, motif name)
+
+    Returns
+    -------
+    motif : str
+        motif name
+    chrom_offsets : dict
+        see genome_hits.write_motif
+    '''
+    i, motif = motif
+    chroms = list()
+    starts = list()
+    stops = list()
+    scores = list()
+    for chunk in chunks:
+        with np.load(part_file(partdir=partdir, chunk=chunk)) as part:
+            chroms.append(np.full(len(part[f'{i}_start']), chunk[0]))
+            starts.append(part[f'{i}_start'])
+            stops.append(part[f'{i}_stop'])
+            scores.append(part[f'{i}_score'])
+    chrom_offsets = genome_hits.write_motif(index_dir=index_dir, motif=motif,
+                                            chroms=np.concatenate(chroms),
+                                            starts=np.concatenate(starts),
+                                            stops=np.concatenate(stops),
+                                            scores=np.concatenate(scores))
+
+    return motif, chrom_offsets
+
+#Independent script functionality
+#==============================================================================
+if __name__ == "__main__":
+    main()
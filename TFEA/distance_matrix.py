@@ -0,0 +1,507 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains the DistanceMatrix class which stores motif distances
+    to regions for all scanned motifs. It is created by the SCANNER module and
+    read by the ENRICHMENT, plot and OUTPUT modules. It also contains the
+    HitMatrix class which stores every hit within each region from which
+    DistanceMatrix summaries can be derived.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import numpy as np
+
+from TFEA import exceptions
+
+#Constants
+#==============================================================================
+#Ways to summarize all hits within a region as a single distance (see 
+#HitMatrix.summary)
+HIT_SUMMARIES = ['best', 'closest', 'average']
+
+#Value stored in dense matrices for regions without a motif hit
+NO_HIT = np.iinfo(np.int32).min
+
+#Distances are stored as int32 in units of 1/RESOLUTION bp. Motif centers can
+#fall between two bases so distances are multiples of 0.5 bp.
+RESOLUTION = 2
+
+#Classes
+#==============================================================================
+class DistanceMatrix(object):
+    '''A motif x region matrix of motif distances (in bp) from the center of
+        each region to the best motif hit within that region. Regions are in
+        ranked order.
+
+    Two backends are available. The dense backend stores an int32 array with
+    NO_HIT for regions without a hit. The sparse backend stores only hits in
+    compressed sparse row format (indptr, indices, values) and is smaller when
+    less than half of all regions have a hit.
+
+    Iterating over a DistanceMatrix yields (motif, distances) tuples where
+    distances is a float array with np.nan for regions without a hit.
+
+    Parameters
+    ----------
+    motifs : list
+        motif names, one for each row
+    regions : int
+        number of regions (columns)
+    dense : np.ndarray
+        int32 array of shape (len(motifs), regions). Required for the dense
+        backend.
+    indptr : np.ndarray
+        row pointers into indices and values. Required for the sparse backend.
+    indices : np.ndarray
+        region index for each hit. Required for the sparse backend.
+    values : np.ndarray
+        int32 distance for each hit. Required for the sparse backend.
+    '''
+    def __init__(self, motifs=None, regions=None, dense=None, indptr=None,
+                    indices=None, values=None):
+        self.motifs = list(motifs)
+        self.regions = int(regions)
+        self.dense = dense
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self._motif_index = dict((motif, i) for i, motif
+                                    in enumerate(self.motifs))
+        if dense is None and (indptr is None or indices is None
+                                or values is None):
+            raise exceptions.InputError("DistanceMatrix requires either a "
+                                        "dense array or indptr, indices and "
+                                        "values arrays.")
+
+    @classmethod
+    def from_rows(cls, rows, backend='auto'):
+        '''Creates a DistanceMatrix from (motif, distances) rows as returned
+            by SCANNER functions.
+
+        Parameters
+        ----------
+        rows : list
+            (motif, distances) tuples. distances may be a float array with
+            np.nan for no hit or a list with '.' for no hit. All rows must be
+            the same length.
+        backend : str
+            'dense', 'sparse' or 'auto'. If 'auto', the smaller backend is
+            chosen based on the number of hits.
+
+        Returns
+        -------
+        distance_matrix : DistanceMatrix
+        '''
+        motifs = list()
+        encoded = list()
+        for motif, distances in rows:
+            motifs.append(motif)
+            encoded.append(encode(distances))
+        regions = len(encoded[0]) if len(encoded) != 0 else 0
+        if any(len(row) != regions for row in encoded):
+            raise exceptions.InputError("All motifs must have distances for "
+                                        "the same number of regions.")
+
+        hits = sum(np.count_nonzero(row != NO_HIT) for row in encoded)
+        if backend == 'auto':
+            backend = 'sparse' if hits*2 < len(encoded)*regions else 'dense'
+
+        if backend == 'dense':
+            dense = np.full((len(encoded), regions), NO_HIT, dtype=np.int32)
+            for i, row in enumerate(encoded):
+                dense[i] = row
+            return cls(motifs=motifs, regions=regions, dense=dense)
+        elif backend == 'sparse':
+            indptr = np.zeros(len(encoded)+1, dtype=np.int64)
+            indices = np.empty(hits, dtype=np.int32)
+            values = np.empty(hits, dtype=np.int32)
+            for i, row in enumerate(encoded):
+                hit_indices = np.flatnonzero(row != NO_HIT)
+                indptr[i+1] = indptr[i] + len(hit_indices)
+                indices[indptr[i]:indptr[i+1]] = hit_indices
+                values[indptr[i]:indptr[i+1]] = row[hit_indices]
+            return cls(motifs=motifs, regions=regions, indptr=indptr,
+                        indices=indices, values=values)
+        else:
+            raise exceptions.InputError("DistanceMatrix backend not "
+                                        "recognized.")
+
+    @property
+    def backend(self):
+        return 'dense' if self.dense is not None else 'sparse'
+
+    @property
+    def shape(self):
+        return (len(self.motifs), self.regions)
+
+    @property
+    def nbytes(self):
+        '''Memory used by the stored arrays in bytes'''
+        if self.dense is not None:
+            return self.dense.nbytes
+        return self.indptr.nbytes + self.indices.nbytes + self.values.nbytes
+
+    def __len__(self):
+        return len(self.motifs)
+
+    def __contains__(self, motif):
+        return motif in self._motif_index
+
+    def __iter__(self):
+        for i, motif in enumerate(self.motifs):
+            yield motif, self.row(i)
+
+    def __getitem__(self, motif):
+        return self.row(self._motif_index[motif])
+
+    def row(self, i):
+        '''Returns distances (in bp) for the motif in row i as a float array
+            with np.nan for regions without a hit
+        '''
+        if self.dense is not None:
+            return decode(self.dense[i])
+        distances = np.full(self.regions, np.nan)
+        start, stop = self.indptr[i], self.indptr[i+1]
+        distances[self.indices[start:stop]] = self.values[start:stop]/RESOLUTION
+        return distances
+
+    def rows(self, start=0, stop=None):
+        '''Returns distances (in bp) for the motifs in rows start to stop as
+            a float array of shape (stop - start, regions) with np.nan for
+            regions without a hit
+        '''
+        stop = len(self.motifs) if stop is None else min(stop, len(self.motifs))
+        if self.dense is not None:
+            return decode(self.dense[start:stop])
+        distances = np.full((max(stop - start, 0), self.regions), np.nan)
+        first, last = self.indptr[start], self.indptr[max(stop, start)]
+        rows = np.repeat(np.arange(len(distances)), 
+                            np.diff(self.indptr[start:max(stop, start)+1]))
+        distances[rows, self.indices[first:last]] = (self.values[first:last]
+                                                        /RESOLUTION)
+        return distances
+
+    def hit_counts(self):
+        '''Returns the number of regions with a hit for each motif'''
+        if self.dense is not None:
+            return np.count_nonzero(self.dense != NO_HIT, axis=1)
+        return np.diff(self.indptr)
+
+    def to_dense(self):
+        '''Returns a DistanceMatrix using the dense backend'''
+        if self.dense is not None:
+            return self
+        return DistanceMatrix.from_rows(self, backend='dense')
+
+    def to_sparse(self):
+        '''Returns a DistanceMatrix using the sparse backend'''
+        if self.dense is None:
+            return self
+        return DistanceMatrix.from_rows(self, backend='sparse')
+
+    def save(self, directory):
+        '''Writes the matrix to a directory as .npy files (one per stored 
+            array) and a motifs.txt file so that it can be memory-mapped by
+            load
+
+        Parameters
+        ----------
+        directory : pathlib.Path
+            full path to a directory to write to. Created if it doesn't exist.
+        '''
+        directory.mkdir(exist_ok=True, parents=True)
+        for array_file in directory.glob('*.npy'):
+            array_file.unlink()
+        (directory / 'motifs.txt').write_text(''.join(motif + '\n' 
+                                                for motif in self.motifs))
+        (directory / 'regions.txt').write_text(str(self.regions) + '\n')
+        if self.dense is not None:
+            np.save(directory / 'dense.npy', self.dense)
+        else:
+            np.save(directory / 'indptr.npy', self.indptr)
+            np.save(directory / 'indices.npy', self.indices)
+            np.save(directory / 'values.npy', self.values)
+
+#==============================================================================
+class HitMatrix(object):
+    '''All motif hits within each region for all scanned motifs. Hits are
+        stored in compressed sparse row format so that memory scales with the
+        number of hits: hits for the motif in row i are indptr[i]:indptr[i+1]
+        of the indices (region), values (distance), scores and strands arrays
+        sorted by region and then distance. Regions are in ranked order.
+
+    Parameters
+    ----------
+    motifs : list
+        motif names, one for each row
+    regions : int
+        number of regions
+    indptr : np.ndarray
+        row pointers into the hit arrays
+    indices : np.ndarray
+        int32 region index of each hit
+    values : np.ndarray
+        int32 distance of each hit in units of 1/RESOLUTION bp
+    scores : np.ndarray
+        float32 score of each hit
+    strands : np.ndarray
+        int8 strand of each hit. 1 (+), -1 (-) or 0 if unknown.
+    '''
+    def __init__(self, motifs=None, regions=None, indptr=None, indices=None,
+                    values=None, scores=None, strands=None):
+        self.motifs = list(motifs)
+        self.regions = int(regions)
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.scores = scores
+        self.strands = strands
+        self._motif_index = dict((motif, i) for i, motif
+                                    in enumerate(self.motifs))
+
+    @classmethod
+    def from_rows(cls, rows, regions=None):
+        '''Creates a HitMatrix from (motif, hits) rows as returned by 
+            scanner.merged_scan
+
+        Parameters
+        ----------
+        rows : list
+            (motif, (region indexes, distances, scores, strands)) tuples with
+            distances in bp
+        regions : int
+            number of regions
+
+        Returns
+        -------
+        hit_matrix : HitMatrix
+        '''
+        motifs = list()
+        indices = list()
+        values = list()
+        scores = list()
+        strands = list()
+        for motif, (row_indices, row_distances, row_scores, 
+                    row_strands) in rows:
+            row_values = np.round(np.asarray(row_distances, 
+                                            dtype=float)*RESOLUTION)
+            order = np.lexsort((row_values, row_indices))
+            motifs.append(motif)
+            indices.append(np.asarray(row_indices, dtype=np.int32)[order])
+            values.append(row_values.astype(np.int32)[order])
+            scores.append(np.asarray(row_scores, dtype=np.float32)[order])
+            strands.append(np.asarray(row_strands, dtype=np.int8)[order])
+        indptr = np.zeros(len(motifs)+1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in indices])
+
+        return cls(motifs=motifs, regions=regions, indptr=indptr, 
+                    indices=np.concatenate([np.zeros(0, dtype=np.int32)] 
+                                            + indices),
+                    values=np.concatenate([np.zeros(0, dtype=np.int32)] 
+                                            + values),
+                    scores=np.concatenate([np.zeros(0, dtype=np.float32)] 
+                                            + scores),
+                    strands=np.concatenate([np.zeros(0, dtype=np.int8)] 
+                                            + strands))
+
+    @property
+    def shape(self):
+        return (len(self.motifs), self.regions)
+
+    @property
+    def nbytes(self):
+        '''Memory used by the stored arrays in bytes'''
+        return (self.indptr.nbytes + self.indices.nbytes + self.values.nbytes
+                + self.scores.nbytes + self.strands.nbytes)
+
+    def __len__(self):
+        return len(self.motifs)
+
+    def __contains__(self, motif):
+        return motif in self._motif_index
+
+    def __iter__(self):
+        for i, motif in enumerate(self.motifs):
+            yield motif, self.row(i)
+
+    def __getitem__(self, motif):
+        return self.row(self._motif_index[motif])
+
+    def row(self, i):
+        '''Returns all hits for the motif in row i
+
+        Returns
+        -------
+        hits : tuple
+            (region indexes, distances in bp, scores, strands) arrays
+        '''
+        start, stop = self.indptr[i], self.indptr[i+1]
+        return (np.asarray(self.indices[start:stop]), 
+                self.values[start:stop]/RESOLUTION,
+                np.asarray(self.scores[start:stop]), 
+                np.asarray(self.strands[start:stop]))
+
+    def hit_counts(self):
+        '''Returns the total number of hits for each motif'''
+        return np.diff(self.indptr)
+
+    def counts(self, i):
+        '''Returns the number of hits within each region for the motif in 
+            row i
+        '''
+        start, stop = self.indptr[i], self.indptr[i+1]
+        return np.bincount(self.indices[start:stop], minlength=self.regions)
+
+    def summary(self, retain='best'):
+        '''Summarizes the hits within each region as a single distance
+
+        Parameters
+        ----------
+        retain : str
+            'best' keeps the highest scoring hit (ties are broken by the 
+            lowest distance, as in scanning), 'closest' keeps the hit closest
+            to the region center (ties are broken by the highest score) and 
+            'average' is the mean absolute distance of all hits.
+
+        Returns
+        -------
+        distance_matrix : DistanceMatrix
+        '''
+        if retain not in HIT_SUMMARIES:
+            raise exceptions.InputError("Hit summary not recognized: " 
+                                        + str(retain))
+        indptr = np.zeros(len(self.motifs)+1, dtype=np.int64)
+        indices = list()
+        values = list()
+        for i in range(len(self.motifs)):
+            start, stop = self.indptr[i], self.indptr[i+1]
+            row_indices = np.asarray(self.indices[start:stop])
+            row_values = np.asarray(self.values[start:stop])
+            row_scores = np.asarray(self.scores[start:stop])
+            if retain == 'best':
+                order = np.lexsort((row_values, -row_scores, row_indices))
+            elif retain == 'closest':
+                order = np.lexsort((row_values, -row_scores, 
+                                    np.abs(row_values), row_indices))
+            else:
+                order = np.arange(len(row_indices))
+            row_indices = row_indices[order]
+            first = np.ones(len(row_indices), dtype=bool)
+            first[1:] = row_indices[1:] != row_indices[:-1]
+            if retain == 'average':
+                starts = np.flatnonzero(first)
+                #Hits on opposite sides of the center must not cancel out
+                sums = np.add.reduceat(np.abs(row_values.astype(np.int64)), 
+                                        starts)
+                row_values = np.round(sums/np.diff(np.append(starts, 
+                                        len(row_indices)))).astype(np.int32)
+            else:
+                row_values = row_values[order][first]
+            indices.append(row_indices[first])
+            values.append(row_values)
+            indptr[i+1] = indptr[i] + len(indices[-1])
+
+        distances = DistanceMatrix(motifs=self.motifs, regions=self.regions,
+                            indptr=indptr, 
+                            indices=np.concatenate([np.zeros(0, dtype=np.int32)]
+                                                    + indices),
+                            values=np.concatenate([np.zeros(0, dtype=np.int32)]
+                                                    + values))
+        if indptr[-1]*2 >= len(self.motifs)*self.regions:
+            return distances.to_dense()
+        return distances
+
+    def save(self, directory):
+        '''Writes the matrix to a directory as .npy files so that it can be
+            memory-mapped by load (see DistanceMatrix.save)
+        '''
+        directory.mkdir(exist_ok=True, parents=True)
+        for array_file in directory.glob('*.npy'):
+            array_file.unlink()
+        (directory / 'motifs.txt').write_text(''.join(motif + '\n' 
+                                                for motif in self.motifs))
+        (directory / 'regions.txt').write_text(str(self.regions) + '\n')
+        for name in ['indptr', 'indices', 'values', 'scores', 'strands']:
+            np.save(directory / (name + '.npy'), getattr(self, name))
+
+#Functions
+#==============================================================================
+def load(directory, mmap_mode='r'):
+    '''Reads a DistanceMatrix written by DistanceMatrix.save or a HitMatrix
+        written by HitMatrix.save
+
+    Parameters
+    ----------
+    directory : pathlib.Path
+        full path to a directory written by DistanceMatrix.save
+    mmap_mode : str or None
+        passed to np.load. By default arrays are memory-mapped read-only so
+        that only the rows that are used are read from disk.
+
+    Returns
+    -------
+    distance_matrix : DistanceMatrix or HitMatrix
+    '''
+    if not (directory / 'motifs.txt').exists():
+        raise exceptions.FileEmptyError("No DistanceMatrix found in " 
+                                        + str(directory))
+    motifs = (directory / 'motifs.txt').read_text().split('\n')[:-1]
+    regions = int((directory / 'regions.txt').read_text())
+    if (directory / 'dense.npy').exists():
+        return DistanceMatrix(motifs=motifs, regions=regions, 
+                                dense=np.load(directory / 'dense.npy', 
+                                                mmap_mode=mmap_mode))
+    if (directory / 'scores.npy').exists():
+        return HitMatrix(motifs=motifs, regions=regions, 
+                            **dict((name, np.load(directory / (name + '.npy'),
+                                                    mmap_mode=mmap_mode))
+                                    for name in ['indptr', 'indices', 'values',
+                                                'scores', 'strands']))
+    return DistanceMatrix(motifs=motifs, regions=regions, 
+                            indptr=np.load(directory / 'indptr.npy', 
+                                            mmap_mode=mmap_mode),
+                            indices=np.load(directory / 'indices.npy', 
+                                            mmap_mode=mmap_mode),
+                            values=np.load(directory / 'values.npy', 
+                                            mmap_mode=mmap_mode))
+
+#==============================================================================
+def encode(distances):
+    '''Converts distances (in bp) into an int32 array with NO_HIT for regions
+        without a hit
+
+    Parameters
+    ----------
+    distances : list or np.ndarray
+        distances with '.' or np.nan for regions without a hit
+
+    Returns
+    -------
+    encoded : np.ndarray
+        int32 distances in units of 1/RESOLUTION bp
+    '''
+    if not isinstance(distances, np.ndarray):
+        distances = np.array([np.nan if x == '.' else x for x in distances],
+                                dtype=float)
+    distances = np.asarray(distances, dtype=float)
+    hits = ~np.isnan(distances)
+    encoded = np.full(len(distances), NO_HIT, dtype=np.int32)
+    encoded[hits] = np.round(distances[hits]*RESOLUTION)
+    return encoded
+
+#==============================================================================
+def decode(encoded):
+    '''Converts an int32 array of encoded distances back into distances (in bp)
+        with np.nan for regions without a hit
+    '''
+    distances = encoded/RESOLUTION
+    distances[encoded == NO_HIT] = np.nan
+    return distances
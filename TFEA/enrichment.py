@@ -34,6 +34,25 @@ from TFEA import config
 from TFEA import multiprocess
 from TFEA import plot
 from TFEA import exceptions
+from TFEA import motif_index
+
+#Constants
+#==============================================================================
+#Maximum number of permuted values held in memory at once when simulating
+#AUC null distributions
+PERMUTATION_BLOCK = 2**22
+#Permutations only move the hit scores when at most this fraction of regions
+#have a hit (see permute_auc_hits)
+SPARSE_HITS = 0.1
+#Number of Monte Carlo standard errors by which the mean and standard
+#deviation of a partial null distribution may be off when deciding to stop
+#drawing adaptive permutations
+ADAPTIVE_Z = 3.0
+#Maximum number of distances scored at once by auc_matrix
+SCORE_BLOCK = 2**22
+#Number of permutations drawn from each random stream of a motif. Work on a
+#motif is split across processes in multiples of this.
+SEED_BLOCK = 100
 
 #Main Script
 #==============================================================================
@@ -44,9 +63,10 @@ def main(use_config=True, motif_distances=None, md_distances1=None,
             jobid=None, pvals=None, fcs=None, p_cutoff=None, figuredir=None, 
             plotall=False, fimo_motifs=None, meta_profile_dict=None, 
             label1=None, label2=None, dpi=None, motif_fpkm={}, bootstrap=False,
-            gc=None, plot_format=None):
+            gc=None, plot_format=None, enrichment_null='permutation',
+            adaptive_permutations=False, seed=False):
     '''This is the main script of the ENRICHMENT module. It takes as input
-        a list of distances outputted from the SCANNER module and calculates
+        a matrix of distances outputted from the SCANNER module and calculates
         an enrichment score, a p-value, and in some instances an adjusted 
         p-value for each motif.
     
@@ -54,34 +74,40 @@ def main(use_config=True, motif_distances=None, md_distances1=None,
     ----------
     use_config : boolean
         Whether to use a config module to assign variables.
-    motif_distances : list of lists
-        A list containing a list for each motif scanned. For each motif, the 
-        list begins with the motif name as a string and is followed by int
-        values corresponding to the motif distance for each region (ranked). A
-        '.' value means the motif was not within the given region
-    md_distances1 : list of lists
-        A list containing a list for each motif scanned. For each motif, the 
-        list begins with the motif name as a string and is followed by int
-        values corresponding to the motif distance for each region (ranked). A
-        '.' value means the motif was not within the given region
-    md_distances2 : list of lists
-        A list containing a list for each motif scanned. For each motif, the 
-        list begins with the motif name as a string and is followed by int
-        values corresponding to the motif distance for each region (ranked). A
-        '.' value means the motif was not within the given region
+    motif_distances : DistanceMatrix
+        A motif x region matrix of motif distances for each region (ranked)
+        created by the SCANNER module
+    md_distances1 : DistanceMatrix
+        A motif x region matrix of motif distances for md_fasta1 regions
+    md_distances2 : DistanceMatrix
+        A motif x region matrix of motif distances for md_fasta2 regions
     enrichment : str
-        The type of enrichment analysis to perform
+        The type of enrichment analysis to perform. 'auc' scores the area 
+        under the cumulative distance score and 'gsea' the maximum of the 
+        GSEA running sum of hits (see max_GSEA)
     output_type : str
         Determines what some functions will output. At this point, this is mostly
         intended for debug purposes.
     permutations : int
         Number of random shuffling permutations to perform to calculate a 
         p-value
+    enrichment_null : str
+        'permutation' to estimate the null distribution of the AUC from 
+        permutations or 'analytic' to compute its mean and standard deviation
+        exactly (see auc_moments)
+    adaptive_permutations : int or False
+        If given, permutations are drawn in growing batches starting at this
+        size and stop early for motifs that are not significant (see 
+        permute_auc_adaptive). permutations is then the maximum.
+    seed : int or False
+        Seed for the random streams of each motif (see seed_stream). If
+        False, fresh entropy is used.
     debug : boolean
         Whether to print debug statements specifically within the multiprocess
         module
     largewindow : int
-        A distance cutoff value used within auc_bgcorrect
+        A distance cutoff value. Regions with a motif within this distance 
+        are hits for 'gsea'.
     smallwindow : int
         A distance cutoff value used within the md score analysis
     
@@ -101,6 +127,9 @@ def main(use_config=True, motif_distances=None, md_distances1=None,
         mdd_distances2 = config.vars['MDD_DISTANCES2']
         enrichment = config.vars['ENRICHMENT']
         permutations = config.vars['PERMUTATIONS']
+        enrichment_null = config.vars['ENRICHMENT_NULL']
+        adaptive_permutations = config.vars['ADAPTIVE_PERMUTATIONS']
+        seed = config.vars['SEED']
         debug = config.vars['DEBUG']
         largewindow = config.vars['LARGEWINDOW']
         smallwindow = config.vars['SMALLWINDOW']
@@ -128,45 +157,104 @@ def main(use_config=True, motif_distances=None, md_distances1=None,
 
     print("Calculating enrichment...", flush=True, file=sys.stderr)
 
+    if fimo_motifs:
+        #Load the motif index once so that forked workers share it
+        motif_index.load(motifdatabase=fimo_motifs)
+
     results = None
     md_results = None
     mdd_results = None
 
     if enrichment == 'auc':
+        print('\tCalculating E-Score:', file=sys.stderr)
+        tests = len(motif_distances)
+        seed_sequence = np.random.SeedSequence(None if seed is False else seed)
+        streams = dict((motif, seed_stream(seed_sequence=seed_sequence, i=i))
+                        for i, motif in enumerate(motif_distances.motifs))
+        auc_results = auc_table(motif_distances=motif_distances, 
+                                fimo_motifs=fimo_motifs, motif_fpkm=motif_fpkm)
+        sim_aucs = dict()
+        if enrichment_null != 'analytic' or bootstrap:
+            motifs = [result[0] for result in auc_results
+                        if not np.isnan(result[5])]
+            #Split the permutations of each motif across processes if there
+            #are fewer motifs than processes
+            chunk_size = permutations
+            if not adaptive_permutations and not bootstrap and len(motifs) != 0:
+                chunks = -(-cpus // len(motifs))
+                chunk_size = -(-permutations // (chunks*SEED_BLOCK))*SEED_BLOCK
+            tasks = list()
+            for motif in motifs:
+                distances = motif_distances[motif]
+                for start in range(0, permutations, chunk_size):
+                    tasks.append((motif, distances, streams[motif], start,
+                                    min(start + chunk_size, permutations)))
+            auc_keywords = dict(bootstrap=bootstrap,
+                                adaptive=adaptive_permutations, tests=tests,
+                                p_cutoff=p_cutoff)
+            nulls = multiprocess.main(function=auc_null, args=tasks,
+                                        kwargs=auc_keywords, debug=debug,
+                                        jobid=jobid, cpus=cpus)
+            chunks = dict((motif, list()) for motif in motifs)
+            for motif, start, sim_auc in sorted(nulls, key=lambda x: x[:2]):
+                chunks[motif].append(sim_auc)
+            for result in auc_results:
+                if result[0] in chunks:
+                    sim_auc = np.concatenate(chunks[result[0]])
+                    sim_aucs[result[0]] = sim_auc
+                    result[5:] = [np.mean(sim_auc), np.std(sim_auc),
+                                    len(sim_auc)]
+
         gc_correct = {}
         linear_regression = None
         if gc:
             print('\tCorrecting GC:', file=sys.stderr)
-            auc_keywords = dict(fimo_motifs=fimo_motifs)
-            motif_gc_auc = multiprocess.main(function=get_auc_gc, 
-                                        args=motif_distances, kwargs=auc_keywords,
-                                        debug=debug, jobid=jobid, cpus=cpus)
-
-            #Calculate linear regression based on AUC and GC content of motifs
-            varx = np.array([i[2] for i in motif_gc_auc])
-            vary = np.array([i[1] for i in motif_gc_auc])
-            mask = ~np.isnan(varx) & ~np.isnan(vary)
-            linear_regression = [x for x in stats.linregress(varx[mask], vary[mask])]
-            slope, intercept, _, _, _ = linear_regression
-            for key, _, gc in motif_gc_auc:
-                offset = slope*gc + intercept
-                gc_correct[key] = offset
-
-
-        print('\tCalculating E-Score:', file=sys.stderr)
-        # manager = Manager()
-        # meta_profile_dict = manager.dict(meta_profile_dict)
-        auc_keywords = dict(permutations=permutations, use_config=use_config, 
-                        output_type=output_type, pvals=pvals, plotall=plotall, 
-                        p_cutoff=p_cutoff, figuredir=figuredir, 
-                        largewindow=largewindow, fimo_motifs=fimo_motifs, 
-                        meta_profile_dict=meta_profile_dict, label1=label1, 
-                        label2=label2, fcs=fcs, motif_fpkm=motif_fpkm, 
-                        tests=len(motif_distances), bootstrap=bootstrap, 
-                        gc_correct=gc_correct, plot_format=plot_format)
-        results = multiprocess.main(function=auc_simulate_and_plot, 
-                                    args=motif_distances, kwargs=auc_keywords,
-                                    debug=debug, jobid=jobid, cpus=cpus)
+            gc_correct, linear_regression = gc_regression(
+                results=[[motif, auc if not np.isnan(mu) else np.nan, motif_gc]
+                            for motif, auc, _, motif_gc, _, mu, _, _ 
+                            in auc_results])
+
+        results = [auc_pvalues(result, offset=gc_correct.get(result[0], 0), 
+                                tests=tests) for result in auc_results]
+
+        #Adaptive permutations stop based on the E-score before GC 
+        #correction, so motifs whose corrected E-score may be significant are
+        #resampled. Plotted motifs are shown with the null their p-value 
+        #was calculated from.
+        redo = dict()
+        for (motif, _, _, _, _, mu, sigma, drawn), result in zip(auc_results, 
+                                                                results):
+            resample = bool(adaptive_permutations and not bootstrap 
+                            and motif in gc_correct and 0 < drawn < permutations
+                            and not not_significant(aucs=[result[2]], mu=mu, 
+                                                    sigma=sigma, 
+                                                    permutations=drawn, 
+                                                    tests=tests, 
+                                                    p_cutoff=p_cutoff))
+            plot_motif = bool(not np.isnan(mu) and (plotall 
+                                or (output_type=='html' and result[6] < p_cutoff)))
+            if resample or plot_motif:
+                redo[motif] = (result, gc_correct.get(motif, 0), resample,
+                                plot_motif, streams[motif], 
+                                None if resample else sim_aucs.get(motif))
+        if len(redo) != 0:
+            print('\tResampling and plotting:', file=sys.stderr)
+            plot_keywords = dict(use_config=use_config, 
+                                permutations=permutations, pvals=pvals, 
+                                figuredir=figuredir, largewindow=largewindow, 
+                                fimo_motifs=fimo_motifs, 
+                                meta_profile_dict=meta_profile_dict, 
+                                label1=label1, label2=label2, fcs=fcs, 
+                                tests=tests, p_cutoff=p_cutoff, 
+                                adaptive=adaptive_permutations, 
+                                bootstrap=bootstrap, plot_format=plot_format)
+            redone = multiprocess.main(function=auc_resample_and_plot, 
+                                        args=[((motif, motif_distances[motif]),)
+                                                + redo[motif] for motif in redo], 
+                                        kwargs=plot_keywords, debug=debug, 
+                                        jobid=jobid, cpus=cpus)
+            redone = dict((result[0], result) for result in redone)
+            results = [redone.get(result[0], result) for result in results]
                                     
         plot.plot_global_gc(results, p_cutoff=p_cutoff, 
                                 title='TFEA GC-Plot', 
@@ -181,6 +269,45 @@ def main(use_config=True, motif_distances=None, md_distances1=None,
                                 p_index=-1,
                                 ylimits=[-1,1])
 
+    elif enrichment == 'gsea':
+        print('\tCalculating max GSEA enrichment score:', file=sys.stderr)
+        tests = len(motif_distances)
+        seed_sequence = np.random.SeedSequence(None if seed is False else seed)
+        gsea_results = gsea_table(motif_distances=motif_distances, 
+                                    cutoff=largewindow, fimo_motifs=fimo_motifs,
+                                    motif_fpkm=motif_fpkm)
+        tasks = [(motif, motif_distances[motif], 
+                    seed_stream(seed_sequence=seed_sequence, i=i))
+                    for i, (motif, es, _, _, _) in enumerate(gsea_results)
+                    if not np.isnan(es)]
+        gsea_keywords = dict(cutoff=largewindow, permutations=permutations)
+        sim_es = dict(multiprocess.main(function=gsea_null, args=tasks, 
+                                        kwargs=gsea_keywords, debug=debug, 
+                                        jobid=jobid, cpus=cpus))
+
+        gc_correct = {}
+        linear_regression = None
+        if gc:
+            print('\tCorrecting GC:', file=sys.stderr)
+            gc_correct, linear_regression = gc_regression(
+                results=[[motif, es, motif_gc] 
+                            for motif, es, _, motif_gc, _ in gsea_results])
+
+        results = [gsea_pvalues(result, sim_es=sim_es.get(result[0]), 
+                                offset=gc_correct.get(result[0], 0), 
+                                tests=tests) for result in gsea_results]
+        plot.plot_global_gc(results, p_cutoff=p_cutoff, 
+                                title='TFEA GC-Plot', 
+                                xlabel='Motif GC-content',
+                                ylabel='Non-corrected Enrichment Score', 
+                                savepath=figuredir / ('TFEA_GC.' + plot_format), 
+                                linear_regression=linear_regression,
+                                plot_format=plot_format, 
+                                x_index=4,
+                                y_index=1, 
+                                c_index=2,
+                                p_index=-1,
+                                ylimits=[-1,1])
         
         # results = list()
         # for motif_distance in motif_distances:
@@ -244,7 +371,9 @@ def calculate_md(md_distances1=None, md_distances2=None, smallwindow=None,
                     jobid=None, cpus=None, debug=None):
     md_keywords = dict(smallwindow=smallwindow)
     md_results = multiprocess.main(function=md_score, 
-                    args=list(zip(sorted(md_distances1),sorted(md_distances2))), 
+                    args=[((motif, distances1), (motif, md_distances2[motif]))
+                            for motif, distances1 in md_distances1
+                            if motif in md_distances2], 
                     kwargs=md_keywords,
                     debug=debug, jobid=jobid, cpus=cpus)
 
@@ -254,163 +383,315 @@ def calculate_md(md_distances1=None, md_distances2=None, smallwindow=None,
 
 #Functions
 #==============================================================================
-def get_auc_gc(distances, fimo_motifs=None):
-    '''Calculates an enrichment score using the area under the curve. This
-        method is not as sensitive to artifacts as other methods. It works well
-        as an asymmetry detector and will be good at picking up cases where
-        most of the motif localization changes happen at the most differentially
-        transcribed regions.
+def auc_table(motif_distances=None, fimo_motifs=None, motif_fpkm=None):
+    '''Calculates the E-score, hit count and exact null moments (see 
+        auc_moments) of every motif, scoring blocks of motifs at once with
+        auc_matrix
+
+    Parameters
+    ----------
+    motif_distances : DistanceMatrix
+        motif x region distances
+
+    Returns
+    -------
+    results : list
+        [motif, auc, hits, gc, fpkm, mu, sigma, 0] for each motif. auc is 0
+        and mu and sigma are np.nan if the AUC is undefined.
     '''
-    try:
-        #sort distances based on the ranks from TF bed file
-        #and calculate the absolute distance
-        motif = distances[0]
-        if fimo_motifs is not None:
-            gc = get_gc(motif=motif, motif_database=fimo_motifs)
-        nan = float('Nan')
-        distances = distances[1:]
-        distances_abs = [abs(x)  if x != '.' else x for x in distances]
-
-        hits = len([x for x in distances_abs if x != '.'])
-
-        #Filter any TFs/files without any hits
-        if hits == 0:
-            return [motif, nan, gc]
-
-        #Get -exp() of distance and get cumulative scores
-        #Filter distances into quartiles to get middle distribution
-        q1 = int(round(len(distances)*.25))
-        q3 = int(round(len(distances)*.75))
-        middledistancehist =  [x for x in distances_abs[int(q1):int(q3)] if x != '.']
-        try:
-            average_distance = float(sum(middledistancehist))/float(len(middledistancehist))
-        except ZeroDivisionError:
-            return [motif, nan, gc]
-        
-        score = [math.exp(-float(x)/average_distance) if x != '.' else 0.0 for x in distances_abs]
-        total = sum(score)
+    nan = float('Nan')
+    regions = motif_distances.regions
+    block_size = max(1, SCORE_BLOCK // max(regions, 1))
+    results = list()
+    for start in range(0, len(motif_distances), block_size):
+        hits, _, score, aucs = auc_matrix(motif_distances.rows(start, 
+                                                    start + block_size))
+        mus, sigmas = auc_moments(distances=score/regions, 
+                                    trend=auc_trend(regions)/regions)
+        for i, motif in enumerate(motif_distances.motifs[start:start+block_size]):
+            gc = nan
+            if fimo_motifs:
+                gc = get_gc(motif=motif, motif_database=fimo_motifs)
+            if np.isnan(aucs[i]):
+                results.append([motif, 0, int(hits[i]), gc, 
+                                motif_fpkm.get(motif, nan), nan, nan, 0])
+            else:
+                results.append([motif, aucs[i], int(hits[i]), gc, 
+                                motif_fpkm.get(motif, nan), mus[i], sigmas[i], 
+                                0])
 
-        binwidth = 1.0/float(len(distances_abs))
-        normalized_score = [(float(x)/total)*binwidth for x in score]
-        cumscore = np.cumsum(normalized_score)
-        trend = np.append(np.arange(0,1,1.0/float(len(cumscore) - 1)), 1.0)
-        trend = [x*binwidth for x in trend]
+    return results
 
-        #The AUC is the relative to the "random" line
-        auc = (np.trapz(cumscore) - np.trapz(trend))*2
+#==============================================================================
+def auc_matrix(distances):
+    '''Calculates the score of each region and the area under the curve (AUC)
+        of the cumulative score for many motifs at once. Scores are 
+        exp(-distance/average distance) for regions with a hit, where the 
+        average is taken over hits in the middle two quartiles of regions.
 
-    except Exception as e:
-        # This prints the type, value, and stack trace of the
-        # current exception being handled.
-        print(traceback.print_exc())
-        raise e
-    return [motif, auc, gc]
-
-#==============================================================================
-def auc_simulate_and_plot(distances, use_config=True, output_type=None, 
-                        permutations=None, pvals=None,
-                        plotall=None, p_cutoff=None, figuredir=None, 
-                        largewindow=None, fimo_motifs=None, 
-                        meta_profile_dict=None, label1=None, label2=None, 
-                        dpi=None, fcs=None, tests=None, motif_fpkm=None, 
-                        bootstrap=False, gc_correct=None, plot_format=None):
-    '''Calculates an enrichment score using the area under the curve. This
-        method is not as sensitive to artifacts as other methods. It works well
-        as an asymmetry detector and will be good at picking up cases where
-        most of the motif localization changes happen at the most differentially
-        transcribed regions.
+    Parameters
+    ----------
+    distances : array
+        motif x region distances (bp) with np.nan for regions without a hit
+
+    Returns
+    -------
+    hits : array
+        number of regions with a hit for each motif
+    averages : array
+        average distance of hits in the middle two quartiles of regions.
+        np.nan if there are none, in which case the AUC is undefined.
+    score : array
+        score of each region normalized to sum to 1 for each motif. Zero for
+        motifs with an undefined AUC.
+    aucs : array
+        the AUC of each motif relative to a uniform distribution of hits
+        (see auc_trend). np.nan if undefined.
+    '''
+    score = np.abs(np.asarray(distances, dtype=float))
+    no_hit = np.isnan(score)
+    hits = score.shape[1] - np.count_nonzero(no_hit, axis=1)
+    motifs, n = score.shape
+
+    #Filter distances into quartiles to get middle distribution
+    q1 = int(round(n*.25))
+    q3 = int(round(n*.75))
+    counts = (q3 - q1) - np.count_nonzero(no_hit[:, q1:q3], axis=1)
+    totals = np.nansum(score[:, q1:q3], axis=1)
+    defined = counts != 0
+    averages = np.full(motifs, np.nan)
+    averages[defined] = totals[defined]/counts[defined]
+
+    #Get -exp() of distance and get cumulative scores. Distances are 
+    #replaced by scores in place to limit memory. Motifs with an undefined
+    #AUC get a scale of 0 and are zeroed when normalizing.
+    scale = np.zeros(motifs)
+    scale[defined] = -1.0/averages[defined]
+    np.multiply(score, scale[:, None], out=score)
+    np.exp(score, out=score)
+    np.copyto(score, 0, where=no_hit)
+    totals = np.sum(score, axis=1)
+    scale = np.zeros(motifs)
+    scale[defined] = 1.0/totals[defined]
+    np.multiply(score, scale[:, None], out=score)
+
+    #The AUC is the relative to the "random" line
+    aucs = np.full(motifs, np.nan)
+    if n != 0:
+        aucs[defined] = (np.dot(score[defined], auc_weights(n)) 
+                            - trapz(auc_trend(n)))*2/n
+
+    return hits, averages, score, aucs
+
+#==============================================================================
+def auc_trend(n):
+    '''Returns the cumulative score of n regions that all have the same 
+        score, from 0 to 1'''
+    return np.append(np.arange(0,1,1.0/float(n - 1)), 1.0)
+
+#==============================================================================
+def auc_score(distances):
+    '''Calculates the score of each region and the AUC for a single motif
+        (see auc_matrix)
+
+    Parameters
+    ----------
+    distances : array
+        distances (bp) of a motif to each region with np.nan for regions 
+        without a hit
+
+    Returns
+    -------
+    hits : int
+        number of regions with a hit
+    score : array or None
+        score of each region normalized to sum to 1. None if the AUC is 
+        undefined (no hits in the middle two quartiles).
+    normalized_score : array
+        score multiplied by the width of a region on the x axis
+    trend : array
+        the cumulative score of a uniform distribution of hits
+    auc : float
+        the AUC relative to trend
+    '''
+    hits, _, score, aucs = auc_matrix(np.asarray(distances, dtype=float)[None])
+    if np.isnan(aucs[0]):
+        return int(hits[0]), None, None, None, None
+    binwidth = 1.0/float(len(distances))
+
+    return (int(hits[0]), score[0], score[0]*binwidth, 
+            auc_trend(len(distances))*binwidth, aucs[0])
+
+#==============================================================================
+def auc_null(task, bootstrap=False, adaptive=False, tests=None, p_cutoff=None):
+    '''Simulates the null distribution of the E-score of a single motif from
+        a range of permutations of its regions (see permute_auc_range). If
+        adaptive is a batch size, permutations stop early once the E-score is
+        confidently not significant (see permute_auc_adaptive).
+
+    Parameters
+    ----------
+    task : tuple
+        (motif, distances, seed_sequence, start, stop)
+
+    Returns
+    -------
+    result : list
+        [motif, start, AUC of each permutation drawn]
     '''
     try:
-        #sort distances based on the ranks from TF bed file
-        #and calculate the absolute distance
-        motif = distances[0]
-        nan = float('Nan')
-        gc = nan
-        if fimo_motifs:
-            gc = get_gc(motif=motif, motif_database=fimo_motifs)
-        else:
-            gc = nan
-        try:
-            fpkm = motif_fpkm[motif]
-        except KeyError:
-            fpkm = nan
-        distances = distances[1:]
-        distances_abs = [abs(x)  if x != '.' else x for x in distances]
-
-        hits = len([x for x in distances_abs if x != '.'])
-
-        #Filter any TFs/files without any hits
-        if hits == 0:
-            return [motif, 0, 0, hits, gc, fpkm, 0, 0]
-
-        #Get -exp() of distance and get cumulative scores
-        #Filter distances into quartiles to get middle distribution
-        q1 = int(round(len(distances)*.25))
-        q3 = int(round(len(distances)*.75))
-        middledistancehist =  [x for x in distances_abs[int(q1):int(q3)] if x != '.']
-        #In the case where there are no hits in the middle two quartiles, then
-        #don't perform computation
-        if len(middledistancehist) == 0:
-            return [motif, 0, 0, hits, gc, fpkm, 0, 0]
-        try:
-            average_distance = np.mean(middledistancehist)#float(sum(middledistancehist))/float(len(middledistancehist))
-        except ZeroDivisionError:
-            return [motif, 0, 0, hits, gc, fpkm, 0, 0]
-        
-        score = [math.exp(-float(x)/average_distance) if x != '.' else 0.0 for x in distances_abs]
-        total = np.sum(score)
-
-        binwidth = 1.0/float(len(distances_abs))
-        normalized_score = np.multiply(np.divide(score, total), binwidth)
-        #[(float(x)/total)*binwidth for x in score]
-        cumscore = np.cumsum(normalized_score)
-        trend = np.append(np.arange(0,1,1.0/float(len(cumscore) - 1)), 1.0)
-        trend = np.multiply(trend, binwidth)
-        # trend = [x*binwidth for x in trend]
-
-        #The AUC is the relative to the "random" line
-        auc = (np.trapz(cumscore) - np.trapz(trend))*2
-        offset = 0
-        if motif in gc_correct:
-            offset = gc_correct[motif]
-        corrected_auc = auc - offset
+        motif, distances, seed_sequence, start, stop = task
+        _, _, normalized_score, trend, auc = auc_score(distances)
 
         #Calculate random AUC
         if bootstrap:
-            sim_auc = permute_auc_bootstrap(original_distances=distances, trend=trend, 
-                                permutations=permutations, bootstrap=bootstrap)
+            sim_auc = permute_auc_bootstrap(original_distances=distances, trend=trend,
+                                permutations=stop-start, bootstrap=bootstrap,
+                                rng=np.random.default_rng(seed_sequence))
+        elif adaptive:
+            sim_auc = permute_auc_adaptive(distances=normalized_score,
+                                            trend=trend, permutations=stop,
+                                            batch=adaptive, aucs=[auc],
+                                            tests=tests, p_cutoff=p_cutoff,
+                                            seed_sequence=seed_sequence)
         else:
-            sim_auc = permute_auc(distances=normalized_score, trend=trend, 
-                                permutations=permutations)
+            sim_auc = permute_auc_range(distances=normalized_score,
+                                        trend=trend, start=start, stop=stop,
+                                        seed_sequence=seed_sequence)
+    except Exception as e:
+        # This prints the type, value, and stack trace of the
+        # current exception being handled.
+        print(traceback.print_exc())
+        raise e
+    return [motif, start, np.asarray(sim_auc)]
+
+#==============================================================================
+def auc_pvalues(result, offset=0, tests=None):
+    '''Calculates Bonferroni corrected p-values of the E-score before and
+        after GC correction from the null mean and standard deviation
 
-        #Calculate p-value
-        mu = np.mean(sim_auc)
-        sigma = np.std(sim_auc)
-        p = min(stats.norm.logcdf(auc,mu,sigma), stats.norm.logsf(auc,mu,sigma))
+    Parameters
+    ----------
+    result : list
+        output of auc_null
+    offset : float
+        the E-score expected from the GC content of the motif
+
+    Returns
+    -------
+    result : list
+        [motif, auc, corrected_auc, hits, gc, fpkm, p, corrected_p] with 
+        p-values as log10
+    '''
+    motif, auc, hits, gc, fpkm, mu, sigma, _ = result
+    if np.isnan(mu):
+        return [motif, 0, 0, hits, gc, fpkm, 0, 0]
+    corrected_auc = auc - offset
+
+    pvalues = list()
+    for x in [auc, corrected_auc]:
+        p = min(stats.norm.logcdf(x,mu,sigma), stats.norm.logsf(x,mu,sigma))
         if math.isnan(p):
             p = 0
         p = p+np.log(tests) if p+np.log(tests) <= 0 else 0
-        p = p*math.log(np.e, 10)
+        pvalues.append(p*math.log(np.e, 10))
+    p, corrected_p = pvalues
 
-        corrected_p = min(stats.norm.logcdf(corrected_auc,mu,sigma), stats.norm.logsf(corrected_auc,mu,sigma))
-        if math.isnan(corrected_p):
-            corrected_p = 0
-        corrected_p = corrected_p+np.log(tests) if corrected_p+np.log(tests) <= 0 else 0
-        corrected_p = corrected_p*math.log(np.e, 10)
+    return [motif, auc, corrected_auc, hits, gc, fpkm, p, corrected_p]
+
+#==============================================================================
+def gc_regression(results=None):
+    '''Fits a linear regression of the enrichment scores of motifs on their
+        GC content
 
-        if plotall or (output_type=='html' and p < p_cutoff):
+    Parameters
+    ----------
+    results : list
+        [motif, score, gc] for each motif. Motifs with a np.nan score or GC
+        content are left out of the fit.
+
+    Returns
+    -------
+    gc_correct : dict
+        the score expected from the GC content of each motif
+    linear_regression : list
+        slope, intercept, r-value, p-value and standard error of the fit
+    '''
+    motifs = [motif for motif, _, _ in results]
+    vary = np.array([score for _, score, _ in results], dtype=float)
+    varx = np.array([motif_gc for _, _, motif_gc in results], dtype=float)
+    mask = ~np.isnan(varx) & ~np.isnan(vary)
+    linear_regression = [x for x in stats.linregress(varx[mask], vary[mask])]
+    slope, intercept, _, _, _ = linear_regression
+    gc_correct = dict((motif, slope*motif_gc + intercept) 
+                        for motif, motif_gc in zip(motifs, varx))
+
+    return gc_correct, linear_regression
+
+#==============================================================================
+def auc_resample_and_plot(distances, use_config=True, permutations=None, 
+                            pvals=None, figuredir=None, largewindow=None, 
+                            fimo_motifs=None, meta_profile_dict=None, 
+                            label1=None, label2=None, fcs=None, tests=None, 
+                            p_cutoff=None, adaptive=False, bootstrap=False,
+                            plot_format=None):
+    '''Draws more permutations for and plots a single motif after GC
+        correction
+
+    Parameters
+    ----------
+    distances : tuple
+        ((motif, distances), result, offset, resample, plot, seed_sequence,
+        sim_auc) where result is the output of auc_pvalues, resample whether
+        to redraw adaptive permutations for both E-scores, plot whether to 
+        plot the motif, seed_sequence the random streams of the motif and 
+        sim_auc the permutations drawn by auc_null. sim_auc is None if no
+        permutations were drawn, in which case they are simulated for the
+        plot.
+
+    Returns
+    -------
+    result : list
+        see auc_pvalues
+    '''
+    try:
+        ((motif, distances), result, offset, resample, plot_motif,
+            seed_sequence, sim_auc) = distances
+        _, score, normalized_score, trend, auc = auc_score(distances)
+        corrected_auc = result[2]
+        if resample:
+            sim_auc = permute_auc_adaptive(distances=normalized_score, 
+                                            trend=trend, 
+                                            permutations=permutations, 
+                                            batch=adaptive, 
+                                            aucs=[auc, corrected_auc],
+                                            tests=tests, p_cutoff=p_cutoff,
+                                            seed_sequence=seed_sequence)
+            result = auc_pvalues(result[:2] + result[3:6] 
+                                    + [np.mean(sim_auc), np.std(sim_auc), 
+                                        len(sim_auc)], 
+                                    offset=offset, tests=tests)
+        elif plot_motif and sim_auc is None and bootstrap:
+            sim_auc = permute_auc_bootstrap(original_distances=distances, 
+                                trend=trend, permutations=permutations, 
+                                bootstrap=bootstrap,
+                                rng=np.random.default_rng(seed_sequence))
+        elif plot_motif and sim_auc is None:
+            sim_auc = permute_auc_range(distances=normalized_score,
+                                        trend=trend, start=0,
+                                        stop=permutations,
+                                        seed_sequence=seed_sequence)
+
+        if plot_motif:
             from TFEA import plot
-            plotting_score = np.divide(score, total)
-            # [(float(x)/total) for x in score]
-            plotting_cumscore = np.cumsum(plotting_score)
             plot.plot_individual_graphs(motif=motif, distances=distances, 
                                         figuredir=figuredir, 
                                         fimo_motifs=fimo_motifs, 
                                         largewindow=largewindow, 
-                                        score=plotting_score, 
+                                        score=score, 
                                         use_config=use_config, 
                                         pvals=pvals, fcs=fcs, 
-                                        cumscore=plotting_cumscore, 
+                                        cumscore=np.cumsum(score), 
                                         sim_auc=sim_auc, auc=auc,
                                         meta_profile_dict=meta_profile_dict, 
                                         label1=label1, label2=label2, 
@@ -420,39 +701,344 @@ def auc_simulate_and_plot(distances, use_config=True, output_type=None,
         # current exception being handled.
         print(traceback.print_exc())
         raise e
-    return [motif, auc, corrected_auc, hits, gc, fpkm, p, corrected_p]
+    return result
 
 #==============================================================================
-def permute_auc(distances=None, trend=None, permutations=None):
+def permute_auc(distances=None, trend=None, permutations=None, rng=np.random):
     '''Generates permutations of the distances and calculates AUC for each 
-        permutation.
+        permutation. The AUC of a cumulative score is linear in the score
+        vector (see auc_weights), so permutations are evaluated in blocks as
+        a single matrix product. Blocks are limited to PERMUTATION_BLOCK
+        values so memory does not grow with the number of permutations.
+        Permutations are drawn as with np.random.permutation(distances), so
+        the null distribution is the same as permuting one at a time. If few
+        regions have a hit, only the hit scores are permuted (see
+        permute_auc_hits).
+
     Parameters
     ----------
     distances : list or array
         normalized distances 
         
+    trend : array
+        the cumulative score of a uniform distribution of hits
+        
     permutations : int
         number of times to permute (default=1000)
+
+    rng : np.random.Generator or np.random
+        source of random numbers. Default: the global np.random state
+
+    Returns
+    -------
+    es_permute : array
+        AUC calculated for each permutation
+
+    '''
+    distances = np.asarray(distances, dtype=float)
+    n = len(distances)
+    weights = auc_weights(n)
+    triangle_area = trapz(trend)
+    hits = distances[distances != 0]
+    if len(hits) <= SPARSE_HITS*n:
+        es = permute_auc_hits(scores=hits, weights=weights,
+                                permutations=permutations, rng=rng)
+        return (es - triangle_area)*2
+
+    block_size = max(1, PERMUTATION_BLOCK // max(n, 1))
+    es_permute = np.zeros(permutations)
+    block = np.empty((min(block_size, permutations), n))
+    for start in range(0, permutations, block_size):
+        stop = min(start + block_size, permutations)
+        for row in block[:stop-start]:
+            row[:] = distances
+            rng.shuffle(row)
+        es = np.dot(block[:stop-start], weights)
+        es_permute[start:stop] = (es - triangle_area)*2
+
+    return es_permute
+
+#==============================================================================
+def permute_auc_adaptive(distances=None, trend=None, permutations=None,
+                            batch=None, aucs=None, tests=None, p_cutoff=None,
+                            seed_sequence=None):
+    '''Draws AUC permutations in batches until the motif is confidently not
+        significant or the maximum number of permutations is reached. The
+        first batch has the given size and each further batch doubles the
+        number drawn. After each batch the Bonferroni corrected p-value is
+        computed with the null mean and standard deviation shifted by 
+        ADAPTIVE_Z standard errors towards significance. If even that p-value
+        is above p_cutoff, no more permutations are drawn.
+
+    Parameters
+    ----------
+    distances : list or array
+        normalized distances 
+
+    trend : array
+        the cumulative score of a uniform distribution of hits
+
+    permutations : int
+        maximum number of permutations
+
+    batch : int
+        number of permutations in the first batch
+
+    aucs : list
+        observed AUCs (e.g. with and without GC correction). Permutations 
+        continue while any of them may be significant.
+
+    tests : int
+        number of motifs tested
+
+    p_cutoff : float
+        natural log of the adjusted p-value cutoff
+
+    seed_sequence : np.random.SeedSequence
+        random streams of the motif (see permute_auc_range). Streams are 
+        drawn once and shared by batches.
+
+    Returns
+    -------
+    es_permute : array
+        AUC calculated for each permutation drawn
+    '''
+    blocks = dict()
+    es_permute = permute_auc_range(distances=distances, trend=trend, start=0,
+                                    stop=min(batch, permutations),
+                                    seed_sequence=seed_sequence, 
+                                    blocks=blocks)
+    while len(es_permute) < permutations:
+        m = len(es_permute)
+        if not_significant(aucs=aucs, mu=np.mean(es_permute), 
+                            sigma=np.std(es_permute), permutations=m, 
+                            tests=tests, p_cutoff=p_cutoff):
+            break
+        es_permute = np.append(es_permute,
+                                permute_auc_range(distances=distances,
+                                                trend=trend, start=m,
+                                                stop=min(2*m, permutations),
+                                                seed_sequence=seed_sequence,
+                                                blocks=blocks))
+
+    return es_permute
+
+#==============================================================================
+def not_significant(aucs=None, mu=None, sigma=None, permutations=None, 
+                    tests=None, p_cutoff=None):
+    '''Returns True if none of the observed AUCs would be significant even if
+        the null mean and standard deviation estimated from a number of 
+        permutations were ADAPTIVE_Z standard errors off towards 
+        significance (see permute_auc_adaptive)
+    '''
+    if permutations < 2:
+        return False
+    deviation = (max(abs(auc - mu) for auc in aucs) 
+                    + ADAPTIVE_Z*sigma/math.sqrt(permutations))
+    sigma_low = sigma*(1 - ADAPTIVE_Z/math.sqrt(2*(permutations - 1)))
+
+    return bool(sigma_low > 0 and stats.norm.logsf(deviation/sigma_low) 
+                                    + np.log(tests) > p_cutoff)
+
+#==============================================================================
+def auc_moments(distances=None, trend=None):
+    '''Calculates the exact mean and standard deviation of the AUC over all
+        permutations of the distances. The AUC is linear in the permuted
+        scores (see auc_weights) and for a linear statistic sum(x[p]*w) over
+        uniform random permutations p of n values, the mean is
+        n*mean(x)*mean(w) and the variance is
+        sum((x - mean(x))**2)*sum((w - mean(w))**2)/(n - 1).
+
+    Parameters
+    ----------
+    distances : list or array
+        normalized distances. If 2D, moments are calculated for each row.
         
+    trend : array
+        the cumulative score of a uniform distribution of hits
+
     Returns
     -------
-    es_permute : list 
-        list of AUC calculated for permutations 
-       
+    mu : float or array
+        mean AUC of the permutation null
+    sigma : float or array
+        standard deviation of the AUC of the permutation null
     '''
+    distances = np.asarray(distances, dtype=float)
+    n = distances.shape[-1]
+    weights = auc_weights(n)
+    mu = (np.sum(distances, axis=-1)*np.mean(weights) - trapz(trend))*2
+    if n < 2:
+        return mu, np.zeros_like(mu)
+    squares = (np.einsum('...i,...i->...', distances, distances) 
+                - np.sum(distances, axis=-1)**2/n)
+    variance = (np.maximum(squares, 0)
+                *np.sum((weights - np.mean(weights))**2)/(n - 1))
+
+    return mu, 2*np.sqrt(variance)
+
+#==============================================================================
+def permute_auc_hits(scores=None, weights=None, permutations=None,
+                        rng=np.random):
+    '''Calculates the area under the cumulative score for permutations of a
+        score vector that is zero outside of a few hits. Permuting such a
+        vector places the hit scores at random distinct positions, so each
+        permutation costs O(k) for k hits instead of O(n) for n regions.
+
+    Parameters
+    ----------
+    scores : array
+        nonzero scores
+        
+    weights : array
+        position weights (see auc_weights)
+        
+    permutations : int
+        number of times to permute
+
+    rng : np.random.Generator or np.random
+        source of random numbers
+
+    Returns
+    -------
+    es_permute : array
+        area under the cumulative score for each permutation
+    '''
+    k = len(scores)
     es_permute = np.zeros(permutations)
-    triangle_area = np.trapz(trend)
-    for i in range(permutations):
-        random_distances = np.random.permutation(distances)
-        cum_distances = np.cumsum(random_distances)
-        es = np.trapz(cum_distances)
-        auc = es - triangle_area
-        es_permute[i] = auc*2
+    if k == 0:
+        return es_permute
+    block_size = max(1, PERMUTATION_BLOCK // k)
+    for start in range(0, permutations, block_size):
+        stop = min(start + block_size, permutations)
+        positions = sample_positions(n=len(weights), k=k, size=stop-start,
+                                        rng=rng)
+        es_permute[start:stop] = np.sum(scores*weights[positions], axis=1)
 
     return es_permute
 
 #==============================================================================
-def permute_auc_bootstrap(original_distances=None, trend=None, permutations=None, bootstrap=False):
+def sample_positions(n=None, k=None, size=None, rng=np.random):
+    '''Draws size independent samples of k distinct positions out of n, each
+        in random order. Positions are drawn with replacement and repeats are
+        redrawn until each sample is distinct, which takes few rounds when k
+        is small relative to n.
+
+    Returns
+    -------
+    positions : array
+        shape (size, k)
+    '''
+    positions = np.sort(random_integers(rng=rng, high=n, size=(size, k)),
+                        axis=1)
+    rows = np.flatnonzero(np.any(positions[:, 1:] == positions[:, :-1], axis=1))
+    while len(rows) != 0:
+        sample = positions[rows]
+        repeats = np.zeros(sample.shape, dtype=bool)
+        repeats[:, 1:] = sample[:, 1:] == sample[:, :-1]
+        sample[repeats] = random_integers(rng=rng, high=n,
+                                            size=np.count_nonzero(repeats))
+        sample.sort(axis=1)
+        positions[rows] = sample
+        rows = rows[np.any(sample[:, 1:] == sample[:, :-1], axis=1)]
+    #Distinct positions are sorted, so shuffle which score goes where
+    order = np.argsort(rng.random((size, k)), axis=1)
+
+    return np.take_along_axis(positions, order, axis=1)
+
+#==============================================================================
+def random_integers(rng=None, high=None, size=None):
+    '''Draws integers from 0 to high - 1 from a np.random.Generator or the
+        legacy np.random interface'''
+    if isinstance(rng, np.random.Generator):
+        return rng.integers(0, high, size=size)
+
+    return rng.randint(0, high, size=size)
+
+#==============================================================================
+def seed_stream(seed_sequence=None, i=None):
+    '''Returns the i-th child of a np.random.SeedSequence, the same as the
+        i-th sequence returned by seed_sequence.spawn, without changing the
+        state of seed_sequence. Motifs and blocks of permutations of a motif
+        each get their own stream so that results do not depend on how work
+        is divided between processes.
+    '''
+    return np.random.SeedSequence(entropy=seed_sequence.entropy,
+                                    spawn_key=seed_sequence.spawn_key + (i,))
+
+#==============================================================================
+def permute_auc_range(distances=None, trend=None, start=None, stop=None,
+                        seed_sequence=None, blocks=None):
+    '''Calculates the AUC for permutations start to stop of a motif.
+        Permutation i is drawn from stream i // SEED_BLOCK of seed_sequence
+        (see seed_stream) so any range gives the same permutations. If
+        seed_sequence is None, permutations are drawn from the global
+        np.random state.
+
+        Each stream always draws all SEED_BLOCK permutations, since the 
+        hit-sparse sampler (see sample_positions) does not draw the first 
+        permutations of a stream the same way for every count. Streams 
+        drawn for successive ranges of the same motif can be kept in 
+        blocks, a dict of stream number and AUCs, so that each is only 
+        drawn once.
+
+    Returns
+    -------
+    es_permute : array
+        AUC calculated for each permutation
+    '''
+    if seed_sequence is None:
+        return permute_auc(distances=distances, trend=trend,
+                            permutations=stop-start)
+    if blocks is None:
+        blocks = dict()
+    es_permute = list()
+    for block in range(start // SEED_BLOCK, -(-stop // SEED_BLOCK)):
+        if block not in blocks:
+            rng = np.random.default_rng(seed_stream(
+                                        seed_sequence=seed_sequence, i=block))
+            blocks[block] = permute_auc(distances=distances, trend=trend,
+                                        permutations=SEED_BLOCK, rng=rng)
+        es = blocks[block]
+        first = block*SEED_BLOCK
+        es_permute.append(es[max(start - first, 0):stop - first])
+
+    return np.concatenate(es_permute)
+
+#==============================================================================
+def auc_weights(n):
+    '''Returns position weights w such that the trapezoidal area under the
+        cumulative sum of any score vector x of length n is np.dot(x, w).
+        A score at position j contributes to n - j cumulative values, the
+        first and last of which are halved by the trapezoid rule.
+
+    Parameters
+    ----------
+    n : int
+        number of regions
+
+    Returns
+    -------
+    weights : array
+    '''
+    weights = n - np.arange(n) - 0.5
+    if n != 0:
+        weights[0] -= 0.5
+
+    return weights
+
+#==============================================================================
+def trapz(y):
+    '''Trapezoidal area under y with unit spacing (as np.trapz)'''
+    y = np.asarray(y, dtype=float)
+    if len(y) < 2:
+        return 0.0
+
+    return float(np.sum(y) - (y[0] + y[-1])/2)
+
+#==============================================================================
+def permute_auc_bootstrap(original_distances=None, trend=None, permutations=None, bootstrap=False,
+                            rng=np.random):
     '''Generates permutations of the original_ and calculates AUC for each 
         permutation.
 
@@ -470,149 +1056,283 @@ def permute_auc_bootstrap(original_distances=None, trend=None, permutations=None
         list of AUC calculated for permutations 
        
     '''
-    hits = [x for x in original_distances if x != '.']
+    original_distances = np.asarray(original_distances, dtype=float)
+    hit_indexes = np.flatnonzero(~np.isnan(original_distances))
     if bootstrap and bootstrap <= len(original_distances):
-        if bootstrap < len(hits):
-            #Determine where there are hits
-            hit_indexes = [i for i,x in enumerate(original_distances) if x != '.']
-
+        new_distances = np.full(len(original_distances), np.nan)
+        if bootstrap < len(hit_indexes):
             #Subsample down hits to bootstrap number
-            new_hit_indexes = np.random.choice(hit_indexes, bootstrap, replace=False)
+            new_hit_indexes = rng.choice(hit_indexes, bootstrap, replace=False)
 
-            #Only keep hit if it is within subsampled indexes, otherwise replace it with '.'
-            new_distances = [x if i in new_hit_indexes else '.' for i,x in enumerate(original_distances)]
+            #Only keep hit if it is within subsampled indexes
+            new_distances[new_hit_indexes] = original_distances[new_hit_indexes]
         else:
-            #Get all numerical hit values
-            hits = [x for x in original_distances if x != '.']
-
-            #Generate a list of hit values of size bootstrap
-            new_hits = iter(np.random.choice(hits, bootstrap, replace=True))
+            #Generate an array of hit values of size bootstrap
+            new_hits = rng.choice(original_distances[hit_indexes], bootstrap, replace=True)
 
             #Determine where the hits will be in the new distances array
-            new_hit_indexes = np.random.choice(len(original_distances), bootstrap, replace=False)
+            new_hit_indexes = rng.choice(len(original_distances), bootstrap, replace=False)
 
-            #Place the hits in their appropriate place
-            new_distances = [next(new_hits) if i in new_hit_indexes else '.' for i in range(len(original_distances))]
+            #Place the hits in their appropriate place (in rank order)
+            new_distances[np.sort(new_hit_indexes)] = new_hits
 
     #Get -exp() of distance and get cumulative scores
     #Filter distances into quartiles to get middle distribution
-    distances_abs = [abs(x) if x != '.' else x for x in new_distances]
+    distances_abs = np.abs(new_distances)
+    hit_mask = ~np.isnan(distances_abs)
     q1 = int(round(len(new_distances)*.25))
     q3 = int(round(len(new_distances)*.75))
-    middledistancehist =  [x for x in distances_abs[int(q1):int(q3)] if x != '.']
-    average_distance = float(sum(middledistancehist))/float(len(middledistancehist))
+    middledistancehist = distances_abs[int(q1):int(q3)]
+    middledistancehist = middledistancehist[~np.isnan(middledistancehist)]
+    average_distance = float(np.sum(middledistancehist))/float(len(middledistancehist))
     
-    score = [math.exp(-float(x)/average_distance) if x != '.' else 0.0 for x in distances_abs]
-    total = sum(score)
+    score = np.zeros(len(distances_abs))
+    score[hit_mask] = np.exp(-distances_abs[hit_mask]/average_distance)
+    total = np.sum(score)
 
     binwidth = 1.0/float(len(distances_abs))
-    normalized_score = [(float(x)/total)*binwidth for x in score]
+    normalized_score = (score/total)*binwidth
 
-    es_permute = []
-    triangle_area = np.trapz(trend)
+    es_permute = permute_auc(distances=normalized_score, trend=trend,
+                                permutations=permutations, rng=rng)
 
-    normalized_distances = normalized_score
-    for i in range(permutations):
-        random_distances = np.random.permutation(normalized_distances)
-        cum_distances = np.cumsum(random_distances)
-        es = np.trapz(cum_distances)
-        auc = es - triangle_area
-        es_permute.append(auc*2)
+    return list(es_permute)
 
-    return es_permute
+#==============================================================================
+def gsea_table(motif_distances=None, cutoff=None, fimo_motifs=None, 
+                motif_fpkm=None):
+    '''Calculates the max GSEA enrichment score and hit count of every motif,
+        scoring blocks of motifs at once with max_GSEA. A region is a hit if
+        the motif is within cutoff of its center.
+
+    Parameters
+    ----------
+    motif_distances : DistanceMatrix
+        motif x region distances
+    cutoff : int
+        maximum distance (bp) of a hit
+
+    Returns
+    -------
+    results : list
+        [motif, es, hits, gc, fpkm] for each motif. es is np.nan if every 
+        region or no region has a hit.
+    '''
+    nan = float('Nan')
+    block_size = max(1, SCORE_BLOCK // max(motif_distances.regions, 1))
+    results = list()
+    for start in range(0, len(motif_distances), block_size):
+        hits = np.abs(motif_distances.rows(start, start + block_size)) < cutoff
+        es = max_GSEA(hits)
+        for i, motif in enumerate(motif_distances.motifs[start:start+block_size]):
+            gc = nan
+            if fimo_motifs:
+                gc = get_gc(motif=motif, motif_database=fimo_motifs)
+            results.append([motif, es[i], int(np.count_nonzero(hits[i])), gc, 
+                            motif_fpkm.get(motif, nan)])
+
+    return results
 
 #==============================================================================
-def max_GSEA(distances, use_config=False, output_type=None, cutoff=None,
-                        permutations=None, pvals=None,
-                        plotall=None, p_cutoff=None, figuredir=None, 
-                        largewindow=None, fimo_motifs=None, 
-                        meta_profile_dict=None, label1=None, label2=None, 
-                        dpi=None, fcs=None):
-    '''Takes the max of the enrichment curve. This method is good at detecting
-        significant motif instances in a row. It is susceptible to instances
-        where a motif appears generally throughout all regions.
+def gsea_null(task, cutoff=None, permutations=None):
+    '''Simulates the null distribution of the max GSEA enrichment score of a
+        single motif (see permute_max_GSEA)
+
+    Parameters
+    ----------
+    task : tuple
+        (motif, distances, seed_sequence)
+
+    Returns
+    -------
+    result : list
+        [motif, enrichment score of each permutation]
     '''
-    motif = distances[0]
-    distances = [x if x != '.' else cutoff+1 for x in distances[1:]]
-    hits = [1 if abs(x) < cutoff else -1 for x in distances]
-    pos_total = float(sum([1 for x in hits if x != -1]))
-    neg_total = float(sum([1 for x in hits if x == -1]))
-
-    Eval = 0
-    ES = list()
-    for distance in hits:
-        if distance == -1:
-            Eval += -1.0/neg_total
-            ES.append(Eval)
-        else:
-            Eval += 1.0/pos_total
-            ES.append(Eval)
-    
-    actualES = max(ES, key=abs)
-
-    #To get NES, first simulate 1000 permuations of region ranks
-    simES = permute_max_GSEA(hits=hits, permutations=1000)
-
-    #NES is the actualES divided by the mean ES of all permutations with the 
-    # same sign as actualES p-value is caluclated empirically 
-    # (i.e. (# of simulated ES scores larger than actualES)/(rest of simulated ES scores))
-    if actualES < 0:
-        simESsubset = [x for x in simES if x < 0]
-        mu = np.mean(simESsubset)
-        NES = -(actualES/mu)
-        sigma = np.std(simESsubset)
-        p = stats.norm.cdf(actualES, mu, sigma)
-    else:
-        simESsubset = [x for x in simES if x > 0]
-        mu = np.mean(simESsubset)
-        NES = actualES/mu
-        sigma = np.std(simESsubset)
-        p = 1-stats.norm.cdf(actualES, mu, sigma)
-
-    if math.isnan(p):
-        p = 1.0
-
-    # if output_type == 'html':
-    #     from TFEA import plot
-    #     plotting_score = [(float(x)/total) for x in score]
-    #     plotting_cumscore = np.cumsum(plotting_score)
-    #     plot.plot_individual_graphs(distances=distances, figuredir=figuredir, 
-    #                     fimo_motifs=fimo_motifs, largewindow=largewindow, 
-    #                     score=plotting_score, use_config=use_config,
-    #                     dpi=dpi, pvals=pvals, fcs=fcs, 
-    #                     cumscore=plotting_cumscore, sim_auc=sim_auc, auc=auc,
-    #                     meta_profile_dict=meta_profile_dict, label1=label1, 
-    #                     label2=label2)
-    
-    if output_type == 'lineplot_output':
-        return ES
-    
-    if output_type == 'simulation_output':
-        return actualES, simES
-
-    return [motif, actualES, NES, pos_total, p]
-
-#==============================================================================
-def permute_max_GSEA(hits=None, permutations=1000):
-    import numpy as np
-    #Simulate 1000 permuations of region ranks
-    pos_total = float(sum([1 for x in hits if x != -1]))
-    neg_total = float(sum([1 for x in hits if x == -1]))
-    simES = list()
-    for i in range(permutations):
-        np.random.shuffle(hits)
-        Eval = 0
-        ES = list()
-        for distance in hits:
-            if distance == -1:
-                Eval += -1.0/neg_total
-                ES.append(Eval)
-            else:
-                Eval += 1.0/pos_total
-                ES.append(Eval)
-        simES.append(max(ES, key=abs))
+    try:
+        motif, distances, seed_sequence = task
+        hits = np.abs(np.asarray(distances, dtype=float)) < cutoff
+        sim_es = permute_max_GSEA(hits=hits, permutations=permutations,
+                                    rng=np.random.default_rng(seed_sequence))
+    except Exception as e:
+        # This prints the type, value, and stack trace of the
+        # current exception being handled.
+        print(traceback.print_exc())
+        raise e
+    return [motif, sim_es]
+
+#==============================================================================
+def gsea_pvalues(result, sim_es=None, offset=0, tests=None):
+    '''Calculates Bonferroni corrected p-values of the max GSEA enrichment 
+        score before and after GC correction. As with GSEA, scores are 
+        compared to a normal fit of the permuted scores with the same sign.
+
+    Parameters
+    ----------
+    result : list
+        output of gsea_table
+    sim_es : array
+        output of permute_max_GSEA
+    offset : float
+        the enrichment score expected from the GC content of the motif
+
+    Returns
+    -------
+    result : list
+        [motif, es, corrected_es, hits, gc, fpkm, p, corrected_p] with 
+        p-values as log10, the same columns as auc_pvalues
+    '''
+    motif, es, hits, gc, fpkm = result
+    if np.isnan(es):
+        return [motif, 0, 0, hits, gc, fpkm, 0, 0]
+    corrected_es = es - offset
+
+    pvalues = list()
+    for x in [es, corrected_es]:
+        same_sign = sim_es[sim_es < 0] if x < 0 else sim_es[sim_es > 0]
+        p = 0
+        if len(same_sign) > 1:
+            mu = np.mean(same_sign)
+            sigma = np.std(same_sign)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                if x < 0:
+                    p = stats.norm.logcdf(x, mu, sigma)
+                else:
+                    p = stats.norm.logsf(x, mu, sigma)
+        if math.isnan(p):
+            p = 0
+        p = p+np.log(tests) if p+np.log(tests) <= 0 else 0
+        pvalues.append(p*math.log(np.e, 10))
+    p, corrected_p = pvalues
 
-    return simES
+    return [motif, es, corrected_es, hits, gc, fpkm, p, corrected_p]
+
+#==============================================================================
+def max_GSEA(hits):
+    '''Calculates the GSEA running sum of many hit vectors at once and 
+        returns its maximum deviation from zero. The running sum increases 
+        by 1/hits at each hit and decreases by 1/(regions - hits) at each 
+        other region. With c hits among the first j regions, the running sum
+        times hits*(regions - hits) is the integer c*regions - j*hits, which
+        is evaluated exactly as a single cumulative sum along the regions so
+        that tied peaks are found regardless of rounding. This method is 
+        good at detecting significant motif instances in a row. It is 
+        susceptible to instances where a motif appears generally throughout
+        all regions.
+
+    Parameters
+    ----------
+    hits : array
+        boolean hits x regions, or a single vector of regions
+
+    Returns
+    -------
+    es : array
+        the value of the running sum furthest from zero for each row (the 
+        first if tied). np.nan if every region or no region has a hit.
+    '''
+    hits = np.atleast_2d(np.asarray(hits, dtype=bool))
+    rows, n = hits.shape
+    pos = np.count_nonzero(hits, axis=1)
+    neg = n - pos
+    es = np.full(rows, np.nan)
+    defined = (pos != 0) & (neg != 0)
+    if not np.any(defined):
+        return es
+    dtype = np.int32 if n*n < 2**31 else np.int64
+    running = np.cumsum(hits[defined], axis=1, dtype=dtype)
+    running *= n
+    running -= (np.arange(1, n + 1, dtype=dtype)
+                *pos[defined].astype(dtype)[:, None])
+    es[defined] = first_peak(running)/(pos[defined]*neg[defined])
+
+    return es
+
+#==============================================================================
+def max_GSEA_positions(positions=None, n=None):
+    '''Calculates max_GSEA from the sorted hit positions of each row. The 
+        running sum only rises at hits, so its maximum deviation is reached
+        at a hit or just before one and only 2*hits values are compared 
+        instead of n.
+
+    Parameters
+    ----------
+    positions : array
+        sorted hit positions with shape (rows, hits)
+    n : int
+        number of regions
+
+    Returns
+    -------
+    es : array
+        see max_GSEA
+    '''
+    rows, k = positions.shape
+    before = np.arange(k)*n - positions*k
+    #Interleave in region order so that ties resolve as in max_GSEA
+    running = np.stack([before, before + (n - k)], axis=2).reshape(rows, 2*k)
+
+    return first_peak(running)/(k*(n - k))
+
+#==============================================================================
+def first_peak(running):
+    '''Returns the first value furthest from zero in each row'''
+    peak = np.argmax(np.abs(running), axis=1)
+
+    return running[np.arange(len(running)), peak]
+
+#==============================================================================
+def permute_max_GSEA(hits=None, permutations=1000, rng=np.random):
+    '''Calculates max_GSEA for permutations of the region ranks. Blocks of 
+        permutations are evaluated as 2D cumulative sums limited to 
+        PERMUTATION_BLOCK values. If few regions have a hit, or few have 
+        none, only the positions of those are drawn (see sample_positions) 
+        and each permutation costs O(hits) (see max_GSEA_positions).
+
+    Parameters
+    ----------
+    hits : array
+        boolean vector of regions with a hit
+    permutations : int
+        number of times to permute
+    rng : np.random.Generator or np.random
+        source of random numbers. Default: the global np.random state
+
+    Returns
+    -------
+    sim_es : array
+        enrichment score of each permutation
+    '''
+    hits = np.asarray(hits, dtype=bool)
+    n = len(hits)
+    k = int(np.count_nonzero(hits))
+    sim_es = np.full(permutations, np.nan)
+    if k == 0 or k == n:
+        return sim_es
+    #Swapping hits and other regions negates the running sum
+    sign = 1
+    if n - k < k:
+        hits, k, sign = ~hits, n - k, -1
+
+    if k <= SPARSE_HITS*n:
+        block_size = max(1, PERMUTATION_BLOCK // (2*k))
+        for start in range(0, permutations, block_size):
+            stop = min(start + block_size, permutations)
+            positions = np.sort(sample_positions(n=n, k=k, size=stop-start, 
+                                                    rng=rng), axis=1)
+            sim_es[start:stop] = sign*max_GSEA_positions(positions=positions,
+                                                            n=n)
+        return sim_es
+
+    block_size = max(1, PERMUTATION_BLOCK // n)
+    block = np.empty((min(block_size, permutations), n), dtype=bool)
+    for start in range(0, permutations, block_size):
+        stop = min(start + block_size, permutations)
+        for row in block[:stop-start]:
+            row[:] = hits
+            rng.shuffle(row)
+        sim_es[start:stop] = sign*max_GSEA(block[:stop-start])
+
+    return sim_es
 
 #==============================================================================
 def padj_bonferroni(results, pvalindex=-1):
@@ -643,16 +1363,16 @@ def padj_bonferroni(results, pvalindex=-1):
 def anderson_darling(distances):
     #sort distances based on the ranks from TF bed file
     #and calculate the absolute distance
-    motif = distances[0]
-    distances = distances[1:]
-    hits = sum([1 if x != '.' else 0 for x in distances])
+    motif, distances = distances
+    hits = int(np.count_nonzero(~np.isnan(distances)))
 
     #Get -exp() of distance and get cumulative scores
     #Filter distances into quartiles to get middle distribution
     q1 = int(round(len(distances)*.25))
     q3 = int(round(len(distances)*.75))
-    expected_distribution =  [x for x in distances[int(q1):int(q3)] if x != '.']
-    observed_distribution = [x for x in distances if x != '.']
+    expected_distribution = distances[int(q1):int(q3)]
+    expected_distribution = expected_distribution[~np.isnan(expected_distribution)]
+    observed_distribution = distances[~np.isnan(distances)]
 
     stat, _, sig = stats.anderson_ksamp([observed_distribution, expected_distribution])
 
@@ -662,10 +1382,9 @@ def anderson_darling(distances):
 def md_score(distances, smallwindow=None):
     '''Calculate md score
     '''
-    distances1, distances2 = distances
-    motif = distances1[0]
-    distances1 = [abs(float(x)) for x in distances1[1:] if x != '.']
-    distances2 = [abs(float(x)) for x in distances2[1:] if x != '.']
+    (motif, distances1), (_, distances2) = distances
+    distances1 = np.abs(distances1[~np.isnan(distances1)])
+    distances2 = np.abs(distances2[~np.isnan(distances2)])
     d1_total = float(len(distances1))
     d2_total = float(len(distances2))
     # print(motif)
@@ -676,8 +1395,8 @@ def md_score(distances, smallwindow=None):
     # print("md2sum: ", sum([1.0 if d <= smallwindow else 0.0 for d in distances2]))
     # print("md2tot: ", d2_total)
     try:
-        md1 = sum([1.0 if d <= smallwindow else 0.0 for d in distances1])/d1_total
-        md2 = sum([1.0 if d <= smallwindow else 0.0 for d in distances2])/d2_total
+        md1 = np.count_nonzero(distances1 <= smallwindow)/d1_total
+        md2 = np.count_nonzero(distances2 <= smallwindow)/d2_total
     except ZeroDivisionError:
         return [motif, 0, 0, 1, 1]
 
@@ -711,10 +1430,10 @@ def md_score_p(results):
     return results
 
 #==============================================================================
-def get_gc(motif=None, motif_database=None, alphabet=['A','C','G','T']):
+def get_gc(motif=None, motif_database=None):
     '''
-    Obtain a pssm model from a meme formatted database file. Warning: If there are multiple
-    motif matches, this function will return the last match in the database.
+    Obtain the GC content of a motif from the compiled index of a meme 
+    formatted database file (see motif_index)
     
     Parameters
     ----------
@@ -725,29 +1444,7 @@ def get_gc(motif=None, motif_database=None, alphabet=['A','C','G','T']):
         
     Returns
     -------
-    PSSM : list or array
-        a list of lists where each corresponding to position then alphabet probability
+    gc : float
+        the mean C+G probability across motif positions
     '''
-    motif_hit = False
-    PSSM = list()
-    with open(motif_database,'r') as F:
-        for line in F:
-            if 'MOTIF' in line:
-                if motif in line:
-                    motif_hit = True
-                else:
-                    motif_hit = False
-            elif motif_hit and 'URL' not in line and 'letter-probability' not in line and line != '\n':
-                acgt_probabilities = [float(x) for x in line.strip('\n').split()]
-                total_prob = sum(acgt_probabilities)
-                acgt_probabilities = [x/total_prob for x in acgt_probabilities] #Convert to probabilities
-                PSSM.append(acgt_probabilities)
-
-    gc = 0
-    for base in PSSM:
-        gc += base[alphabet.index('C')]
-        gc += base[alphabet.index('G')]
-    
-    gc = gc/float(len(PSSM))
-    
-    return gc
+    return motif_index.load(motifdatabase=motif_database).gc(motif=motif)
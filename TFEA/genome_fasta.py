@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains an in-process reader for indexed genome fasta files
+    used by the SCANNER module in place of bedtools getfasta. The genome is
+    memory-mapped and region sequences are sliced directly from it using the
+    samtools faidx index (genomefasta.fai). The index is created if it does
+    not exist.
+
+    Genomes are opened once per process and kept open. Because the file is
+    memory-mapped, forked workers share the same pages through the operating
+    system page cache rather than each reading their own copy.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import os
+import sys
+import mmap
+
+import numpy as np
+
+from TFEA import exceptions
+
+#Constants
+#==============================================================================
+#Open genomes keyed by file path: (mmap, fai dict)
+_GENOMES = dict()
+
+#Functions
+#==============================================================================
+def open_genome(genomefasta=None):
+    '''Memory-maps a genome fasta file and reads its index (once per process)
+
+    Returns
+    -------
+    genome : mmap.mmap
+        the memory-mapped fasta file
+    fai : dict
+        chromosome names as keys and (length, offset, linebases, linewidth)
+        as values
+    '''
+    genomefasta = str(genomefasta)
+    if genomefasta not in _GENOMES:
+        fai = read_fai(genomefasta=genomefasta)
+        with open(genomefasta, 'rb') as F:
+            genome = mmap.mmap(F.fileno(), 0, access=mmap.ACCESS_READ)
+        _GENOMES[genomefasta] = (genome, fai)
+
+    return _GENOMES[genomefasta]
+
+#==============================================================================
+def read_fai(genomefasta=None):
+    '''Reads a samtools faidx index (genomefasta.fai). If it does not exist
+        it is created.
+
+    Returns
+    -------
+    fai : dict
+        chromosome names as keys and (length, offset, linebases, linewidth)
+        as values
+    '''
+    fai_file = str(genomefasta) + '.fai'
+    if not os.path.exists(fai_file):
+        fai = index_fasta(genomefasta=genomefasta)
+        try:
+            with open(fai_file, 'w') as outfile:
+                for chrom, values in fai.items():
+                    outfile.write('\t'.join([chrom] + [str(x) for x in values])
+                                    + '\n')
+        except OSError:
+            pass #Genome directory not writable, keep index in memory
+        return fai
+
+    fai = dict()
+    with open(fai_file) as F:
+        for line in F:
+            linelist = line.rstrip('\n').split('\t')
+            fai[linelist[0]] = tuple(int(x) for x in linelist[1:5])
+
+    return fai
+
+#==============================================================================
+def index_fasta(genomefasta=None):
+    '''Creates a samtools faidx style index of a fasta file. All lines of a
+        sequence except the last must be the same length.
+
+    Returns
+    -------
+    fai : dict
+        chromosome names as keys and (length, offset, linebases, linewidth)
+        as values
+    '''
+    fai = dict()
+    chrom = None
+    position = 0
+    with open(genomefasta, 'rb') as F:
+        for line in F:
+            if line[:1] == b'>':
+                chrom = line[1:].split()[0].decode()
+                fai[chrom] = [0, position + len(line), 0, 0]
+                last_line = False
+            elif chrom is not None and len(line.rstrip()) != 0:
+                bases = len(line.rstrip(b'\r\n'))
+                if fai[chrom][2] == 0:
+                    fai[chrom][2] = bases
+                    fai[chrom][3] = len(line)
+                elif last_line or bases > fai[chrom][2]:
+                    raise exceptions.InputError("Different line lengths "
+                                                "within " + chrom + " of "
+                                                + str(genomefasta))
+                last_line = bases < fai[chrom][2]
+                fai[chrom][0] += bases
+            position += len(line)
+
+    return dict((chrom, tuple(values)) for chrom, values in fai.items())
+
+#==============================================================================
+def chrom_sizes(genomefasta=None):
+    '''Returns chromosome names as keys and sizes as values'''
+    _, fai = open_genome(genomefasta=genomefasta)
+    return dict((chrom, values[0]) for chrom, values in fai.items())
+
+#==============================================================================
+def fetch(genomefasta=None, chrom=None, start=None, stop=None):
+    '''Returns the sequence of a single region
+
+    Parameters
+    ----------
+    chrom : str
+        chromosome name
+    start, stop : int
+        0-based, half-open coordinates. Must be within the chromosome.
+
+    Returns
+    -------
+    sequence : bytes
+        the region sequence (case as in the genome fasta)
+    '''
+    genome, fai = open_genome(genomefasta=genomefasta)
+    _, offset, linebases, linewidth = fai[chrom]
+    first = offset + (start//linebases)*linewidth + start%linebases
+    last = offset + (stop//linebases)*linewidth + stop%linebases
+    sequence = genome[first:last]
+    if linewidth - linebases == 1:
+        return sequence.replace(b'\n', b'')
+    return sequence.replace(b'\r\n', b'')
+
+#==============================================================================
+def valid_regions(genomefasta=None, chroms=None, starts=None, stops=None):
+    '''Returns a boolean array of regions that are within the genome. As with
+        bedtools getfasta, other regions are skipped with a warning.
+    '''
+    sizes = chrom_sizes(genomefasta=genomefasta)
+    valid = np.array([chrom in sizes and 0 <= start < stop <= sizes[chrom]
+                        for chrom, start, stop in zip(chroms, starts, stops)],
+                        dtype=bool)
+    for i in np.flatnonzero(~valid):
+        print("WARNING. Feature (" + str(chroms[i]) + ":" + str(starts[i])
+                + "-" + str(stops[i]) + ") beyond the length of "
+                + str(chroms[i]) + ". Skipping.", file=sys.stderr)
+
+    return valid
+
+#==============================================================================
+def write_fasta(genomefasta=None, chroms=None, starts=None, stops=None,
+                outfile=None):
+    '''Writes region sequences to a fasta file with chrom:start-stop names
+        (as bedtools getfasta). Regions outside the genome are skipped.
+    '''
+    valid = valid_regions(genomefasta=genomefasta, chroms=chroms,
+                            starts=starts, stops=stops)
+    with open(outfile, 'wb') as output:
+        for chrom, start, stop, keep in zip(chroms, starts, stops, valid):
+            if keep:
+                output.write(f'>{chrom}:{start}-{stop}\n'.encode())
+                output.write(fetch(genomefasta=genomefasta, chrom=chrom,
+                                    start=start, stop=stop) + b'\n')
+
+    return outfile
+
+#==============================================================================
+def encode_regions(genomefasta=None, chroms=None, starts=None, stops=None,
+                    table=None):
+    '''Encodes region sequences directly from the genome as a single 1D uint8
+        array where regions are separated by a non-ACGT value (see
+        scanner.fasta_encode_flat). All regions must be within the genome.
+
+    Parameters
+    ----------
+    table : np.ndarray
+        lookup table from ascii codes to encoded values (see
+        scanner.encoding_table)
+
+    Returns
+    -------
+    encoded : np.ndarray
+        encoded sequences
+    offsets : np.ndarray
+        the position of the first base of each region within encoded
+    '''
+    lengths = np.asarray(stops, dtype=np.int64) - np.asarray(starts,
+                                                                dtype=np.int64)
+    offsets = np.cumsum(lengths + 1) - (lengths + 1)
+    encoded = np.full(int(np.sum(lengths + 1)), table[ord('N')],
+                        dtype=np.uint8)
+    for offset, chrom, start, stop in zip(offsets, chroms, starts, stops):
+        sequence = fetch(genomefasta=genomefasta, chrom=chrom, start=start,
+                            stop=stop)
+        encoded[offset:offset+len(sequence)] = table[np.frombuffer(sequence,
+                                                            dtype=np.uint8)]
+
+    return encoded, offsets
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains the genome hits engine used by the SCANNER module
+    when SCANNER is set to 'genome hits'. Genome-wide motif hits are stored as
+    a binary index: for each motif, an array of hits sorted by chromosome and
+    start that can be memory-mapped. Distances from region centers to the
+    nearest motif hit are found using np.searchsorted rather than bedtools
+    closest.
+
+    An index directory contains:
+        genomehits_index.json - motif names with chromosome names and offsets
+            into each motif's hit array
+        <motif>.npy - a structured array of hits (see HIT_DTYPE)
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import sys
+from pathlib import Path
+
+import numpy as np
+import ujson
+
+from TFEA import multiprocess
+from TFEA import exceptions
+
+#Constants
+#==============================================================================
+INDEX_FILE = 'genomehits_index.json'
+
+#Hits are sorted by start within each chromosome. maxstop is the running
+#maximum of stop within each chromosome, used to find overlapping and
+#upstream hits with a single searchsorted.
+HIT_DTYPE = np.dtype([('start', np.int64), ('stop', np.int64),
+                        ('maxstop', np.int64), ('score', np.float32)])
+
+#Functions
+#==============================================================================
+def get_index(genomehits=None, tempdir=None, cpus=1, debug=False, jobid=None):
+    '''Returns the path to a genome hits index. If genomehits is a directory
+        of bed files (one per motif) rather than an index, an index is built
+        within tempdir.
+
+    Parameters
+    ----------
+    genomehits : pathlib.Path
+        full path to either an index directory or a directory containing bed
+        files of motif hits across the genome
+    tempdir : pathlib.Path
+        full path to a directory where an index may be built
+
+    Returns
+    -------
+    index_dir : pathlib.Path
+        full path to an index directory
+    '''
+    genomehits = Path(genomehits)
+    if (genomehits / INDEX_FILE).exists():
+        return genomehits
+
+    index_dir = Path(tempdir) / 'genomehits_index'
+    build_index(genomehits=genomehits, index_dir=index_dir, cpus=cpus,
+                debug=debug, jobid=jobid)
+
+    return index_dir
+
+#==============================================================================
+def build_index(genomehits=None, index_dir=None, cpus=1, debug=False,
+                jobid=None):
+    '''Converts a directory of bed files of motif hits (one per motif) into a
+        genome hits index
+
+    Parameters
+    ----------
+    genomehits : pathlib.Path
+        full path to a directory containing bed files of motif hits
+    index_dir : pathlib.Path
+        full path to the index directory to create
+    '''
+    bedfiles = sorted(Path(genomehits).glob('*.bed'))
+    if len(bedfiles) == 0:
+        raise exceptions.FileEmptyError("No motif hit bed files found in "
+                                        + str(genomehits))
+    index_dir = Path(index_dir)
+    index_dir.mkdir(exist_ok=True, parents=True)
+    print("\tIndexing genome hits:", file=sys.stderr)
+    motifs = multiprocess.main(function=index_bed, args=bedfiles,
+                                kwargs=dict(index_dir=index_dir), debug=debug,
+                                jobid=jobid, cpus=cpus)
+    write_index_file(index_dir=index_dir, motifs=dict(motifs))
+
+#==============================================================================
+def index_bed(bedfile, index_dir=None):
+    '''Reads a bed file of motif hits and writes it to an index directory
+
+    Returns
+    -------
+    motif : str
+        the motif name (bed file name without the '.bed' extension)
+    chrom_offsets : dict
+        see write_motif
+    '''
+    motif = motif_name(bedfile)
+    chroms, starts, stops, scores = read_hit_bed(bedfile=bedfile)
+    chrom_offsets = write_motif(index_dir=index_dir, motif=motif,
+                                chroms=chroms, starts=starts, stops=stops,
+                                scores=scores)
+
+    return motif, chrom_offsets
+
+#==============================================================================
+def motif_name(filename=None):
+    '''Returns a motif name from a genome hits bed file name'''
+    filename = Path(filename).name
+    if filename.endswith('.bed'):
+        return filename[:-len('.bed')]
+    return filename
+
+#==============================================================================
+def read_hit_bed(bedfile=None):
+    '''Reads motif hits from a bed file. Scores are read from the 5th column
+        if present.
+
+    Returns
+    -------
+    chroms : np.ndarray
+        chromosome names
+    starts, stops : np.ndarray
+        0-based, half-open coordinates
+    scores : np.ndarray
+        motif scores (0 if not present)
+    '''
+    chroms = list()
+    starts = list()
+    stops = list()
+    scores = list()
+    with open(bedfile) as F:
+        for line in F:
+            if line[0] == '#' or line.strip() == '':
+                continue
+            linelist = line.rstrip('\n').split('\t')
+            chroms.append(linelist[0])
+            starts.append(int(linelist[1]))
+            stops.append(int(linelist[2]))
+            scores.append(float(linelist[4]) if len(linelist) > 4 else 0.0)
+
+    return (np.array(chroms, dtype=str), np.array(starts, dtype=np.int64),
+            np.array(stops, dtype=np.int64),
+            np.array(scores, dtype=np.float32))
+
+#==============================================================================
+def write_motif(index_dir=None, motif=None, chroms=None, starts=None,
+                stops=None, scores=None):
+    '''Sorts hits for a single motif by chromosome and start and writes them
+        to <motif>.npy within index_dir
+
+    Returns
+    -------
+    chrom_offsets : dict
+        chromosome names as keys and [first, last + 1] row of the hits for
+        that chromosome as values
+    '''
+    chroms = np.asarray(chroms, dtype=str)
+    order = np.lexsort((starts, chroms))
+    chroms = chroms[order]
+    hits = np.empty(len(order), dtype=HIT_DTYPE)
+    hits['start'] = np.asarray(starts)[order]
+    hits['stop'] = np.asarray(stops)[order]
+    hits['score'] = np.asarray(scores)[order]
+    chrom_offsets = dict()
+    unique_chroms, first = np.unique(chroms, return_index=True)
+    last = np.append(first[1:], len(chroms))
+    for chrom, i, j in zip(unique_chroms, first, last):
+        hits['maxstop'][i:j] = np.maximum.accumulate(hits['stop'][i:j])
+        chrom_offsets[str(chrom)] = [int(i), int(j)]
+    np.save(Path(index_dir) / (motif + '.npy'), hits)
+
+    return chrom_offsets
+
+#==============================================================================
+def write_index_file(index_dir=None, motifs=None):
+    '''Writes the index file listing all motifs and their chromosome offsets.
+        This is written last so that an index is only used once complete.
+    '''
+    with open(Path(index_dir) / INDEX_FILE, 'w') as outfile:
+        ujson.dump(dict(motifs=motifs), outfile)
+
+#==============================================================================
+def load_index(index_dir=None):
+    '''Reads the index file of a genome hits index
+
+    Returns
+    -------
+    index : dict
+        motif names as keys and chromosome offsets (see write_motif) as values
+    '''
+    index_file = Path(index_dir) / INDEX_FILE
+    if not index_file.exists():
+        raise exceptions.FileEmptyError("No genome hits index found in "
+                                        + str(index_dir))
+    with open(index_file) as F:
+        return ujson.load(F)['motifs']
+
+#==============================================================================
+def region_centers(bedfile=None):
+    '''Reads the center position of each region in a bed file (in file order)
+
+    Returns
+    -------
+    chroms : np.ndarray
+        chromosome names
+    centers : np.ndarray
+        0-based center positions
+    '''
+    chroms = list()
+    centers = list()
+    with open(bedfile) as F:
+        for line in F:
+            if (line[0] == '#' or line.strip() == '' 
+                    or line.startswith(('track', 'browser'))):
+                continue
+            chrom, start, stop = line.split('\t')[:3]
+            chroms.append(chrom)
+            centers.append((int(start) + int(stop))//2)
+
+    return np.array(chroms, dtype=str), np.array(centers, dtype=np.int64)
+
+#==============================================================================
+def closest_distances(motifs, index_dir=None, index=None, region_sets=None,
+                        distance_cutoff=None):
+    '''Calculates the distance from each region center to the nearest hit
+        of each motif. Distances follow bedtools closest -D ref -t first: 0
+        if a hit overlaps the center, negative if the nearest hit is upstream
+        and positive if downstream. Ties are broken in favor of upstream hits.
+
+    Parameters
+    ----------
+    motifs : list
+        motif names within the index
+    index_dir : pathlib.Path
+        full path to a genome hits index
+    index : dict
+        the output of load_index
+    region_sets : list
+        (chroms, centers) tuples (see region_centers)
+    distance_cutoff : int
+        distances greater than this are considered no hit
+
+    Returns
+    -------
+    motif_distances : list
+        for each region set, a list of (motif, distances) tuples where
+        distances is an array with np.nan for regions without a hit within
+        distance_cutoff
+    '''
+    motif_distances = [list() for _ in region_sets]
+    groups = [chrom_regions(chroms=chroms) for chroms, _ in region_sets]
+    for motif in motifs:
+        if motif not in index:
+            raise exceptions.InputError("Motif " + motif + " not found in "
+                                        "genome hits index.")
+        hits = np.load(Path(index_dir) / (motif + '.npy'), mmap_mode='r')
+        for i, (_, centers) in enumerate(region_sets):
+            distances = np.full(len(centers), np.nan)
+            for chrom, (first, last) in index[motif].items():
+                regions = groups[i].get(chrom)
+                if regions is None or first == last:
+                    continue
+                distances[regions] = nearest_hits(
+                                        starts=hits['start'][first:last],
+                                        maxstops=hits['maxstop'][first:last],
+                                        centers=centers[regions])
+            distances[np.abs(distances) > distance_cutoff] = np.nan
+            motif_distances[i].append((motif, distances))
+
+    return motif_distances
+
+#==============================================================================
+def chrom_regions(chroms=None):
+    '''Groups regions by chromosome
+
+    Parameters
+    ----------
+    chroms : np.ndarray
+        chromosome name of each region
+
+    Returns
+    -------
+    regions : dict
+        chromosome names as keys and arrays of region indexes (in file order)
+        as values
+    '''
+    order = np.argsort(chroms, kind='stable')
+    names, first = np.unique(chroms[order], return_index=True)
+
+    return dict((str(name), regions) for name, regions 
+                in zip(names, np.split(order, first[1:])))
+
+#==============================================================================
+def nearest_hits(starts=None, maxstops=None, centers=None):
+    '''Finds the signed distance from each center to the nearest hit on a
+        single chromosome
+
+    Parameters
+    ----------
+    starts : np.ndarray
+        sorted hit starts
+    maxstops : np.ndarray
+        running maximum of hit stops (in start order)
+    centers : np.ndarray
+        0-based center positions
+
+    Returns
+    -------
+    distances : np.ndarray
+        signed distances (see closest_distances)
+    '''
+    starts = np.asarray(starts)
+    maxstops = np.asarray(maxstops)
+    #Number of hits starting at or before each center. Every hit ending at or
+    #before the center is among these so the running maximum stop gives
+    #either an overlapping hit (> center) or the nearest upstream hit.
+    k = np.searchsorted(starts, centers, side='right')
+    upstream = np.full(len(centers), -np.inf)
+    has_upstream = k > 0
+    upstream_stops = maxstops[k[has_upstream] - 1]
+    upstream[has_upstream] = -(centers[has_upstream] - upstream_stops + 1)
+    overlap = np.zeros(len(centers), dtype=bool)
+    overlap[has_upstream] = upstream_stops > centers[has_upstream]
+
+    downstream = np.full(len(centers), np.inf)
+    has_downstream = k < len(starts)
+    downstream[has_downstream] = (starts[k[has_downstream]]
+                                    - centers[has_downstream])
+
+    distances = np.where(-upstream <= downstream, upstream, downstream)
+    distances[overlap] = 0
+
+    return distances
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains a persistent, content-addressed cache of genomic
+    motif hits used by the SCANNER module. Hits are cached for a given genome,
+    motif, p-value threshold, background and scanner along with the genomic
+    intervals that have been scanned so that subsequent runs only scan regions
+    that have not been seen before.
+
+    Each run appends new files to the cache rather than modifying existing
+    ones and files are written to a temporary name before being atomically
+    renamed. This makes the cache safe to share between concurrent jobs (e.g.
+    SLURM jobs) on a shared filesystem without locking.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import os
+import uuid
+import socket
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+#Constants
+#==============================================================================
+#Number of chunk files allowed for a single cache key before they are merged
+MAX_CHUNKS = 16
+
+#Number of evenly spaced 1MB blocks of the genome fasta used to fingerprint it
+FINGERPRINT_BLOCKS = 16
+
+#Functions
+#==============================================================================
+def genome_fingerprint(genomefasta=None):
+    '''Computes a fingerprint of a genome fasta file from its size and the
+        contents of evenly spaced blocks. This avoids hashing a full genome
+        every run while still identifying the genome by its contents.
+
+    Parameters
+    ----------
+    genomefasta : str
+        full path to a genome fasta file
+
+    Returns
+    -------
+    fingerprint : str
+        hex digest
+    '''
+    size = os.stat(genomefasta).st_size
+    block = 2**20
+    sha = hashlib.sha1(str(size).encode())
+    with open(genomefasta, 'rb') as F:
+        for i in range(FINGERPRINT_BLOCKS):
+            F.seek(int((size - block)*i/max(1, FINGERPRINT_BLOCKS-1))
+                    if size > block else 0)
+            sha.update(F.read(block))
+
+    return sha.hexdigest()
+
+#==============================================================================
+def cache_key(*components):
+    '''Creates a cache key from any number of components (e.g. genome
+        fingerprint, motif matrix, threshold, background). Components may be
+        strings, numbers, bytes or numpy arrays.
+
+    Returns
+    -------
+    key : str
+        hex digest
+    '''
+    sha = hashlib.sha1()
+    for component in components:
+        if isinstance(component, np.ndarray):
+            component = np.ascontiguousarray(component).tobytes()
+        elif not isinstance(component, bytes):
+            component = str(component).encode()
+        sha.update(hashlib.sha1(component).digest())
+
+    return sha.hexdigest()
+
+#==============================================================================
+def key_directory(cache_dir=None, key=None):
+    return Path(cache_dir) / key[:2] / key
+
+#==============================================================================
+def load(cache_dir=None, key=None, retries=5):
+    '''Loads all cached hits and scanned intervals for a given key
+
+    Parameters
+    ----------
+    cache_dir : str
+        full path to the cache directory
+    key : str
+        a key created using cache_key
+    retries : int
+        number of times to re-list cache files if a file is removed by a
+        concurrent merge while loading
+
+    Returns
+    -------
+    coverage : dict
+        chromosome names as keys and (starts, stops) arrays of merged scanned
+        intervals as values (0-based, half-open)
+    hits : dict
+        chromosome names as keys and (starts, stops, scores, strands) arrays 
+        sorted by start as values (0-based, half-open). Strands are 1 (+), -1
+        (-) or 0 if unknown (e.g. hits cached by older versions).
+    chunk_files : list
+        cache files that were loaded
+    '''
+    directory = key_directory(cache_dir=cache_dir, key=key)
+    for attempt in range(retries):
+        chunks = list()
+        chunk_files = sorted(directory.glob('*.npz'))
+        try:
+            for chunk_file in chunk_files:
+                with np.load(chunk_file) as chunk:
+                    chunks.append(dict(chunk))
+            break
+        except FileNotFoundError:
+            if attempt == retries - 1:
+                raise
+
+    coverage = dict()
+    hits = dict()
+    for chunk in chunks:
+        chroms = chunk['chroms']
+        for i, chrom in enumerate(chroms):
+            cov = chunk['coverage_chrom'] == i
+            coverage.setdefault(chrom, ([], []))
+            coverage[chrom][0].append(chunk['coverage_start'][cov])
+            coverage[chrom][1].append(chunk['coverage_stop'][cov])
+            hit = chunk['hit_chrom'] == i
+            hits.setdefault(chrom, ([], [], [], []))
+            hits[chrom][0].append(chunk['hit_start'][hit])
+            hits[chrom][1].append(chunk['hit_stop'][hit])
+            hits[chrom][2].append(chunk['hit_score'][hit])
+            if 'hit_strand' in chunk:
+                hits[chrom][3].append(chunk['hit_strand'][hit])
+            else:
+                hits[chrom][3].append(np.zeros(np.count_nonzero(hit), 
+                                                dtype=np.int8))
+
+    for chrom in coverage:
+        coverage[chrom] = merge_intervals(np.concatenate(coverage[chrom][0]),
+                                            np.concatenate(coverage[chrom][1]))
+    for chrom in hits:
+        hits[chrom] = unique_hits(*[np.concatenate(x) for x in hits[chrom]])
+
+    return coverage, hits, chunk_files
+
+#==============================================================================
+def save(cache_dir=None, key=None, coverage=None, hits=None):
+    '''Appends newly scanned intervals and their hits to the cache as a new
+        chunk file. The file is written under a temporary name and atomically
+        renamed. If there are too many chunk files for this key they are
+        merged.
+
+    Parameters
+    ----------
+    cache_dir : str
+        full path to the cache directory
+    key : str
+        a key created using cache_key
+    coverage : dict
+        chromosome names as keys and (starts, stops) arrays of scanned
+        intervals as values. All hits fully within these intervals must be
+        included in hits.
+    hits : dict
+        chromosome names as keys and (starts, stops, scores) or (starts, 
+        stops, scores, strands) arrays as values
+    '''
+    directory = key_directory(cache_dir=cache_dir, key=key)
+    directory.mkdir(parents=True, exist_ok=True)
+    write_chunk(directory=directory, coverage=coverage, hits=hits)
+
+    if len(list(directory.glob('*.npz'))) > MAX_CHUNKS:
+        merged_coverage, merged_hits, chunk_files = load(cache_dir=cache_dir,
+                                                            key=key)
+        write_chunk(directory=directory, coverage=merged_coverage,
+                    hits=merged_hits)
+        for chunk_file in chunk_files:
+            try:
+                chunk_file.unlink()
+            except FileNotFoundError:
+                pass #Merged by a concurrent job
+
+#==============================================================================
+def write_chunk(directory=None, coverage=None, hits=None):
+    '''Writes a single chunk file atomically
+    '''
+    chroms = sorted(set(coverage) | set(hits))
+    arrays = dict(chroms=np.array(chroms, dtype=str))
+    empty = np.zeros(0, dtype=np.int64)
+    for name, data, columns in [('coverage', coverage, ['start', 'stop']),
+                                ('hit', hits, ['start', 'stop', 'score', 
+                                                'strand'])]:
+        arrays[name + '_chrom'] = np.concatenate([empty] +
+                            [np.full(len(data[chrom][0]), i, dtype=np.int64)
+                            for i, chrom in enumerate(chroms) if chrom in data])
+        for j, column in enumerate(columns):
+            arrays[name + '_' + column] = np.concatenate([empty] +
+                            [np.asarray(data[chrom][j]) if j < len(data[chrom])
+                            else np.zeros(len(data[chrom][0]), dtype=np.int8)
+                            for chrom in chroms if chrom in data])
+    arrays['hit_strand'] = arrays['hit_strand'].astype(np.int8)
+
+    name = f'{uuid.uuid4().hex}'
+    tmp_file = directory / f'.{name}.{socket.gethostname()}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as outfile:
+        np.savez(outfile, **arrays)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.replace(tmp_file, directory / (name + '.npz'))
+
+#==============================================================================
+def merge_intervals(starts=None, stops=None):
+    '''Merges overlapping or adjacent intervals
+
+    Returns
+    -------
+    starts, stops : np.ndarray
+        sorted, non-overlapping intervals
+    '''
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    if len(starts) == 0:
+        return starts, stops
+    order = np.argsort(starts, kind='mergesort')
+    starts, stops = starts[order], np.maximum.accumulate(stops[order])
+    new = np.ones(len(starts), dtype=bool)
+    new[1:] = starts[1:] > stops[:-1]
+    group_stops = np.append(np.flatnonzero(new)[1:] - 1, len(starts) - 1)
+    return starts[new], stops[group_stops]
+
+#==============================================================================
+def subtract_intervals(starts=None, stops=None, remove_starts=None,
+                        remove_stops=None):
+    '''Removes intervals from a set of merged intervals
+
+    Parameters
+    ----------
+    starts, stops : np.ndarray
+        sorted, non-overlapping intervals
+    remove_starts, remove_stops : np.ndarray
+        sorted, non-overlapping intervals to remove
+
+    Returns
+    -------
+    starts, stops : np.ndarray
+        sorted, non-overlapping intervals
+    '''
+    if len(remove_starts) == 0 or len(starts) == 0:
+        return starts, stops
+    #Sweep over interval boundaries. Each position is kept if it is within an
+    #interval and not within a removed interval.
+    points = np.concatenate([starts, stops, remove_starts, remove_stops])
+    deltas = np.concatenate([np.ones(len(starts)), -np.ones(len(stops)),
+                            -2*np.ones(len(remove_starts)),
+                            2*np.ones(len(remove_stops))]).astype(np.int64)
+    order = np.argsort(points, kind='mergesort')
+    points, deltas = points[order], deltas[order]
+    unique_points, index = np.unique(points, return_index=True)
+    state = np.cumsum(np.add.reduceat(deltas, index))
+    keep = state == 1
+    new_starts = unique_points[:-1][keep[:-1]]
+    new_stops = unique_points[1:][keep[:-1]]
+    return merge_intervals(new_starts, new_stops)
+
+#==============================================================================
+def intersect_intervals(starts=None, stops=None, other_starts=None,
+                        other_stops=None):
+    '''Returns the intersection of two sets of sorted, non-overlapping
+        intervals
+    '''
+    if len(starts) == 0 or len(other_starts) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    points = np.concatenate([starts, stops, other_starts, other_stops])
+    deltas = np.concatenate([np.ones(len(starts)), -np.ones(len(stops)),
+                            np.ones(len(other_starts)),
+                            -np.ones(len(other_stops))]).astype(np.int64)
+    order = np.argsort(points, kind='mergesort')
+    points, deltas = points[order], deltas[order]
+    unique_points, index = np.unique(points, return_index=True)
+    state = np.cumsum(np.add.reduceat(deltas, index))
+    keep = state == 2
+    return merge_intervals(unique_points[:-1][keep[:-1]],
+                            unique_points[1:][keep[:-1]])
+
+#==============================================================================
+def unique_hits(starts=None, stops=None, scores=None, strands=None):
+    '''Sorts hits by start and removes duplicate hits (e.g. hits found when
+        scanning overlapping intervals). Strands are 0 (unknown) if not given.
+
+    Returns
+    -------
+    starts, stops, scores, strands : np.ndarray
+    '''
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    scores = np.asarray(scores, dtype=float)
+    if strands is None:
+        strands = np.zeros(len(starts), dtype=np.int8)
+    strands = np.asarray(strands, dtype=np.int8)
+    order = np.lexsort((-scores, stops, starts))
+    starts, stops = starts[order], stops[order]
+    scores, strands = scores[order], strands[order]
+    keep = np.ones(len(starts), dtype=bool)
+    keep[1:] = (starts[1:] != starts[:-1]) | (stops[1:] != stops[:-1])
+    return starts[keep], stops[keep], scores[keep], strands[keep]
+
+#==============================================================================
+def region_hits(chroms=None, starts=None, stops=None, hits=None):
+    '''Finds all hits fully contained within each region
+
+    Parameters
+    ----------
+    chroms : np.ndarray
+        chromosome of each region
+    starts, stops : np.ndarray
+        0-based, half-open region coordinates
+    hits : dict
+        chromosome names as keys and (starts, stops, scores) or (starts, 
+        stops, scores, strands) arrays sorted by start as values
+
+    Returns
+    -------
+    regions : np.ndarray
+        index of the region containing each hit. Hits are sorted by region 
+        and then start and a hit within overlapping regions is returned once
+        for each region.
+    hit_starts, hit_stops, hit_scores, hit_strands : np.ndarray
+        0-based, half-open coordinates, score and strand of each hit
+    '''
+    chroms = np.asarray(chroms)
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    results = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64),
+                np.zeros(0, dtype=np.int64), np.zeros(0), 
+                np.zeros(0, dtype=np.int8))]
+    for chrom in np.unique(chroms):
+        if chrom not in hits or len(hits[chrom][0]) == 0:
+            continue
+        chrom_starts, chrom_stops, chrom_scores = hits[chrom][:3]
+        if len(hits[chrom]) > 3:
+            chrom_strands = hits[chrom][3]
+        else:
+            chrom_strands = np.zeros(len(chrom_starts), dtype=np.int8)
+        regions = np.flatnonzero(chroms == chrom)
+        lo = np.searchsorted(chrom_starts, starts[regions], side='left')
+        hi = np.searchsorted(chrom_starts, stops[regions], side='left')
+        counts = hi - lo
+
+        #Expand each region into all hits that start within it
+        region_index = np.repeat(np.arange(len(regions)), counts)
+        candidates = (np.arange(counts.sum())
+                        - np.repeat(np.cumsum(counts) - counts, counts)
+                        + np.repeat(lo, counts))
+        contained = chrom_stops[candidates] <= stops[regions][region_index]
+        candidates = candidates[contained]
+        region_index = region_index[contained]
+        results.append((regions[region_index], chrom_starts[candidates], 
+                        chrom_stops[candidates], chrom_scores[candidates], 
+                        chrom_strands[candidates]))
+
+    regions, hit_starts, hit_stops, hit_scores, hit_strands = [
+                                        np.concatenate(x) for x in zip(*results)]
+    order = np.lexsort((hit_starts, regions))
+    return (regions[order], hit_starts[order], hit_stops[order], 
+            hit_scores[order], hit_strands[order])
+
+#==============================================================================
+def best_hits(chroms=None, starts=None, stops=None, hits=None):
+    '''Finds the highest scoring hit fully contained within each region. Ties
+        are broken by the lowest start position.
+
+    Parameters
+    ----------
+    chroms : np.ndarray
+        chromosome of each region
+    starts, stops : np.ndarray
+        0-based, half-open region coordinates
+    hits : dict
+        chromosome names as keys and (starts, stops, scores) or (starts, 
+        stops, scores, strands) arrays sorted by start as values
+
+    Returns
+    -------
+    hit_starts, hit_stops : np.ndarray
+        0-based, half-open coordinates of the best hit in each region. -1 if
+        there was no hit.
+    hit_scores : np.ndarray
+        score of the best hit in each region. -inf if there was no hit.
+    '''
+    regions, all_starts, all_stops, all_scores, _ = region_hits(chroms=chroms,
+                                                            starts=starts,
+                                                            stops=stops,
+                                                            hits=hits)
+    hit_starts = np.full(len(starts), -1, dtype=np.int64)
+    hit_stops = np.full(len(starts), -1, dtype=np.int64)
+    hit_scores = np.full(len(starts), -np.inf)
+
+    #Sort by region, then highest score, then lowest start
+    order = np.lexsort((all_starts, -all_scores, regions))
+    regions = regions[order]
+    first = np.ones(len(regions), dtype=bool)
+    first[1:] = regions[1:] != regions[:-1]
+    best = order[first]
+    hit_starts[regions[first]] = all_starts[best]
+    hit_stops[regions[first]] = all_stops[best]
+    hit_scores[regions[first]] = all_scores[best]
+
+    return hit_starts, hit_stops, hit_scores
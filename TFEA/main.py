@@ -142,10 +142,14 @@ def run():
     '''This module returns motif distances to regions of interest. This is
         accomplished either by scanning regions on the fly using fimo or homer, or 
         by running bedtools closest on region centers compared to a database of
-        motif hits across the genome.
+        motif hits across the genome. Distances are saved to the output directory
+        and can be loaded using --scan_results to skip this module.
     '''
     from TFEA import scanner
-    scanner.main()
+    if config.vars['SCAN_RESULTS']:
+        scanner.load_scan_results()
+    else:
+        scanner.main()
         
     #ENRICHMENT module
     #==============================================================================
@@ -162,7 +166,21 @@ def run():
     from TFEA import output
     output.main()
 
-    print("TFEA done. Output in:", config.vars['OUTPUT'], file=sys.stderr)
+    #Additional large windows and p-value thresholds
+    #==============================================================================
+    '''Distances for smaller large windows (--largewindows) and stricter
+        p-value thresholds (--fimo_threshs) are derived from the same scan. 
+        ENRICHMENT and OUTPUT are rerun for each of them with output written 
+        to its own folder (see scanner.variant_name).
+    '''
+    outputdir = config.vars['OUTPUT']
+    for name in list(config.vars['SCAN_VARIANTS']):
+        print(name + ":", file=sys.stderr)
+        scanner.select_variant(name=name)
+        enrichment.main()
+        output.main()
+
+    print("TFEA done. Output in:", outputdir, file=sys.stderr)
 
     #Delete temp_files directory
     #==============================================================================
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains a compiled index of a MEME formatted motif database.
+    The database is parsed once and motif names, PSSMs, nsites, widths, GC
+    content, consensus sequences and the database background are stored as
+    arrays in a compiled index file next to the database
+    (motifdatabase + INDEX_SUFFIX). Tables derived from the motifs, such as
+    score p-value tables, are built on first use and saved in the same file.
+
+    The index file is keyed by the modification time, size and sha1 hash of
+    the database. If the modification time or size differ, the hash is
+    checked and the index is rebuilt only if the database content changed.
+    If the database directory is not writable, the index is kept in memory.
+    Indexes are loaded once per process so forked workers share the copy
+    loaded by the parent.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import os
+import hashlib
+
+import numpy as np
+
+from TFEA import exceptions
+
+#Constants
+#==============================================================================
+ALPHABET = 'ACGT'
+INDEX_SUFFIX = '.tfeaidx.npz'
+#Increment when the arrays stored in the index change
+INDEX_VERSION = 1
+#Maximum number of derived table sets (e.g. p-value tables for different
+#backgrounds) kept in an index file. The oldest set is dropped first.
+MAX_TABLES = 8
+#Loaded indexes keyed by database path
+_INDEXES = dict()
+
+#Classes
+#==============================================================================
+class MotifIndex(object):
+    '''Compiled motif database
+
+    Attributes
+    ----------
+    arrays : dict
+        the arrays stored in the index file
+    names : list
+        motif names in database order. As with fimo output parsing, the name
+        of a motif is the last word of its MOTIF line (the alternate name if
+        given, otherwise the motif id).
+    '''
+    def __init__(self, arrays=None, index_file=None):
+        self.arrays = arrays
+        self.index_file = index_file
+        self.names = [str(name) for name in arrays['names']]
+        #Motifs can be looked up by id or alternate name. As with fimo, the
+        #last motif wins if a name is repeated.
+        self.rows = dict()
+        for i, (motif_id, alt_id) in enumerate(zip(arrays['ids'],
+                                                    arrays['alt_ids'])):
+            for name in [motif_id, alt_id]:
+                if name != '':
+                    self.rows[str(name)] = i
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, motif):
+        return motif in self.rows
+
+    def row(self, motif=None):
+        '''Returns the position of a motif within the index'''
+        try:
+            return self.rows[motif]
+        except KeyError:
+            raise exceptions.InputError("Motif not found in motif database: "
+                                        + str(motif))
+
+    def motif_names(self, row=None):
+        '''Returns the id and alternate name (if any) of a motif'''
+        names = [str(self.arrays['ids'][row]), str(self.arrays['alt_ids'][row])]
+        return [name for name in names if name != '']
+
+    def pssm(self, motif=None):
+        '''Returns a tuple of (PSSM array with shape (width, 4), nsites)'''
+        i = self.row(motif=motif)
+        offset = self.arrays['offsets'][i]
+        return (self.arrays['pssms'][offset:offset+self.arrays['widths'][i]],
+                float(self.arrays['nsites'][i]))
+
+    def width(self, motif=None):
+        return int(self.arrays['widths'][self.row(motif=motif)])
+
+    def gc(self, motif=None):
+        '''Returns the mean C+G probability across motif positions'''
+        return float(self.arrays['gc'][self.row(motif=motif)])
+
+    def consensus(self, motif=None):
+        '''Returns the most likely base at each motif position'''
+        return str(self.arrays['consensus'][self.row(motif=motif)])
+
+    @property
+    def background(self):
+        '''Background letter frequencies of the database'''
+        return self.arrays['background']
+
+    def tables(self, key=None, build=None):
+        '''Returns a set of arrays derived from all motifs in the index (for
+            example score p-value tables under a given background). Sets are
+            built once and saved in the index file under key.
+
+        Parameters
+        ----------
+        key : str
+            identifies the set. Must not contain '/'.
+        build : function
+            called with this index if the set is not cached. Returns a dict
+            of array names and arrays.
+
+        Returns
+        -------
+        tables : dict
+            array names as keys and arrays as values
+        '''
+        prefix = 'table/' + key + '/'
+        tables = dict((name[len(prefix):], array)
+                        for name, array in self.arrays.items()
+                        if name.startswith(prefix))
+        if len(tables) != 0:
+            return tables
+
+        tables = build(self)
+        keys = [str(x) for x in self.arrays.get('table_keys', [])] + [key]
+        for old_key in keys[:-MAX_TABLES]:
+            for name in [name for name in self.arrays
+                            if name.startswith('table/' + old_key + '/')]:
+                del self.arrays[name]
+        self.arrays['table_keys'] = np.array(keys[-MAX_TABLES:], dtype=str)
+        for name, array in tables.items():
+            self.arrays[prefix + name] = array
+        if self.index_file is not None:
+            write_index_file(index_file=self.index_file, arrays=self.arrays)
+
+        return tables
+
+#Functions
+#==============================================================================
+def load(motifdatabase=None):
+    '''Returns the compiled index of a motif database, compiling it if the
+        index file does not exist or is out of date
+
+    Parameters
+    ----------
+    motifdatabase : str or Path
+        full path to a meme formatted file
+
+    Returns
+    -------
+    index : MotifIndex
+    '''
+    key = str(motifdatabase)
+    try:
+        stat = os.stat(key)
+    except OSError:
+        raise exceptions.FileEmptyError("Motif database not found: " + key)
+    if key in _INDEXES:
+        index = _INDEXES[key]
+        if (index.arrays['mtime'] == stat.st_mtime_ns
+                and index.arrays['size'] == stat.st_size):
+            return index
+
+    index_file = index_path(motifdatabase=motifdatabase)
+    arrays = read_index_file(index_file=index_file)
+    if arrays is None or arrays['size'] != stat.st_size:
+        arrays = None
+    elif arrays['mtime'] != stat.st_mtime_ns:
+        #Touched but possibly unchanged, compare content
+        if arrays['sha1'] == file_hash(motifdatabase=motifdatabase):
+            arrays['mtime'] = np.int64(stat.st_mtime_ns)
+            write_index_file(index_file=index_file, arrays=arrays)
+        else:
+            arrays = None
+    if arrays is None:
+        arrays = compile_database(motifdatabase=motifdatabase)
+        arrays['mtime'] = np.int64(stat.st_mtime_ns)
+        arrays['size'] = np.int64(stat.st_size)
+        arrays['sha1'] = np.array(file_hash(motifdatabase=motifdatabase))
+        write_index_file(index_file=index_file, arrays=arrays)
+
+    _INDEXES[key] = MotifIndex(arrays=arrays, index_file=index_file)
+
+    return _INDEXES[key]
+
+#==============================================================================
+def index_path(motifdatabase=None):
+    return str(motifdatabase) + INDEX_SUFFIX
+
+#==============================================================================
+def file_hash(motifdatabase=None):
+    '''Returns the sha1 hex digest of a file'''
+    sha1 = hashlib.sha1()
+    with open(motifdatabase, 'rb') as F:
+        for block in iter(lambda: F.read(2**20), b''):
+            sha1.update(block)
+
+    return sha1.hexdigest()
+
+#==============================================================================
+def read_index_file(index_file=None):
+    '''Reads an index file. Returns None if it does not exist, cannot be read
+        or was written by a different version.
+    '''
+    try:
+        with np.load(index_file) as data:
+            arrays = dict((key, data[key]) for key in data.files)
+    except (OSError, ValueError, EOFError):
+        return None
+    if arrays.get('version') != INDEX_VERSION:
+        return None
+
+    return arrays
+
+#==============================================================================
+def write_index_file(index_file=None, arrays=None):
+    '''Writes an index file atomically so that concurrent jobs never read a
+        partial index. If the directory is not writable, nothing is written.
+    '''
+    tmp_file = index_file + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(tmp_file, 'wb') as outfile:
+            np.savez(outfile, **arrays)
+        os.replace(tmp_file, index_file)
+    except OSError:
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+
+#==============================================================================
+def compile_database(motifdatabase=None):
+    '''Parses a MEME formatted motif database in a single pass
+
+    Returns
+    -------
+    arrays : dict
+        'names', 'ids' and 'alt_ids' (str arrays, alt_ids empty if not
+        given), 'widths', 'nsites', 'gc', 'consensus', 'offsets' (the first
+        row of each motif within 'pssms'), 'pssms' (all probability matrices
+        stacked with shape (sum of widths, 4)) and 'background'
+    '''
+    background = np.full(len(ALPHABET), 1.0/len(ALPHABET))
+    names = list()
+    ids = list()
+    alt_ids = list()
+    nsites = list()
+    pssms = list()
+    motif_line = None
+    with open(motifdatabase) as F:
+        for line in F:
+            if line.startswith('Background letter frequencies') and len(ids) == 0:
+                values = F.readline().split()
+                frequencies = dict(zip(values[::2], values[1::2]))
+                background = np.array([float(frequencies[base])
+                                        for base in ALPHABET])
+            elif line.startswith('MOTIF'):
+                motif_line = line.strip('\n').split()
+            elif 'letter-probability' in line and motif_line is not None:
+                header = line.split('=')
+                fields = dict()
+                for key, value in zip(header[:-1], header[1:]):
+                    fields[key.split()[-1]] = value.split()[0]
+                width = int(fields['w'])
+                pssm = list()
+                while len(pssm) < width:
+                    row = F.readline().split()
+                    if len(row) != 0:
+                        pssm.append([float(x) for x in row])
+                pssm = np.array(pssm)
+                pssms.append(pssm/pssm.sum(axis=1)[:, None])
+                nsites.append(float(fields.get('nsites', 20)))
+                names.append(motif_line[-1])
+                ids.append(motif_line[1])
+                alt_ids.append(motif_line[2] if len(motif_line) > 2 else '')
+                motif_line = None
+
+    widths = np.array([len(pssm) for pssm in pssms], dtype=np.int64)
+    offsets = np.cumsum(widths) - widths
+    consensus = [''.join(ALPHABET[i] for i in np.argmax(pssm, axis=1))
+                    for pssm in pssms]
+    gc = [np.mean(pssm[:, ALPHABET.index('C')] + pssm[:, ALPHABET.index('G')])
+            for pssm in pssms]
+
+    return dict(version=np.int64(INDEX_VERSION), names=np.array(names, dtype=str),
+                ids=np.array(ids, dtype=str),
+                alt_ids=np.array(alt_ids, dtype=str), widths=widths,
+                nsites=np.array(nsites, dtype=float), offsets=offsets,
+                pssms=(np.concatenate(pssms) if len(pssms) != 0
+                        else np.zeros((0, len(ALPHABET)))),
+                gc=np.array(gc, dtype=float),
+                consensus=np.array(consensus, dtype=str),
+                background=background/background.sum())
+
+#==============================================================================
+def write_meme(motifdatabase=None, motifs=None, outfile=None):
+    '''Writes a subset of motifs from the index to a MEME formatted file
+
+    Parameters
+    ----------
+    motifs : list
+        motif names
+    outfile : str or Path
+        full path to the output file
+
+    Returns
+    -------
+    outfile : str or Path
+    '''
+    index = load(motifdatabase=motifdatabase)
+    with open(outfile, 'w') as output:
+        output.write('MEME version 4\n\nALPHABET= ' + ALPHABET
+                        + '\n\nstrands: + -\n\n'
+                        'Background letter frequencies\n'
+                        + ' '.join(base + ' ' + str(frequency) for base,
+                                    frequency in zip(ALPHABET,
+                                                        index.background))
+                        + '\n\n')
+        for motif in motifs:
+            pssm, nsites = index.pssm(motif=motif)
+            output.write('MOTIF '
+                        + ' '.join(index.motif_names(row=index.row(motif=motif)))
+                        + '\nletter-probability matrix: alength= '
+                        + str(len(ALPHABET)) + ' w= ' + str(len(pssm))
+                        + ' nsites= ' + str(nsites) + '\n')
+            for row in pssm:
+                output.write('\t'.join(str(x) for x in row) + '\n')
+            output.write('\n')
+
+    return outfile
@@ -554,7 +554,9 @@ def html_output(results=None, module_list=None, outputdir=None,
 def summary_html_output(config_object=None, outputdir=None):
     exclude = ['MOTIF_DISTANCES','MD_DISTANCES1', 'MD_DISTANCES2', 
                 'MDD_DISTANCES1', 'MDD_DISTANCES2', 'PVALS', 'FCS', 
-                'META_PROFILE', 'RESULTS', 'MD_RESULTS', 'MDD_RESULTS']
+                'META_PROFILE', 'RESULTS', 'MD_RESULTS', 'MDD_RESULTS', 
+                'SCAN_VARIANTS', 'MOTIF_HITS', 'MD_HITS1', 'MD_HITS2', 
+                'MDD_HITS1', 'MDD_HITS2']
     with open(os.path.join(outputdir,'summary.html'),'w') as outfile:
         outfile.write("""<!DOCTYPE html>
                 <html>
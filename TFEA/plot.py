@@ -37,6 +37,7 @@ import numpy as np
 from scipy import stats
 
 from TFEA import exceptions
+from TFEA import motif_index
 
 ## GC Decorator
 import gc
@@ -85,14 +86,15 @@ def plot_individual_graphs(use_config=True, distances=None, figuredir=None,
     q1 = int(round(np.percentile(np.arange(1, len(distances),1), 25)))
     q2 = int(round(np.percentile(np.arange(1, len(distances),1), 50)))
     q3 = int(round(np.percentile(np.arange(1, len(distances),1), 75)))
-    q1_distances = [x for x in distances[:q1] if x != '.']
-    q1_meta_retain = [i for i,x in enumerate(distances[:q1]) if x != '.']
-    q2_distances = [x for x in distances[q1:q2] if x != '.']
-    q2_meta_retain = [i for i,x in enumerate(distances[q1:q2]) if x != '.']
-    q3_distances = [x for x in distances[q2:q3] if x != '.']
-    q3_meta_retain = [i for i,x in enumerate(distances[q2:q3]) if x != '.']
-    q4_distances = [x for x in distances[q3:] if x != '.']
-    q4_meta_retain = [i for i,x in enumerate(distances[q3:]) if x != '.']
+    hit_mask = ~np.isnan(distances)
+    q1_distances = distances[:q1][hit_mask[:q1]]
+    q1_meta_retain = np.flatnonzero(hit_mask[:q1])
+    q2_distances = distances[q1:q2][hit_mask[q1:q2]]
+    q2_meta_retain = np.flatnonzero(hit_mask[q1:q2])
+    q3_distances = distances[q2:q3][hit_mask[q2:q3]]
+    q3_meta_retain = np.flatnonzero(hit_mask[q2:q3])
+    q4_distances = distances[q3:][hit_mask[q3:]]
+    q4_meta_retain = np.flatnonzero(hit_mask[q3:])
 
     
     #Get log pval to plot for rank metric
@@ -129,9 +131,8 @@ def plot_individual_graphs(use_config=True, distances=None, figuredir=None,
     
     barplot(ax=barplot_ax, xvals=xvals, colorarray=score, xlimits=xlimits)
 
-    scatter_data = [(i,x) for i,x in zip(xvals, distances) if x != '.']
-    scatter_x = [i for i,_ in scatter_data]
-    scatter_y = [x for _,x in scatter_data]
+    scatter_x = xvals[hit_mask]
+    scatter_y = distances[hit_mask]
     if len(logpval) != 0:
         scatterplot(ax=scatterplot_ax, xvals=scatter_x, yvals=scatter_y, 
                     xlimits=xlimits, largewindow=largewindow)
@@ -612,10 +613,15 @@ def plot_global_gc(results, p_cutoff=None, title=None, xlabel=None,
 #==============================================================================
 @force_gc
 def meme_logo(motif_file, motif_ID, figuredir, plot_format=None):
-    '''Runs meme2images that creates logo images
+    '''Runs meme2images that creates logo images. meme2images is given a
+        single-motif file written from the compiled motif index so that it
+        does not re-read the whole database for every motif.
     '''
+    single_motif_file = figuredir / (motif_ID + '.logo.meme')
+    motif_index.write_meme(motifdatabase=motif_file, motifs=[motif_ID],
+                            outfile=single_motif_file)
     meme2images_command = ['meme2images', '-rc', '-eps', '-motif', motif_ID, 
-                            motif_file, figuredir]
+                            single_motif_file, figuredir]
     motif_ID = motif_ID.replace('.', '_')
     imagemagick_command = ['convert', figuredir / ('logo'+motif_ID+'.eps'), 
                             figuredir / (f'logo{motif_ID}.png')]
@@ -627,6 +633,8 @@ def meme_logo(motif_file, motif_ID, figuredir, plot_format=None):
         subprocess.check_output(imagemagick_rc_command, stderr=subprocess.PIPE)
     except subprocess.CalledProcessError as e:
         print(e.stderr.decode(), flush=True, file=sys.stdout)
+    finally:
+        os.remove(single_motif_file)
     return
 
 #==============================================================================
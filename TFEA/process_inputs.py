@@ -66,7 +66,9 @@ def read_arguments():
     inputs.add_argument('--fimo_motifs', help=("Full path to a .meme "
                         "formatted motif databse file. Some "
                         "databases included in motif_files "
-                        "folder."), dest='FIMO_MOTIFS')
+                        "folder. A compiled index of the database is "
+                        "saved next to it (.tfeaidx.npz) if the folder is "
+                        "writable."), dest='FIMO_MOTIFS')
     inputs.add_argument('--config','-c', help=("A configuration file that a "
                         "user may use instead of specifying flags. Command "
                         "line flags will overwrite options within the config "
@@ -94,6 +96,11 @@ def read_arguments():
                                             "sequences to be analyzed, ranked by "
                                             "the user."), 
                                             dest='FASTA_FILE')
+    processed_inputs.add_argument('--scan_results', help=("A scan_results "
+                                            "directory saved by a previous "
+                                            "TFEA run. Starts TFEA at the "
+                                            "ENRICHMENT module."), 
+                                            dest='SCAN_RESULTS', metavar='DIR')
 
     # Secondary analysis inputs
     secondary_inputs = parser.add_argument_group('Secondary Analysis Inputs', 
@@ -153,12 +160,18 @@ def read_arguments():
                                     "bed file"), choices=['deseq', 'fc', False], 
                                     dest='RANK')
     module_switches.add_argument('--scanner', help=("Method for scanning fasta "
-                                    "files for motifs. Default: fimo"), 
-                                    choices=['fimo', 'genome hits'], 
+                                    "files for motifs. 'numpy' scans all "
+                                    "motifs in-process using the same p-value "
+                                    "threshold as fimo. Default: fimo"), 
+                                    choices=['fimo', 'numpy', 'genome hits'], 
                                     dest='SCANNER')
     module_switches.add_argument('--enrichment', help=("Method for calculating "
-                                    "enrichment. Default: auc"), choices=['auc', 
-                                    'auc_bgcorrect'], dest='ENRICHMENT')
+                                    "enrichment. 'gsea' scores the maximum "
+                                    "of the GSEA running sum of regions "
+                                    "with a motif within --largewindow. "
+                                    "Default: auc"), choices=['auc', 
+                                    'auc_bgcorrect', 'gsea'], 
+                                    dest='ENRICHMENT')
 
     # Scanner Options
     scanner_options = parser.add_argument_group('Scanner Options', 
@@ -166,15 +179,63 @@ def read_arguments():
     scanner_options.add_argument('--fimo_thresh', help=("P-value threshold for "
                                     "calling FIMO motif hits. Default: 1e-6"), 
                                     dest='FIMO_THRESH')
+    scanner_options.add_argument('--fimo_threshs', help=("A comma-separated "
+                                    "list of p-value thresholds (e.g. "
+                                    "1e-5,1e-6,1e-7) to analyze from a single "
+                                    "scan. Regions are scanned once at the "
+                                    "loosest threshold which replaces "
+                                    "--fimo_thresh and the p-value of each "
+                                    "best hit is kept. Results for each "
+                                    "stricter threshold are written to a "
+                                    "fimo_thresh_<value> folder within the "
+                                    "output. Requires bed file inputs with "
+                                    "the 'numpy' scanner. Default: False"), 
+                                    dest='FIMO_THRESHS')
     scanner_options.add_argument('--fimo_background', help=("Options for "
                                     "choosing mononucleotide background "
                                     "distribution to use with FIMO. Default: largewindow"
                                     "{'largewindow', 'smallwindow', int, file}"),
                                     dest='FIMO_BACKGROUND')
+    scanner_options.add_argument('--fimo_batch', help=("Number of motifs to "
+                                    "scan within a single fimo call. 'auto' "
+                                    "chooses a size based on --cpus. Set to "
+                                    "False to scan one motif per call. "
+                                    "Default: auto"), dest='FIMO_BATCH')
+    scanner_options.add_argument('--scan_cache', help=("A folder used to "
+                                    "cache genomic motif hits between runs. "
+                                    "Only regions not previously scanned with "
+                                    "the same genome, motifs, threshold and "
+                                    "background are scanned. Can be shared "
+                                    "by concurrent jobs. For use with 'fimo' "
+                                    "or 'numpy' scanner options and bed file "
+                                    "inputs. Markov backgrounds are also "
+                                    "cached here. Default: False"), 
+                                    dest='SCAN_CACHE', metavar='DIR')
+    scanner_options.add_argument('--pwm_scan', help=("Scanning algorithm for "
+                                    "the 'numpy' scanner. 'lookahead' scores "
+                                    "the most informative motif positions "
+                                    "first and abandons a site once it can "
+                                    "no longer reach the p-value threshold. "
+                                    "'full' scores every site in full. Both "
+                                    "give identical hits. Default: lookahead"),
+                                    choices=['full', 'lookahead'],
+                                    dest='PWM_SCAN')
+    scanner_options.add_argument('--all_hits', help=("Keep every motif hit "
+                                    "within each region (distance, score and "
+                                    "strand) in addition to the best hit. "
+                                    "Hits are saved with the scan results so "
+                                    "that --hit_summary can be changed when "
+                                    "rerunning with --scan_results. Requires "
+                                    "bed file inputs with the 'fimo' or "
+                                    "'numpy' scanner."), 
+                                    action='store_true', dest='ALL_HITS', 
+                                    default=None)
     scanner_options.add_argument('--genomehits', help=("A folder containing "
                                     "bed files with pre-calculated motif hits "
-                                    "to a genome. For use with 'genome hits' "
-                                    "scanner option."), dest='GENOMEHITS')
+                                    "to a genome or a genome hits index. Bed "
+                                    "files are indexed once per run. For use "
+                                    "with 'genome hits' scanner option."), 
+                                    dest='GENOMEHITS')
     scanner_options.add_argument('--singlemotif', help=("Option to run "
                                     "analysis on a subset of motifs within "
                                     "specified motif database or genome hits. "
@@ -188,11 +249,65 @@ def read_arguments():
                                         "permutations to perfrom for "
                                         "calculating p-value. Default: 1000"), 
                                         dest='PERMUTATIONS')
+    enrichment_options.add_argument('--enrichment_null', help=("How the null "
+                                        "distribution of the E-score is "
+                                        "obtained. 'permutation' estimates "
+                                        "its mean and standard deviation "
+                                        "from --permutations shuffles of the "
+                                        "regions. 'analytic' computes both "
+                                        "exactly without permutations, which "
+                                        "are then only simulated for plotted "
+                                        "motifs. Cannot be used with "
+                                        "--bootstrap. Default: permutation"), 
+                                        choices=['permutation', 'analytic'],
+                                        dest='ENRICHMENT_NULL')
+    enrichment_options.add_argument('--adaptive_permutations', help=("Draw "
+                                        "permutations in batches starting at "
+                                        "this size and doubling, and stop "
+                                        "once a motif is confidently not "
+                                        "significant given --padjcutoff. "
+                                        "Significant and borderline motifs "
+                                        "receive up to --permutations "
+                                        "permutations, which can then be "
+                                        "raised for precise p-values. Set to "
+                                        "False to turn off. Default: False"), 
+                                        dest='ADAPTIVE_PERMUTATIONS')
+    enrichment_options.add_argument('--seed', help=("Seed for the random "
+                                        "permutations of each motif. Results "
+                                        "are reproducible for a given seed "
+                                        "regardless of --cpus. Set to False "
+                                        "for a different seed each run. "
+                                        "Default: False"), 
+                                        dest='SEED')
     enrichment_options.add_argument('--largewindow', help=("The size (bp) of a "
                                         "large window around input regions "
                                         "that captures background. Default: "
                                         "1500"), 
                                         dest='LARGEWINDOW')
+    enrichment_options.add_argument('--hit_summary', help=("How motif hits "
+                                        "within a region are summarized as a "
+                                        "single distance. 'best' uses the "
+                                        "highest scoring hit, 'closest' the "
+                                        "hit closest to the region center and "
+                                        "'average' the mean absolute distance "
+                                        "of all hits. Anything but 'best' "
+                                        "requires "
+                                        "--all_hits or scan results saved "
+                                        "with --all_hits. Default: best"), 
+                                        choices=['best', 'closest', 'average'],
+                                        dest='HIT_SUMMARY')
+    enrichment_options.add_argument('--largewindows', help=("A comma-"
+                                        "separated list of large window sizes "
+                                        "(e.g. 1500,1000,500) to analyze from a "
+                                        "single scan. Regions are scanned once "
+                                        "at the largest size which replaces "
+                                        "--largewindow. Results for each "
+                                        "smaller size are written to a "
+                                        "largewindow_<size> folder within the "
+                                        "output. Requires bed file inputs with "
+                                        "the 'fimo' or 'numpy' scanner or "
+                                        "'genome hits'. Default: False"), 
+                                        dest='LARGEWINDOWS')
     enrichment_options.add_argument('--smallwindow', help=("The size (bp) of a "
                                         "small window arount input regions "
                                         "that captures signal. Default: "
@@ -310,6 +425,7 @@ def read_arguments():
                     'COMBINED_FILE': [False, [Path, bool]],
                     'RANKED_FILE': [False, [Path, bool]],
                     'FASTA_FILE': [False, [Path, bool]],
+                    'SCAN_RESULTS': [False, [Path, bool]],
                     'MD': [False, [bool]],
                     'MDD': [False, [bool]],
                     'MD_BEDFILE1': [False, [Path, bool]],
@@ -329,12 +445,22 @@ def read_arguments():
                     'DEBUG': [False, [bool]],
                     'GENOMEFASTA': [False, [Path, bool]],
                     'FIMO_THRESH': [1e-6, [float]], 
+                    'FIMO_THRESHS': [False, [str, bool]], 
                     'FIMO_MOTIFS': [False, [Path, bool]],
                     'FIMO_BACKGROUND': ['largewindow', [int, str]], 
+                    'FIMO_BATCH': ['auto', [int, str]], 
+                    'SCAN_CACHE': [False, [Path, bool]],
+                    'PWM_SCAN': ['lookahead', [str]],
+                    'ALL_HITS': [False, [bool]],
+                    'HIT_SUMMARY': ['best', [str]],
                     'SINGLEMOTIF': [False, [bool, str]], 
                     'GENOMEHITS': [False, [Path, bool]],
                     'PERMUTATIONS': [1000, [int]], 
+                    'ENRICHMENT_NULL': ['permutation', [str]], 
+                    'ADAPTIVE_PERMUTATIONS': [False, [int, bool]], 
+                    'SEED': [False, [int, bool]], 
                     'LARGEWINDOW': [1500, [int]], 
+                    'LARGEWINDOWS': [False, [str, bool]], 
                     'SMALLWINDOW': [150, [int]], 
                     'PADJCUTOFF': [0.1, [float]], 
                     'OUTPUT_TYPE': ['txt', [str]],
@@ -529,6 +655,7 @@ def verify_arguments(parser=None):
     config.vars['RESULTS'] = []
     config.vars['MD_RESULTS'] = []
     config.vars['MDD_RESULTS'] = []
+    config.vars['SCAN_VARIANTS'] = {}
 
     #Set module booleans based on pre-processed inputs
     if config.vars['COMBINED_FILE']:
@@ -539,9 +666,16 @@ def verify_arguments(parser=None):
     if config.vars['FASTA_FILE']:
         config.vars['COMBINE'] = False
         config.vars['RANK'] = False
+    if config.vars['SCAN_RESULTS']:
+        config.vars['COMBINE'] = False
+        config.vars['RANK'] = False
+        if not (config.vars['SCAN_RESULTS'] / 'motif_distances').exists():
+            raise exceptions.InputError('SCAN_RESULTS does not contain motif distances from a previous TFEA run')
 
     #Verify combine module
-    if not config.vars['COMBINE']:
+    if config.vars['SCAN_RESULTS']:
+        pass #Distances already computed, skip COMBINE, RANK and SCANNER checks
+    elif not config.vars['COMBINE']:
         if not config.vars['COMBINED_FILE'] and config.vars['RANK']:
             raise exceptions.InputError('COMBINE module switched off but RANK module switched on without a COMBINED_FILE')
         if config.vars['MD']:
@@ -556,9 +690,11 @@ def verify_arguments(parser=None):
             raise exceptions.InputError('COMBINE module switched on but BED2 not specified')
 
     #Verify rank module
-    if not config.vars['RANK']:
-        if not config.vars['RANKED_FILE'] and not config.vars['FASTA_FILE'] and config.vars['SCANNER'] == 'fimo':
-            raise exceptions.InputError('SCANNER module set to "fimo" but RANK module switched off without RANKED_FILE or FASTA_FILE')
+    if config.vars['SCAN_RESULTS']:
+        pass
+    elif not config.vars['RANK']:
+        if not config.vars['RANKED_FILE'] and not config.vars['FASTA_FILE'] and config.vars['SCANNER'] in ['fimo', 'numpy']:
+            raise exceptions.InputError('SCANNER module set to "' + config.vars['SCANNER'] + '" but RANK module switched off without RANKED_FILE or FASTA_FILE')
         if config.vars['MDD']:
             if not config.vars['MDD_BEDFILE1'] and not config.vars['MDD_FASTA1']:
                 raise exceptions.InputError('RANK module switched off but MDD module switched on without MDD_BEDFILE1 or MDD_FASTA1')
@@ -573,13 +709,76 @@ def verify_arguments(parser=None):
             raise exceptions.InputError('RANK module switched on but LABEL2 not specified')
 
     #Verify scanner module
-    if not config.vars['GENOMEHITS'] and config.vars['SCANNER'] == 'genome hits':
-        raise exceptions.InputError('SCANNER set to "genome hits" without specifying GENOMEHITS')
-    if not config.vars['FIMO_MOTIFS'] and config.vars['SCANNER'] == 'fimo':
-        raise exceptions.InputError('SCANNER set to "fimo" without specifying FIMO_MOTIFS')
-
-    if not config.vars['FASTA_FILE'] and not config.vars['GENOMEFASTA']:
-        raise exceptions.InputError('User inputs require GENOMEFASTA')
+    if not config.vars['SCAN_RESULTS']:
+        if not config.vars['GENOMEHITS'] and config.vars['SCANNER'] == 'genome hits':
+            raise exceptions.InputError('SCANNER set to "genome hits" without specifying GENOMEHITS')
+        if not config.vars['FIMO_MOTIFS'] and config.vars['SCANNER'] in ['fimo', 'numpy']:
+            raise exceptions.InputError('SCANNER set to "' + config.vars['SCANNER'] + '" without specifying FIMO_MOTIFS')
+        if config.vars['SCAN_CACHE'] and config.vars['SCANNER'] in ['fimo', 'numpy']:
+            if not config.vars['GENOMEFASTA']:
+                raise exceptions.InputError('SCAN_CACHE requires GENOMEFASTA')
+            config.vars['SCAN_CACHE'].mkdir(exist_ok=True, parents=True)
+
+        if not config.vars['FASTA_FILE'] and not config.vars['GENOMEFASTA']:
+            raise exceptions.InputError('User inputs require GENOMEFASTA')
+
+    #Verify multiple large windows
+    if config.vars['LARGEWINDOWS']:
+        windows = str(config.vars['LARGEWINDOWS']).strip('[]()').split(',')
+        windows = sorted(set(int(float(x)) for x in windows), reverse=True)
+        user_fasta = any(config.vars[key] for key in ['FASTA_FILE', 
+                            'MD_FASTA1', 'MD_FASTA2', 'MDD_FASTA1', 
+                            'MDD_FASTA2'])
+        if config.vars['SCAN_RESULTS'] or user_fasta:
+            raise exceptions.InputError('LARGEWINDOWS requires bed file inputs and cannot be used with SCAN_RESULTS or fasta files')
+        if config.vars['SCANNER'] not in ['fimo', 'numpy', 'genome hits']:
+            raise exceptions.InputError('LARGEWINDOWS requires SCANNER set to "fimo", "numpy" or "genome hits"')
+        if windows[-1] <= config.vars['SMALLWINDOW']:
+            raise exceptions.InputError('All LARGEWINDOWS must be larger than SMALLWINDOW')
+        config.vars['LARGEWINDOW'] = windows[0]
+        config.vars['LARGEWINDOWS'] = windows
+
+    #Verify multiple p-value thresholds
+    if config.vars['FIMO_THRESHS']:
+        threshs = str(config.vars['FIMO_THRESHS']).strip('[]()').split(',')
+        threshs = sorted(set(float(x) for x in threshs), reverse=True)
+        user_fasta = any(config.vars[key] for key in ['FASTA_FILE', 
+                            'MD_FASTA1', 'MD_FASTA2', 'MDD_FASTA1', 
+                            'MDD_FASTA2'])
+        if config.vars['SCAN_RESULTS'] or user_fasta:
+            raise exceptions.InputError('FIMO_THRESHS requires bed file inputs and cannot be used with SCAN_RESULTS or fasta files')
+        if config.vars['SCANNER'] != 'numpy':
+            raise exceptions.InputError('FIMO_THRESHS requires SCANNER set to "numpy"')
+        if threshs[-1] <= 0:
+            raise exceptions.InputError('All FIMO_THRESHS must be greater than 0')
+        config.vars['FIMO_THRESH'] = threshs[0]
+        config.vars['FIMO_THRESHS'] = threshs
+
+    #Verify all hits
+    if config.vars['ALL_HITS']:
+        user_fasta = any(config.vars[key] for key in ['FASTA_FILE', 
+                            'MD_FASTA1', 'MD_FASTA2', 'MDD_FASTA1', 
+                            'MDD_FASTA2'])
+        if user_fasta or config.vars['SCANNER'] not in ['fimo', 'numpy']:
+            raise exceptions.InputError('ALL_HITS requires bed file inputs with SCANNER set to "fimo" or "numpy"')
+    if (config.vars['HIT_SUMMARY'] != 'best' and not config.vars['ALL_HITS'] 
+            and not config.vars['SCAN_RESULTS']):
+        raise exceptions.InputError('HIT_SUMMARY "' + config.vars['HIT_SUMMARY'] + '" requires ALL_HITS or SCAN_RESULTS saved with ALL_HITS')
+
+    if config.vars['ENRICHMENT'] == 'gsea' and (
+            config.vars['ENRICHMENT_NULL'] == 'analytic' 
+            or config.vars['ADAPTIVE_PERMUTATIONS'] or config.vars['BOOTSTRAP']):
+        raise exceptions.InputError('ENRICHMENT "gsea" cannot be used with ENRICHMENT_NULL "analytic", ADAPTIVE_PERMUTATIONS or BOOTSTRAP')
+    if config.vars['ENRICHMENT_NULL'] == 'analytic' and config.vars['BOOTSTRAP']:
+        raise exceptions.InputError('ENRICHMENT_NULL "analytic" cannot be used with BOOTSTRAP')
+    if config.vars['ADAPTIVE_PERMUTATIONS']:
+        if config.vars['ENRICHMENT_NULL'] == 'analytic' or config.vars['BOOTSTRAP']:
+            raise exceptions.InputError('ADAPTIVE_PERMUTATIONS cannot be used with ENRICHMENT_NULL "analytic" or BOOTSTRAP')
+        if config.vars['ADAPTIVE_PERMUTATIONS'] < 2:
+            raise exceptions.InputError('ADAPTIVE_PERMUTATIONS must be at least 2')
+    if config.vars['SEED'] is True or (config.vars['SEED'] is not False 
+                                        and config.vars['SEED'] < 0):
+        raise exceptions.InputError('SEED must be False or a non-negative integer')
     
     if config.vars['GC'] and not config.vars['FIMO_MOTIFS']:
         raise exceptions.InputError('GC correction requires FIMO_MOTIFS, etiher turn off GC correction or provide a .meme database')
@@ -656,7 +855,9 @@ def write_rerun(args=None, outputdir=None):
 def write_vars(config_vars=None, outputfile=None):
     exclude = ['MOTIF_DISTANCES','MD_DISTANCES1', 'MD_DISTANCES2', 
                 'MDD_DISTANCES1', 'MDD_DISTANCES2', 'PVALS', 'FCS', 
-                'META_PROFILE', 'RESULTS', 'MD_RESULTS', 'MDD_RESULTS']
+                'META_PROFILE', 'RESULTS', 'MD_RESULTS', 'MDD_RESULTS', 
+                'SCAN_VARIANTS', 'MOTIF_HITS', 'MD_HITS1', 'MD_HITS2', 
+                'MDD_HITS1', 'MDD_HITS2']
 
     with open(outputfile, 'w') as outfile:
         for key in config_vars:
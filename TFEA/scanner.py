@@ -18,17 +18,24 @@ __email__ = 'Jonathan.Rubin@colorado.edu'
 import os
 import sys
 import time
+import shutil
 import datetime
+import itertools
+import tempfile
 import subprocess
-import traceback
+import uuid
 from pathlib import Path
 
 import numpy as np
-from pybedtools import BedTool
-from pybedtools import featurefuncs
+import ujson
 
 from TFEA import multiprocess
 from TFEA import exceptions
+from TFEA import distance_matrix
+from TFEA import hit_cache
+from TFEA import genome_hits
+from TFEA import genome_fasta
+from TFEA import motif_index
 
 #Main Script
 #==============================================================================
@@ -37,11 +44,13 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
             scanner=None, md=None, largewindow=None, smallwindow=None, 
             genomehits=None, fimo_background=None, genomefasta=None, 
             tempdir=None, fimo_motifs=None, singlemotif=None, fimo_thresh=None,
-            debug=None, mdd=None, jobid=None, cpus=None):
+            debug=None, mdd=None, jobid=None, cpus=None, fimo_batch_size='auto',
+            scan_cache=None, pwm_scan='lookahead', largewindows=False, 
+            fimo_threshs=False, all_hits=False, hit_summary='best'):
     '''This is the main script of the SCANNER module. It returns motif distances
         to regions of interest by either scanning fasta files on the fly using
-        fimo or homer or by using bedtools closest on a center bed file and 
-        a database of bed files corresponding to motif hits across the genome
+        fimo or numpy or by finding the closest hit to region centers within
+        an index of motif hits across the genome (see genome_hits module)
 
     Parameters
     ----------
@@ -71,7 +80,7 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
         motif hits
     genomehits : str
         Full path to a folder containing bed files of motif hits across the 
-        genome
+        genome or a genome hits index
     fimo_background : int, str, or boolean
         Defines whether to use a background file when performing fimo motif
         scanning. A user can specify any int for window size, smallwindow, 
@@ -91,24 +100,50 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
     debug : boolean
         Whether to print debug statements specifically within the multiprocess
         module
+    fimo_batch_size : int, str, or boolean
+        Number of motifs to scan within a single fimo call. If 'auto', the
+        number is chosen based on cpus. If False, one motif per call.
+    scan_cache : str or boolean
+        Full path to a directory containing cached genomic motif hits (see
+        hit_cache module) and markov backgrounds shared between runs. False if
+        not desired. Hits are only cached when scanning regions from bed files
+        with fimo or numpy.
+    pwm_scan : str
+        Scanning algorithm used by the numpy scanner. 'full' scores every
+        position in full. 'lookahead' abandons positions once they can no 
+        longer reach the score cutoff. Both give identical hits.
+    largewindows : list or boolean
+        Large window sizes to derive from a single scan at largewindow (the
+        largest). Distances for each smaller window are stored in 
+        config.vars['SCAN_VARIANTS'] (see select_variant) and saved to a 
+        largewindow_<size> folder within the output. Only supported for bed
+        file inputs with fimo or numpy and for genome hits.
+    fimo_threshs : list or boolean
+        P-value thresholds to derive from a single scan at fimo_thresh (the
+        loosest). The p-value of the best hit in each region is kept and 
+        regions whose best hit does not pass a stricter threshold are 
+        treated as having no hit. Results are stored and saved as for 
+        largewindows (to a fimo_thresh_<value> folder) for every combination
+        of window and threshold. Only supported for bed file inputs with 
+        numpy.
+    all_hits : boolean
+        Whether to keep every hit within each region (see 
+        distance_matrix.HitMatrix) in addition to the best hit. Only 
+        supported for bed file inputs with fimo or numpy.
+    hit_summary : str
+        How the hits within each region are summarized as the distance used
+        by ENRICHMENT (see distance_matrix.HitMatrix.summary). Anything but
+        'best' requires all_hits.
 
     Returns
     -------
-    motif_distances : list of lists
-        A list containing a list for each motif scanned. For each motif, the 
-        list begins with the motif name as a string and is followed by int
-        values corresponding to the motif distance for each region (ranked). A
-        '.' value means the motif was not within the given region
-    md_distances1 : list of lists
-        A list containing a list for each motif scanned. For each motif, the 
-        list begins with the motif name as a string and is followed by int
-        values corresponding to the motif distance for each region (ranked). A
-        '.' value means the motif was not within the given region
-    md_distances2 : list of lists
-        A list containing a list for each motif scanned. For each motif, the 
-        list begins with the motif name as a string and is followed by int
-        values corresponding to the motif distance for each region (ranked). A
-        '.' value means the motif was not within the given region
+    motif_distances : DistanceMatrix
+        A motif x region matrix of motif distances for each region (ranked).
+        Regions without a motif hit are stored as no hit values.
+    md_distances1 : DistanceMatrix
+        A motif x region matrix of motif distances for md_fasta1 regions
+    md_distances2 : DistanceMatrix
+        A motif x region matrix of motif distances for md_fasta2 regions
 
     Raises
     ------
@@ -146,6 +181,13 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
         pvals = config.vars['PVALS']
         cpus = config.vars['CPUS']
         jobid = config.vars['JOBID']
+        fimo_batch_size = config.vars['FIMO_BATCH']
+        scan_cache = config.vars['SCAN_CACHE']
+        pwm_scan = config.vars['PWM_SCAN']
+        largewindows = config.vars['LARGEWINDOWS']
+        fimo_threshs = config.vars['FIMO_THRESHS']
+        all_hits = config.vars['ALL_HITS']
+        hit_summary = config.vars['HIT_SUMMARY']
 
     print("Scanning regions using " + scanner + "...", flush=True, file=sys.stderr)
 
@@ -155,12 +197,37 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
     mdd_distances1 = None
     mdd_distances2 = None
 
-    if not fasta_file and scanner != 'genome hits':
+    #Regions from bed files are merged into non-redundant genomic intervals
+    #and scanned once for all region sets. User provided fasta files lack
+    #genomic coordinates and are scanned separately.
+    user_fasta = any([fasta_file, md_fasta1, md_fasta2, mdd_fasta1, mdd_fasta2])
+    merged = scanner in ['fimo', 'numpy'] and not user_fasta
+
+    #Smaller large windows are derived from the same scan
+    windows = [largewindow] + [int(window) for window in (largewindows or [])
+                                if window < largewindow]
+    if len(windows) > 1 and not (merged or scanner == 'genome hits'):
+        raise exceptions.InputError("Multiple large windows require bed file "
+                                    "inputs with fimo or numpy scanning or "
+                                    "genome hits.")
+
+    #Stricter p-value thresholds are derived from the same scan
+    threshs = [fimo_thresh] + [float(thresh) for thresh in (fimo_threshs or [])
+                                if float(thresh) < float(fimo_thresh)]
+    if len(threshs) > 1 and not (merged and scanner == 'numpy'):
+        raise exceptions.InputError("Multiple p-value thresholds require bed "
+                                    "file inputs with numpy scanning.")
+    variants = list(itertools.product(windows, threshs))
+    if all_hits and not merged:
+        raise exceptions.InputError("Keeping all hits requires bed file "
+                                    "inputs with fimo or numpy scanning.")
+
+    if not fasta_file and scanner != 'genome hits' and not merged:
         fasta_file = getfasta(bedfile=ranked_file, genomefasta=genomefasta, 
                                 tempdir=tempdir, outname='ranked_file.fa')
         if os.stat(fasta_file).st_size == 0:
             raise exceptions.FileEmptyError("Error in SCANNER module. Converting RANKED_FILE to fasta failed.")
-    if md:
+    if md and not merged:
         if not md_fasta1:
             md_fasta1 = getfasta(bedfile=md_bedfile1, genomefasta=genomefasta, 
                                 tempdir=tempdir, outname='md1_fasta.fa')
@@ -169,7 +236,7 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
                                 tempdir=tempdir, outname='md2_fasta.fa')
         if os.stat(md_fasta1).st_size == 0 or os.stat(md_fasta2).st_size == 0:
             raise exceptions.FileEmptyError("Error in SCANNER module. Converting MD bedfiles to fasta failed.")
-    if mdd:
+    if mdd and not merged:
         if not mdd_fasta1:
             mdd_fasta1 = getfasta(bedfile=mdd_bedfile1, genomefasta=genomefasta, 
                                 tempdir=tempdir, outname='mdd1_fasta.fa')
@@ -179,30 +246,109 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
         if os.stat(mdd_fasta1).st_size == 0 or os.stat(mdd_fasta2).st_size == 0:
             raise exceptions.FileEmptyError("Error in SCANNER module. Converting MDD bedfiles to fasta failed.")
 
+    #MERGED FIMO/NUMPY
+    if merged:
+        background_file = get_background_file(fimo_background=fimo_background,
+                                                fasta_file=fasta_file,
+                                                largewindow=largewindow,
+                                                smallwindow=smallwindow,
+                                                tempdir=tempdir,
+                                                ranked_file=ranked_file,
+                                                genomefasta=genomefasta,
+                                                cache_dir=scan_cache)
+
+        #Get motifs to scan through
+        if singlemotif != False:
+            motif_list = singlemotif.split(',')
+        else:
+            motif_list = fimo_motif_names(motifdatabase=fimo_motifs)
+        motif_batches = fimo_batches(motif_list=motif_list, cpus=cpus, 
+                                        batch_size=fimo_batch_size)
+
+        pwms = meme_pssms(motifdatabase=fimo_motifs, motifs=motif_list)
+        if scanner == 'numpy':
+            pwm_list = numpy_pwms(motif_list=motif_list, 
+                                    fimo_motifs=fimo_motifs, 
+                                    background_file=background_file, 
+                                    fimo_thresh=fimo_thresh)
+            pwms = dict((motif, (log_odds, cutoff)) 
+                        for motif, log_odds, cutoff in pwm_list)
+
+        #P-value tables for the scores of best hits
+        tables = None
+        if len(threshs) > 1:
+            tables = dict((motif, table) for motif, (_, table) 
+                            in numpy_pvalue_tables(motif_list=motif_list, 
+                                            fimo_motifs=fimo_motifs, 
+                                            background_file=background_file,
+                                            max_pvalue=fimo_thresh).items())
+
+        #Create cache keys from the contents of the genome, motifs, and 
+        #background as well as the threshold used
+        cache_keys = None
+        pad = 0
+        if scan_cache:
+            genome = hit_cache.genome_fingerprint(genomefasta=genomefasta)
+            if background_file is not None:
+                background_key = Path(background_file).read_bytes()
+            else:
+                background_key = meme_background(motifdatabase=fimo_motifs)
+            cache_keys = dict()
+            for motif, pwm in pwms.items():
+                if scanner == 'numpy':
+                    cache_keys[motif] = hit_cache.cache_key('numpy', genome, 
+                                                            *pwm)
+                else:
+                    cache_keys[motif] = hit_cache.cache_key('fimo', genome, 
+                                                        *pwm, 
+                                                        float(fimo_thresh), 
+                                                        background_key)
+            pad = max([len(pwm[0]) for pwm in pwms.values()]) - 1
+
+        bedfiles = [ranked_file]
+        if md:
+            bedfiles += [md_bedfile1, md_bedfile2]
+        if mdd:
+            bedfiles += [mdd_bedfile1, mdd_bedfile2]
+
+        print("\tTFEA" + (", MD" if md else "") + (", MDD" if mdd else "") 
+                + ":", file=sys.stderr)
+        merged_keywords = dict(bedfiles=bedfiles, genomefasta=genomefasta, 
+                                tempdir=tempdir, largewindow=largewindow, 
+                                scanner=scanner, bg_file=background_file, 
+                                motifdatabase=fimo_motifs, thresh=fimo_thresh,
+                                pwms=pwms if scanner == 'numpy' else None,
+                                scan_cache=scan_cache, cache_keys=cache_keys, 
+                                pad=pad, pwm_scan=pwm_scan, windows=windows,
+                                threshs=threshs, tables=tables, 
+                                all_hits=all_hits)
+        batch_distances = multiprocess.main(function=merged_scan, 
+                                            args=motif_batches, 
+                                            kwargs=merged_keywords, 
+                                            debug=debug, jobid=jobid, 
+                                            cpus=cpus)
+        region_set_distances = [[distances for batch in batch_distances 
+                                    for distances in batch[i]] 
+                                for i in range(len(variants)*len(bedfiles))]
+        variant_distances = dict((variant, region_set_distances[
+                                        i*len(bedfiles):(i+1)*len(bedfiles)])
+                                for i, variant in enumerate(variants))
+        (motif_distances, md_distances1, md_distances2, mdd_distances1, 
+            mdd_distances2) = split_region_sets(
+                                region_set_distances=variant_distances[variants[0]], 
+                                md=md, mdd=mdd)
+
     #FIMO
-    if scanner == 'fimo':
+    elif scanner == 'fimo':
         #Get background file, if none desired set to 'None'
-        if fasta_file and fimo_background:
-            background_file = fasta_markov(tempdir=tempdir, fastafile=fasta_file, order='1')
-        elif fimo_background == 'largewindow':
-            background_file = fimo_background_file(
-                                window=int(largewindow), 
-                                tempdir=tempdir, bedfile=ranked_file, 
-                                genomefasta=genomefasta, order='1')
-        elif fimo_background == 'smallwindow':
-            background_file = fimo_background_file(
-                                window=int(smallwindow), 
-                                tempdir=tempdir, bedfile=ranked_file, 
-                                genomefasta=genomefasta, order='1')
-        elif type(fimo_background) == int:
-            background_file = fimo_background_file(
-                                window=fimo_background, 
-                                tempdir=tempdir, bedfile=ranked_file, 
-                                genomefasta=genomefasta, order='1')
-        elif type(fimo_background) == str:
-            background_file = fimo_background
-        else:
-            background_file = None
+        background_file = get_background_file(fimo_background=fimo_background, 
+                                                fasta_file=fasta_file, 
+                                                largewindow=largewindow, 
+                                                smallwindow=smallwindow, 
+                                                tempdir=tempdir, 
+                                                ranked_file=ranked_file, 
+                                                genomefasta=genomefasta,
+                                                cache_dir=scan_cache)
 
         #Get motifs to scan through
         if singlemotif != False:
@@ -210,6 +356,19 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
         else:
             motif_list = fimo_motif_names(motifdatabase=fimo_motifs)
 
+        #Group motifs so that each fimo call scans a batch of motifs
+        motif_batches = fimo_batches(motif_list=motif_list, cpus=cpus, 
+                                        batch_size=fimo_batch_size)
+
+        #Index region names once so that forked workers share the index
+        region_index(fastafile=fasta_file)
+        if md:
+            region_index(fastafile=md_fasta1)
+            region_index(fastafile=md_fasta2)
+        if mdd:
+            region_index(fastafile=mdd_fasta1)
+            region_index(fastafile=mdd_fasta2)
+
         #Perform fimo on desired motifs
         print("\tTFEA:", file=sys.stderr)
         fimo_keywords = dict(bg_file=background_file, fasta_file=fasta_file, 
@@ -217,9 +376,10 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
                             thresh=fimo_thresh, 
                             largewindow=largewindow)
 
-        motif_distances = multiprocess.main(function=fimo, args=motif_list, 
+        motif_distances = multiprocess.main(function=fimo_batch, args=motif_batches, 
                                             kwargs=fimo_keywords, debug=debug, 
                                             jobid=jobid, cpus=cpus)
+        motif_distances = [distances for batch in motif_distances for distances in batch]
 
         #FIMO for md score fasta files
         if md:
@@ -228,23 +388,22 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
                             tempdir=tempdir, motifdatabase=fimo_motifs, 
                             thresh=fimo_thresh, 
                             largewindow=largewindow)
-            md_distances1 = multiprocess.main(function=fimo, args=motif_list, 
+            md_distances1 = multiprocess.main(function=fimo_batch, args=motif_batches, 
                                                 kwargs=fimo_keywords, 
                                                 debug=debug, jobid=jobid, 
                                                 cpus=cpus)
+            md_distances1 = [distances for batch in md_distances1 for distances in batch]
             
             fimo_keywords = dict(bg_file=background_file, fasta_file=md_fasta2, 
                             tempdir=tempdir, motifdatabase=fimo_motifs, 
                             thresh=fimo_thresh, 
                             largewindow=largewindow)
-            md_distances2 = multiprocess.main(function=fimo, args=motif_list, 
+            md_distances2 = multiprocess.main(function=fimo_batch, args=motif_batches, 
                                                 kwargs=fimo_keywords, 
                                                 debug=debug, jobid=jobid,
                                                 cpus=cpus)
+            md_distances2 = [distances for batch in md_distances2 for distances in batch]
             
-            if use_config:
-                config.vars['MD_DISTANCES1'] = md_distances1
-                config.vars['MD_DISTANCES2'] = md_distances2
         
         if mdd:
             print("\tMDD:", file=sys.stderr)
@@ -253,19 +412,21 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
                             tempdir=tempdir, motifdatabase=fimo_motifs, 
                             thresh=fimo_thresh, 
                             largewindow=largewindow)
-            mdd_distances1 = multiprocess.main(function=fimo, args=motif_list, 
+            mdd_distances1 = multiprocess.main(function=fimo_batch, args=motif_batches, 
                                                 kwargs=fimo_keywords, 
                                                 debug=debug, jobid=jobid,
                                                 cpus=cpus)
+            mdd_distances1 = [distances for batch in mdd_distances1 for distances in batch]
             
             fimo_keywords = dict(bg_file=background_file, fasta_file=mdd_fasta2, 
                             tempdir=tempdir, motifdatabase=fimo_motifs, 
                             thresh=fimo_thresh, 
                             largewindow=largewindow)
-            mdd_distances2 = multiprocess.main(function=fimo, args=motif_list, 
+            mdd_distances2 = multiprocess.main(function=fimo_batch, args=motif_batches, 
                                                 kwargs=fimo_keywords, 
                                                 debug=debug, jobid=jobid,
                                                 cpus=cpus)
+            mdd_distances2 = [distances for batch in mdd_distances2 for distances in batch]
             # mdd_distances1 = []
             # mdd_distances2 = []
             # mdd_sorted_indices = np.argsort(pvals)
@@ -286,117 +447,202 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
             #         mdd_distances2.append([motif] + mdd_sorted_distances[:cutoff])
             #         mdd_distances1.append([motif] + mdd_sorted_distances[cutoff:])
             #     # print(f'\r\t Completed: {i}/{len(motif_distances)} ', end=' ', flush=True, file=sys.stderr)
-            if use_config:
-                config.vars['MDD_DISTANCES1'] = mdd_distances1
-                config.vars['MDD_DISTANCES2'] = mdd_distances2
-            
-    #HOMER
-    elif scanner== 'homer':
-        raise exceptions.InputError("Homer scanning is not supported at this time.")
 
-    #GENOME HITS
-    elif scanner == 'genome hits':
-        #Get motifs to analyze
-        if singlemotif == False:
-            motif_list = os.listdir(genomehits)
+    #NUMPY
+    elif scanner == 'numpy':
+        #Get background, if none desired use the background in the database
+        background_file = get_background_file(fimo_background=fimo_background,
+                                                fasta_file=fasta_file,
+                                                largewindow=largewindow,
+                                                smallwindow=smallwindow,
+                                                tempdir=tempdir,
+                                                ranked_file=ranked_file,
+                                                genomefasta=genomefasta,
+                                                cache_dir=scan_cache)
+
+        #Get motifs to scan through. Log-odds matrices and score cutoffs are
+        #computed once here and passed to each process.
+        if singlemotif != False:
+            motif_list = singlemotif.split(',')
         else:
-            motif_list = [os.path.join(genomehits, motif) for motif in singlemotif.split(',')]
+            motif_list = fimo_motif_names(motifdatabase=fimo_motifs)
+        pwm_list = numpy_pwms(motif_list=motif_list, fimo_motifs=fimo_motifs,
+                                background_file=background_file,
+                                fimo_thresh=fimo_thresh)
 
-        #Perform bedtools closest to get distances
-        ranked_file = get_center(bedfile=ranked_file, outname=ranked_file)
+        #Perform numpy scanning on desired motifs
         print("\tTFEA:", file=sys.stderr)
-        bedtools_distance_keywords = dict(genomehits=genomehits, 
-                                            ranked_center_file=ranked_file, 
-                                            tempdir=tempdir, 
-                                            distance_cutoff=largewindow, 
-                                            rank_index=3)
-        
-        motif_distances = multiprocess.main(function=bedtools_closest, 
-                                            args=motif_list, 
-                                            kwargs=bedtools_distance_keywords, 
-                                            debug=debug, jobid=jobid,
-                                            cpus=cpus)
+        numpy_keywords = dict(encoded_file=fasta_encode(fastafile=fasta_file,
+                                                        tempdir=tempdir),
+                            largewindow=largewindow, pwm_scan=pwm_scan)
+        motif_distances = multiprocess.main(function=numpy_scan, args=pwm_list,
+                                            kwargs=numpy_keywords, debug=debug,
+                                            jobid=jobid, cpus=cpus)
 
-        #GENOME HITS for md score bed files
+        #Numpy scanning for md score fasta files
         if md:
             print("\tMD:", file=sys.stderr)
-            md_bedfile1 = get_center(bedfile=md_bedfile1, outname=md_bedfile1)
-            bedtools_distance_keywords = dict(genomehits=genomehits, 
-                                                ranked_center_file=md_bedfile1, 
-                                                tempdir=tempdir, 
-                                                distance_cutoff=largewindow)
-
-            md_distances1 = multiprocess.main(function=bedtools_closest, 
-                                            args=motif_list, 
-                                            kwargs=bedtools_distance_keywords, 
-                                            debug=debug, jobid=jobid,
-                                            cpus=cpus)
+            numpy_keywords = dict(encoded_file=fasta_encode(fastafile=md_fasta1,
+                                                            tempdir=tempdir),
+                                largewindow=largewindow, pwm_scan=pwm_scan)
+            md_distances1 = multiprocess.main(function=numpy_scan,
+                                                args=pwm_list,
+                                                kwargs=numpy_keywords,
+                                                debug=debug, jobid=jobid,
+                                                cpus=cpus)
 
-            md_bedfile2 = get_center(bedfile=md_bedfile2, outname=md_bedfile2)
-            bedtools_distance_keywords = dict(genomehits=genomehits, 
-                                                ranked_center_file=md_bedfile2, 
-                                                tempdir=tempdir, 
-                                                distance_cutoff=largewindow)
+            numpy_keywords = dict(encoded_file=fasta_encode(fastafile=md_fasta2,
+                                                            tempdir=tempdir),
+                                largewindow=largewindow, pwm_scan=pwm_scan)
+            md_distances2 = multiprocess.main(function=numpy_scan,
+                                                args=pwm_list,
+                                                kwargs=numpy_keywords,
+                                                debug=debug, jobid=jobid,
+                                                cpus=cpus)
 
-            md_distances2 = multiprocess.main(function=bedtools_closest, 
-                                            args=motif_list, 
-                                            kwargs=bedtools_distance_keywords, 
-                                            debug=debug, jobid=jobid,
-                                            cpus=cpus)
-            if use_config:
-                config.vars['MD_DISTANCES1'] = md_distances1
-                config.vars['MD_DISTANCES2'] = md_distances2
         if mdd:
             print("\tMDD:", file=sys.stderr)
-            print(f'\t Completed: 0/{len(motif_distances)} ', end=' ', file=sys.stderr)
-            mdd_bedfile1 = get_center(bedfile=mdd_bedfile1, outname=mdd_bedfile1)
-            bedtools_distance_keywords = dict(genomehits=genomehits, 
-                                                ranked_center_file=mdd_bedfile1, 
-                                                tempdir=tempdir, 
-                                                distance_cutoff=largewindow)
+            numpy_keywords = dict(encoded_file=fasta_encode(fastafile=mdd_fasta1,
+                                                            tempdir=tempdir),
+                                largewindow=largewindow, pwm_scan=pwm_scan)
+            mdd_distances1 = multiprocess.main(function=numpy_scan,
+                                                args=pwm_list,
+                                                kwargs=numpy_keywords,
+                                                debug=debug, jobid=jobid,
+                                                cpus=cpus)
 
-            mdd_distances1 = multiprocess.main(function=bedtools_closest, 
-                                            args=motif_list, 
-                                            kwargs=bedtools_distance_keywords, 
-                                            debug=debug, jobid=jobid,
-                                            cpus=cpus)
+            numpy_keywords = dict(encoded_file=fasta_encode(fastafile=mdd_fasta2,
+                                                            tempdir=tempdir),
+                                largewindow=largewindow, pwm_scan=pwm_scan)
+            mdd_distances2 = multiprocess.main(function=numpy_scan,
+                                                args=pwm_list,
+                                                kwargs=numpy_keywords,
+                                                debug=debug, jobid=jobid,
+                                                cpus=cpus)
 
-            mdd_bedfile2 = get_center(bedfile=mdd_bedfile2, outname=mdd_bedfile2)
-            bedtools_distance_keywords = dict(genomehits=genomehits, 
-                                                ranked_center_file=mdd_bedfile2, 
-                                                tempdir=tempdir, 
-                                                distance_cutoff=largewindow)
+    #HOMER
+    elif scanner== 'homer':
+        raise exceptions.InputError("Homer scanning is not supported at this time.")
 
-            mdd_distances2 = multiprocess.main(function=bedtools_closest, 
-                                            args=motif_list, 
-                                            kwargs=bedtools_distance_keywords, 
-                                            debug=debug, jobid=jobid,
-                                            cpus=cpus)
-            # mdd_distances1 = []
-            # mdd_distances2 = []
-            # mdd_sorted_indices = np.argsort(pvals)
-            # for i, single_motif_distances in enumerate(motif_distances, 1):
-            #     motif = single_motif_distances[0]
-            #     mdd_distances = single_motif_distances[1:]
-            #     mdd_sorted_distances = [mdd_distances[i] for i in mdd_sorted_indices]
-            #     if mdd_percent != False:
-            #         cutoff = int(len(mdd_sorted_distances)*mdd_percent)
-            #         mdd_distances2.append([motif] + mdd_sorted_distances[:cutoff])
-            #         mdd_distances1.append([motif] + mdd_sorted_distances[cutoff:])
-            #     else:
-            #         sorted_pvals = [pvals[i] for i in mdd_sorted_indices]
-            #         cutoff = int(len([p for p in sorted_pvals if p < mdd_pval]))
-            #         mdd_distances2.append([motif] + mdd_sorted_distances[:cutoff])
-            #         mdd_distances1.append([motif] + mdd_sorted_distances[cutoff:])
-            #    # print(f'\r\t Completed: {i}/{len(motif_distances)} ', end=' ', flush=True, file=sys.stderr)
-            if use_config:
-                config.vars['MDD_DISTANCES1'] = mdd_distances1
-                config.vars['MDD_DISTANCES2'] = mdd_distances2
+    #GENOME HITS
+    elif scanner == 'genome hits':
+        #Load (or build from bed files) a binary index of genome-wide hits
+        index_dir = genome_hits.get_index(genomehits=genomehits, 
+                                            tempdir=tempdir, cpus=cpus, 
+                                            debug=debug, jobid=jobid)
+        index = genome_hits.load_index(index_dir=index_dir)
+
+        #Get motifs to analyze
+        if singlemotif == False:
+            motif_list = sorted(index)
+        else:
+            motif_list = [genome_hits.motif_name(motif) 
+                            for motif in singlemotif.split(',')]
+        motif_batches = fimo_batches(motif_list=motif_list, cpus=cpus, 
+                                        batch_size='auto')
+
+        bedfiles = [ranked_file]
+        if md:
+            bedfiles += [md_bedfile1, md_bedfile2]
+        if mdd:
+            bedfiles += [mdd_bedfile1, mdd_bedfile2]
+        region_sets = [genome_hits.region_centers(bedfile=bedfile) 
+                        for bedfile in bedfiles]
+
+        #Find distances to the closest hit for all region sets
+        print("\tTFEA" + (", MD" if md else "") + (", MDD" if mdd else "") 
+                + ":", file=sys.stderr)
+        closest_keywords = dict(index_dir=index_dir, index=index, 
+                                region_sets=region_sets, 
+                                distance_cutoff=largewindow)
+        batch_distances = multiprocess.main(
+                                    function=genome_hits.closest_distances, 
+                                    args=motif_batches, 
+                                    kwargs=closest_keywords, debug=debug, 
+                                    jobid=jobid, cpus=cpus)
+        region_set_distances = [[distances for batch in batch_distances 
+                                    for distances in batch[i]] 
+                                for i in range(len(bedfiles))]
+        (motif_distances, md_distances1, md_distances2, mdd_distances1, 
+            mdd_distances2) = split_region_sets(
+                                region_set_distances=region_set_distances, 
+                                md=md, mdd=mdd)
+
+        #The closest hit is the same for all windows, only the cutoff differs
+        variant_distances = dict(((window, fimo_thresh), [[(motif, np.where(
+                                            np.abs(distances) > window, 
+                                            np.nan, distances)) 
+                                        for motif, distances in region_set]
+                                        for region_set in region_set_distances])
+                                for window in windows[1:])
     else:
         raise exceptions.InputError("SCANNER option not recognized.")
 
+    #Store distances as compact motif x region matrices
+    matrices = [scan_matrices(rows=rows) for rows in [motif_distances, 
+                md_distances1, md_distances2, mdd_distances1, mdd_distances2]]
+    hit_matrices = [hits for _, hits in matrices]
+    (motif_distances, md_distances1, md_distances2, mdd_distances1, 
+        mdd_distances2) = [distances for distances, _ in matrices]
+
+    if use_config:
+        #Save distances so that ENRICHMENT can be rerun without rescanning
+        save_scan_results(scan_results=config.vars['OUTPUT'] / 'scan_results',
+                            motif_distances=motif_distances, 
+                            md_distances1=md_distances1, 
+                            md_distances2=md_distances2, 
+                            mdd_distances1=mdd_distances1, 
+                            mdd_distances2=mdd_distances2, 
+                            pvals=config.vars['PVALS'], 
+                            fcs=config.vars['FCS'], largewindow=largewindow, 
+                            motif_fpkm=config.vars.get('MOTIF_FPKM', {}),
+                            hit_matrices=hit_matrices)
+
+        #Distances for smaller large windows and stricter thresholds are kept
+        #for ENRICHMENT and OUTPUT reruns (see select_variant) and saved to 
+        #their own folders
+        for window, thresh in variants[1:]:
+            window_matrices = [scan_matrices(rows=rows) 
+                                for rows in split_region_sets(
+                                    region_set_distances=variant_distances[
+                                                            (window, thresh)],
+                                    md=md, mdd=mdd)]
+            window_vars = dict(zip(SCAN_RESULTS + HIT_RESULTS, 
+                                    [distances for distances, _ in window_matrices]
+                                    + [hits for _, hits in window_matrices]))
+            name = variant_name(largewindow=largewindow, 
+                                fimo_thresh=fimo_thresh, window=window, 
+                                thresh=thresh)
+            outputdir = config.vars['OUTPUT'] / name
+            save_scan_results(scan_results=outputdir / 'scan_results',
+                            motif_distances=window_vars['MOTIF_DISTANCES'], 
+                            md_distances1=window_vars['MD_DISTANCES1'], 
+                            md_distances2=window_vars['MD_DISTANCES2'], 
+                            mdd_distances1=window_vars['MDD_DISTANCES1'], 
+                            mdd_distances2=window_vars['MDD_DISTANCES2'], 
+                            pvals=config.vars['PVALS'], 
+                            fcs=config.vars['FCS'], largewindow=window, 
+                            motif_fpkm=config.vars.get('MOTIF_FPKM', {}),
+                            hit_matrices=[window_vars[hits_name] 
+                                            for hits_name in HIT_RESULTS])
+            summarize_hits(scan_results=window_vars, hit_summary=hit_summary)
+            window_vars.update(LARGEWINDOW=window, FIMO_THRESH=thresh, 
+                                OUTPUT=outputdir, 
+                                FIGUREDIR=outputdir / 'plots', META_PROFILE={})
+            config.vars['SCAN_VARIANTS'][name] = window_vars
+
+    #Distances used by ENRICHMENT may instead summarize all hits
+    results = summarize_hits(scan_results=dict(zip(SCAN_RESULTS + HIT_RESULTS,
+                                    [motif_distances, md_distances1, 
+                                    md_distances2, mdd_distances1, 
+                                    mdd_distances2] + hit_matrices)), 
+                            hit_summary=hit_summary)
+    (motif_distances, md_distances1, md_distances2, mdd_distances1, 
+        mdd_distances2) = [results[name] for name in SCAN_RESULTS]
     if use_config:
-        config.vars['MOTIF_DISTANCES'] = motif_distances
+        for name, matrix in results.items():
+            if matrix is not None:
+                config.vars[name] = matrix
 
     total_time = time.time() - start_time
     if use_config:
@@ -422,10 +668,255 @@ def main(use_config=True, fasta_file=False, md_fasta1=False, md_fasta2=False,
     return motif_distances, md_distances1, md_distances2, mdd_distances1, mdd_distances2
 
 #Functions
+#==============================================================================
+def split_region_sets(region_set_distances=None, md=False, mdd=False):
+    '''Splits per region set results ordered as ranked_file, md bed files 
+        and mdd bed files (see merged_scan)
+
+    Returns
+    -------
+    motif_distances, md_distances1, md_distances2, mdd_distances1, 
+    mdd_distances2 : list or None
+        None for region sets that were not scanned
+    '''
+    md_distances = [None, None]
+    mdd_distances = [None, None]
+    if md:
+        md_distances = region_set_distances[1:3]
+    if mdd:
+        mdd_distances = region_set_distances[-2:]
+
+    return tuple([region_set_distances[0]] + list(md_distances) 
+                    + list(mdd_distances))
+
+#==============================================================================
+def variant_name(largewindow=None, fimo_thresh=None, window=None, 
+                    thresh=None):
+    '''Returns the output folder name of a smaller large window and/or 
+        stricter p-value threshold derived from a scan at largewindow and 
+        fimo_thresh (e.g. largewindow_1000_fimo_thresh_1e-07)
+    '''
+    name = list()
+    if window != largewindow:
+        name.append(f'largewindow_{window}')
+    if thresh != fimo_thresh:
+        name.append(f'fimo_thresh_{float(thresh):g}')
+
+    return '_'.join(name)
+
+#==============================================================================
+def select_variant(name=None):
+    '''Replaces SCANNER results in config with those of a smaller large 
+        window or stricter p-value threshold derived from the same scan (see
+        main) so that ENRICHMENT and OUTPUT can be run for it. Output is 
+        written to a folder within the output directory (see variant_name).
+        Meta profiles are only computed for the original scan and so are not
+        plotted.
+    '''
+    from TFEA import config
+    variant_vars = config.vars['SCAN_VARIANTS'][name]
+    variant_vars['FIGUREDIR'].mkdir(exist_ok=True, parents=True)
+    config.vars.update(variant_vars)
+
+#==============================================================================
+def scan_matrices(rows=None):
+    '''Converts the rows of a single region set returned by scanning functions
+        into a DistanceMatrix and, if rows contain all hits (see 
+        merged_scan), a HitMatrix
+
+    Returns
+    -------
+    distances : DistanceMatrix or None
+        None if rows is None
+    hits : HitMatrix or None
+        None if rows do not contain all hits
+    '''
+    if rows is None:
+        return None, None
+    if len(rows) == 0 or len(rows[0]) == 2:
+        return distance_matrix.DistanceMatrix.from_rows(rows), None
+
+    return (distance_matrix.DistanceMatrix.from_rows([(motif, distances) 
+                                        for motif, distances, _ in rows]),
+            distance_matrix.HitMatrix.from_rows([(motif, hits) 
+                                        for motif, _, hits in rows], 
+                                        regions=len(rows[0][1])))
+
+#==============================================================================
+def summarize_hits(scan_results=None, hit_summary='best'):
+    '''Replaces distances in scan_results with a summary of all hits within
+        each region (see distance_matrix.HitMatrix.summary). Distances are 
+        already those of the best hit so 'best' leaves them unchanged.
+
+    Parameters
+    ----------
+    scan_results : dict
+        SCAN_RESULTS and HIT_RESULTS names as keys and matrices (or None) as
+        values. Modified in place.
+    hit_summary : str
+        one of distance_matrix.HIT_SUMMARIES
+
+    Returns
+    -------
+    scan_results : dict
+
+    Raises
+    ------
+    InputError
+        If all hits were not kept for a set of distances
+    '''
+    if hit_summary == 'best':
+        return scan_results
+    for name, hits_name in zip(SCAN_RESULTS, HIT_RESULTS):
+        if scan_results.get(name) is None:
+            continue
+        if scan_results.get(hits_name) is None:
+            raise exceptions.InputError("HIT_SUMMARY '" + str(hit_summary) 
+                                        + "' requires all hits. Scan with "
+                                        "ALL_HITS.")
+        scan_results[name] = scan_results[hits_name].summary(
+                                                        retain=hit_summary)
+
+    return scan_results
+
+#==============================================================================
+#Names of distance matrices saved within a scan_results directory
+SCAN_RESULTS = ['MOTIF_DISTANCES', 'MD_DISTANCES1', 'MD_DISTANCES2', 
+                'MDD_DISTANCES1', 'MDD_DISTANCES2']
+
+#Names of all hit matrices saved within a scan_results directory (in the 
+#same order as SCAN_RESULTS)
+HIT_RESULTS = ['MOTIF_HITS', 'MD_HITS1', 'MD_HITS2', 'MDD_HITS1', 
+                'MDD_HITS2']
+
+#==============================================================================
+def save_scan_results(scan_results=None, motif_distances=None, 
+                        md_distances1=None, md_distances2=None, 
+                        mdd_distances1=None, mdd_distances2=None, pvals=None, 
+                        fcs=None, largewindow=None, motif_fpkm=None, 
+                        hit_matrices=None):
+    '''Saves SCANNER output to a directory so that TFEA can be restarted 
+        at the ENRICHMENT module using --scan_results. Distance matrices are
+        saved as .npy files that are memory-mapped when loaded.
+
+    Parameters
+    ----------
+    scan_results : pathlib.Path
+        full path to a directory to save results to
+    motif_distances : DistanceMatrix
+        distances to ranked regions
+    md_distances1, md_distances2, mdd_distances1, mdd_distances2 : 
+        DistanceMatrix or None
+        distances for md and mdd analysis (None if not performed)
+    pvals : list
+        p-values for each ranked region (from the RANK module)
+    fcs : list
+        fold changes for each ranked region (from the RANK module)
+    largewindow : int
+        half-length of scanned regions
+    motif_fpkm : dict
+        motif annotation FPKM values (from the RANK module)
+    hit_matrices : list or None
+        HitMatrix (or None) for each set of distances if all hits were kept
+    '''
+    matrices = [motif_distances, md_distances1, md_distances2, 
+                mdd_distances1, mdd_distances2]
+    if hit_matrices is None:
+        hit_matrices = [None]*len(HIT_RESULTS)
+    scan_results.mkdir(exist_ok=True, parents=True)
+    for name, matrix in zip(SCAN_RESULTS + HIT_RESULTS, 
+                            matrices + list(hit_matrices)):
+        if matrix is not None:
+            matrix.save(scan_results / name.lower())
+        elif (scan_results / name.lower()).exists():
+            shutil.rmtree(scan_results / name.lower())
+    np.save(scan_results / 'pvals.npy', np.asarray(pvals, dtype=float))
+    np.save(scan_results / 'fcs.npy', np.asarray(fcs, dtype=float))
+    info = dict(largewindow=largewindow, motif_fpkm=motif_fpkm)
+    (scan_results / 'scan_info.json').write_text(ujson.dumps(info))
+
+#==============================================================================
+def load_scan_results(use_config=True, scan_results=None, md=None, mdd=None,
+                        hit_summary='best'):
+    '''Loads SCANNER output saved by save_scan_results. This replaces the
+        COMBINE, RANK, and SCANNER modules when --scan_results is specified.
+
+    Parameters
+    ----------
+    use_config : boolean
+        Whether to use a config module to assign variables.
+    scan_results : pathlib.Path
+        full path to a directory created by save_scan_results
+    md : boolean
+        whether md distances are required
+    mdd : boolean
+        whether mdd distances are required
+    hit_summary : str
+        how all hits within each region are summarized as distances (see 
+        summarize_hits)
+
+    Returns
+    -------
+    scan_results : dict
+        SCAN_RESULTS names as keys and DistanceMatrix (or None) as values and
+        HIT_RESULTS names as keys and HitMatrix (or None) as values. Also 
+        contains 'PVALS', 'FCS', 'LARGEWINDOW', and 'MOTIF_FPKM' keys.
+
+    Raises
+    ------
+    InputError
+        If md or mdd distances are required but were not saved
+    '''
+    start_time = time.time()
+    if use_config:
+        from TFEA import config
+        scan_results = config.vars['SCAN_RESULTS']
+        md = config.vars['MD']
+        mdd = config.vars['MDD']
+        hit_summary = config.vars['HIT_SUMMARY']
+
+    print("Loading scan results...", end=' ', flush=True, file=sys.stderr)
+    results = dict()
+    for name in SCAN_RESULTS + HIT_RESULTS:
+        if (scan_results / name.lower()).exists():
+            results[name] = distance_matrix.load(scan_results / name.lower())
+        else:
+            results[name] = None
+    if results['MOTIF_DISTANCES'] is None:
+        raise exceptions.InputError("No motif distances found in " 
+                                    + str(scan_results))
+    if md and (results['MD_DISTANCES1'] is None 
+                or results['MD_DISTANCES2'] is None):
+        raise exceptions.InputError("MD specified but scan results do not "
+                                    "contain MD distances.")
+    if mdd and (results['MDD_DISTANCES1'] is None 
+                or results['MDD_DISTANCES2'] is None):
+        raise exceptions.InputError("MDD specified but scan results do not "
+                                    "contain MDD distances.")
+    info = ujson.loads((scan_results / 'scan_info.json').read_text())
+    results['PVALS'] = np.load(scan_results / 'pvals.npy')
+    results['FCS'] = np.load(scan_results / 'fcs.npy')
+    results['LARGEWINDOW'] = info['largewindow']
+    results['MOTIF_FPKM'] = info['motif_fpkm']
+    summarize_hits(scan_results=results, hit_summary=hit_summary)
+
+    if use_config:
+        for key in results:
+            if results[key] is not None:
+                config.vars[key] = results[key]
+        config.vars['META_PROFILE'] = False
+        config.vars['SCANNERtime'] = time.time() - start_time
+
+    print("done in: " + str(datetime.timedelta(seconds=int(time.time()-start_time))), 
+            file=sys.stderr)
+
+    return results
+
 #==============================================================================
 def getfasta(bedfile=None, genomefasta=None, tempdir=None, outname=None):
-    '''Converts a bed file to a fasta file using bedtools. Outputs into the 
-        tempdir directory created by TFEA.
+    '''Converts a bed file to a fasta file by reading region sequences from 
+        the indexed genome in-process (see genome_fasta module). Outputs into
+        the tempdir directory created by TFEA.
 
     Parameters
     ----------
@@ -445,20 +936,9 @@ def getfasta(bedfile=None, genomefasta=None, tempdir=None, outname=None):
         fasta format 
     '''
     fasta_file = tempdir / outname
-    #pybedtools implementation (incomplete)
-    # pybed = BedTool(bedfile).sequence(fi=genomefasta).saveas(fasta_file)
-
-    getfasta_command = ["bedtools", "getfasta",
-                        "-fi", genomefasta, 
-                        "-bed", bedfile,
-                        "-fo", fasta_file]
-    
-    try:
-        subprocess.run(getfasta_command, check=True, 
-                        stdout=subprocess.PIPE, 
-                        stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        raise exceptions.SubprocessError(e.stderr.decode())
+    chroms, starts, stops = read_bed_regions(bedfile=bedfile)
+    genome_fasta.write_fasta(genomefasta=genomefasta, chroms=chroms, 
+                                starts=starts, stops=stops, outfile=fasta_file)
 
     return fasta_file
 
@@ -481,63 +961,153 @@ def fasta_names(fastafile=None):
                 names.append(line[1:].strip('\n'))
     
     return names
-            
+
 #==============================================================================
-def fimo_background_file(window=None, tempdir=None, bedfile=None, 
-                            genomefasta=None, order=None):
-    background_bed_file = tempdir / "fimo_background.bed"
-    outfile = open(background_bed_file,'w')
-    with open(bedfile) as F:
-        F.readline()
-        for line in F:
-            chrom, start, stop, name = line.strip('\n').split('\t')
-            center = (int(start)+int(stop))/2
-            start = int(center - window)
-            stop = int(center + window)
-            outfile.write('\t'.join([chrom, str(start), str(stop), name]) + '\n')
-    outfile.close()
-    
-    getfasta(bedfile=background_bed_file, 
-                                genomefasta=genomefasta, tempdir=tempdir, 
-                                outname='fimo_background.fa')
+def get_background_file(fimo_background=None, fasta_file=None,
+                        largewindow=None, smallwindow=None, tempdir=None,
+                        ranked_file=None, genomefasta=None, cache_dir=None,
+                        order=1):
+    '''Decides which markov background file to use when scanning based on the
+        user specified fimo_background option. Backgrounds are computed 
+        in-process and cached by a hash of the sequences they are computed 
+        from so that they are only computed once for a given region set.
+
+    Parameters
+    ----------
+    fimo_background : int, str, or boolean
+        'largewindow', 'smallwindow', an int window size, a full path to a
+        background file, or False if no background is desired
+    fasta_file : str
+        full path to a fasta file of regions. If specified, the background is
+        computed from all of its sequences rather than from windows around
+        ranked_file regions.
+    ranked_file : str
+        full path to a bed file of regions. The background is computed from
+        windows (of the size specified by fimo_background) around the center
+        of each region.
+    cache_dir : str or None
+        full path to a directory where computed backgrounds are cached. If 
+        None, tempdir is used.
+    order : int
+        markov model order
+
+    Returns
+    -------
+    background_file : str or None
+        full path to a markov background file. None if no background desired.
+    '''
+    if fimo_background == False:
+        return None
+    elif fimo_background == 'largewindow':
+        window = int(largewindow)
+    elif fimo_background == 'smallwindow':
+        window = int(smallwindow)
+    elif type(fimo_background) == int:
+        window = fimo_background
+    elif type(fimo_background) == str:
+        return fimo_background
+    else:
+        return None
+
+    if fasta_file:
+        with open(fasta_file, 'rb') as F:
+            key = hit_cache.cache_key('markov', order, F.read())
+    else:
+        chroms, starts, stops = background_windows(bedfile=ranked_file, 
+                                                    window=window, 
+                                                    genomefasta=genomefasta)
+        key = hit_cache.cache_key('markov', order, 
+                                    hit_cache.genome_fingerprint(
+                                                    genomefasta=genomefasta),
+                                    '\t'.join(chroms), starts, stops)
+
+    background_dir = Path(cache_dir if cache_dir else tempdir) / 'backgrounds'
+    background_file = background_dir / (key + '.txt')
+    if not background_file.exists():
+        if fasta_file:
+            encoded, _ = fasta_encode_flat(fastafile=fasta_file)
+        else:
+            encoded, _ = genome_fasta.encode_regions(genomefasta=genomefasta,
+                                                        chroms=chroms, 
+                                                        starts=starts, 
+                                                        stops=stops, 
+                                                        table=encoding_table())
+        background_dir.mkdir(exist_ok=True, parents=True)
+        write_markov_background(encoded=encoded, order=order, 
+                                outfile=background_file)
 
-    fasta_file = tempdir / 'fimo_background.fa'
-    background_file = fasta_markov(tempdir=tempdir, fastafile=fasta_file, 
-                                    order=order)
-    
     return background_file
 
 #==============================================================================
-def fasta_markov(tempdir=None, fastafile=None, order=None):
-    '''This function runs meme's fasta-get-markov function that generates a 
-        background markov file (for use with fimo) from a fasta file.
+def background_windows(bedfile=None, window=None, genomefasta=None):
+    '''Returns windows of +/- window bp around the center of each region in
+        a bed file, clipped to chromosome ends. Regions on chromosomes not in
+        the genome are skipped.
+    '''
+    chroms, starts, stops = read_bed_regions(bedfile=bedfile)
+    sizes = genome_fasta.chrom_sizes(genomefasta=genomefasta)
+    keep = np.array([chrom in sizes for chrom in chroms], dtype=bool)
+    chroms, starts, stops = chroms[keep], starts[keep], stops[keep]
+    centers = (starts + stops)//2
+    chrom_sizes = np.array([sizes[chrom] for chrom in chroms], dtype=np.int64)
+    starts = np.clip(centers - window, 0, chrom_sizes)
+    stops = np.clip(centers + window, 0, chrom_sizes)
 
-    Parameters
-    ----------
-    tempdir : string
-        full path to temp directory in output directory (created by TFEA)
+    return chroms, starts, stops
 
-    fastafile : string
-        full path to fasta file that will be used to generate the markov
-        background model file
+#==============================================================================
+def markov_counts(encoded=None, k=None):
+    '''Counts all k-mers within encoded sequences (see fasta_encode_flat) on
+        both strands. K-mers containing a non-ACGT character are skipped.
 
-    order : string
-        an integer formatted as a string where a user may specify what order
-        markov model they would like (default='0')
-        
     Returns
     -------
-    None
+    counts : np.ndarray
+        k-mer counts indexed by base 4 k-mer value (e.g. AC = 0*4 + 1)
     '''
-    markov_background = tempdir / "markov_background.txt"
-    try:
-        with open(markov_background, 'w') as output:
-            subprocess.run(["fasta-get-markov", "-m", order, fastafile],
-                            stdout=output, stderr=subprocess.PIPE)
-    except subprocess.CalledProcessError as e:
-        raise exceptions.SubprocessError(e.stderr.decode())
-        
-    return markov_background
+    n = len(encoded) - k + 1
+    if n <= 0:
+        return np.zeros(4**k, dtype=np.int64)
+    index = np.zeros(n, dtype=np.int64)
+    valid = np.ones(n, dtype=bool)
+    for j in range(k):
+        window = encoded[j:j+n]
+        valid &= window < 4
+        index = index*4 + np.minimum(window, 3)
+    counts = np.bincount(index[valid], minlength=4**k)
+
+    #Add reverse complement counts. Complementing a base is 3 - base in 
+    #ALPHABET order.
+    kmers = np.arange(4**k)
+    reverse = np.zeros(4**k, dtype=np.int64)
+    for j in range(k):
+        reverse = reverse*4 + (3 - (kmers//4**j)%4)
+
+    return counts + counts[reverse]
+
+#==============================================================================
+def write_markov_background(encoded=None, order=None, outfile=None, 
+                            pseudocount=0.1):
+    '''Writes a markov background file in the format generated by 
+        fasta-get-markov (k-mer frequencies for k = 1 to order + 1, combining 
+        both strands). The file is written to a temporary name and renamed so
+        that concurrent jobs can share cached backgrounds.
+    '''
+    lines = list()
+    for k in range(1, order + 2):
+        counts = markov_counts(encoded=encoded, k=k)
+        frequencies = ((counts + pseudocount)
+                        / (counts.sum() + pseudocount*len(counts)))
+        lines.append(f'# order {k-1}\n')
+        for kmer, frequency in zip(itertools.product(ALPHABET, repeat=k), 
+                                    frequencies):
+            lines.append(f'{"".join(kmer)} {frequency:.3e}\n')
+
+    tmp_file = Path(str(outfile) + '.' + uuid.uuid4().hex + '.tmp')
+    tmp_file.write_text(''.join(lines))
+    os.replace(tmp_file, outfile)
+
+    return outfile
 
 #==============================================================================
 def fimo(motif, bg_file=None, fasta_file=None, tempdir=None, 
@@ -565,40 +1135,308 @@ def fimo(motif, bg_file=None, fasta_file=None, tempdir=None,
         
     Returns
     -------
-    fimo_out : string
-        full path to where fimo output which is stored within the tempdir 
-        directory.
+    motif_distances : tuple
+        the motif name and an array of the distance of the best motif hit for 
+        each sequence (in fasta order). np.nan means there was no hit.
+    '''
+    return fimo_batch([motif], bg_file=bg_file, fasta_file=fasta_file, 
+                        tempdir=tempdir, motifdatabase=motifdatabase, 
+                        thresh=thresh, largewindow=largewindow)[0]
+
+#==============================================================================
+def fimo_batches(motif_list=None, cpus=1, batch_size='auto',
+                    batches_per_cpu=4):
+    '''Splits a list of motifs into batches that are each scanned within a
+        single fimo call. This avoids paying fimo startup, fasta loading and
+        background parsing costs for every motif.
+
+    Parameters
+    ----------
+    motif_list : list
+        motif names to scan
+    cpus : int
+        number of processes that will run fimo in parallel
+    batch_size : int, str, or boolean
+        number of motifs per batch. If 'auto', batches are sized so that each
+        process receives batches_per_cpu batches (to keep all processes busy
+        when some batches take longer than others). If False, each motif is
+        scanned on its own.
+    batches_per_cpu : int
+        number of batches each process receives when batch_size is 'auto'
+
+    Returns
+    -------
+    motif_batches : list of lists
+        motif names grouped into batches
     '''
-    fimo_out = tempdir / (motif+'.fimo.bed')
+    if batch_size == 'auto':
+        batch_size = int(np.ceil(len(motif_list)/float(cpus*batches_per_cpu)))
+    elif batch_size == False:
+        batch_size = 1
+    batch_size = max(1, int(batch_size))
+    motif_batches = [motif_list[i:i+batch_size]
+                        for i in range(0, len(motif_list), batch_size)]
+
+    return motif_batches
+
+#==============================================================================
+def fimo_batch(motifs, bg_file=None, fasta_file=None, tempdir=None,
+                motifdatabase=None, thresh=None, largewindow=None):
+    '''Runs fimo once on a given fastafile for a batch of motifs within a
+        provided motif database. fimo is run in --text mode and its output is
+        parsed as it is streamed so that only the best hit per region is held
+        in memory.
+
+    Parameters
+    ----------
+    motifs : list
+        names of motifs that match motifs within motifdatabase
+    bg_file : string
+        full path to a markov background model
+    fasta_file : string
+        full path to a fasta file that fimo will perform motif scanning on
+    motifdatabase : string
+        full path to a motif database file in meme format
+    thresh : float
+        p-value threshold for motif hits
+    largewindow : int
+        half-length of scanned regions
+
+    Returns
+    -------
+    motif_distances : list of lists
+        a list of (motif, distances) tuples, one for each motif in the batch
+    '''
+    index = region_index(fastafile=fasta_file)
+    best_hits = run_fimo(motifs, bg_file=bg_file, fasta_file=fasta_file, 
+                            motifdatabase=motifdatabase, thresh=thresh, 
+                            parser=fimo_parse_stream, largewindow=largewindow,
+                            index=index)
+
+    motif_distances = list()
+    for motif in motifs:
+        scores, distances = best_hits[motif]
+        motif_distances.append((motif, region_distances(scores=scores, 
+                                                        distances=distances, 
+                                                        index=index)))
+
+    return motif_distances
+
+#==============================================================================
+def run_fimo(motifs, bg_file=None, fasta_file=None, motifdatabase=None, 
+                thresh=None, parser=None, **parser_keywords):
+    '''Runs fimo in --text mode for a batch of motifs and passes its output
+        to a parser as it is streamed
+
+    Parameters
+    ----------
+    motifs : list
+        names of motifs that match motifs within motifdatabase
+    parser : function
+        a function that takes fimo_stream and motifs keywords (e.g. 
+        fimo_parse_stream or fimo_parse_hits)
+    parser_keywords : dict
+        additional keyword arguments passed to parser
+
+    Returns
+    -------
+    parsed : object
+        the output of parser
+    '''
+    command = ["fimo", "--text", "--skip-matched-sequence",
+                "--verbosity", "1",
+                "--thresh", str(thresh)]
     if bg_file is not None:
-        command = ("fimo", "--skip-matched-sequence", 
-                    "--verbosity", "1", 
-                    "--thresh", str(thresh),
-                    "--bgfile", bg_file,
-                    "--motif", motif, 
-                    motifdatabase, fasta_file)
-    else:
-        command = ("fimo", "--skip-matched-sequence", 
-                    "--verbosity", "1", 
-                    "--thresh",str(thresh),
-                    "--motif", motif, 
-                    motifdatabase, fasta_file)
+        command += ["--bgfile", bg_file]
+    for motif in motifs:
+        command += ["--motif", motif]
+    command += [motifdatabase, fasta_file]
+
+    #stderr is not read until stdout is parsed, so it goes to a file rather
+    #than a pipe that fimo could fill and block on
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, 
+                                    stderr=stderr, universal_newlines=True)
+        parsed = parser(fimo_stream=process.stdout, motifs=motifs, 
+                        **parser_keywords)
+        process.stdout.close()
+        if process.wait() != 0:
+            stderr.seek(0)
+            raise exceptions.SubprocessError(stderr.read())
+
+    return parsed
+
+#==============================================================================
+#Region indexes built for each fasta file, keyed by file path. These are built
+#in the main process before workers are forked so that workers share them.
+_REGION_INDEX = dict()
 
-    try:
-        fimo_out = subprocess.check_output(command, stderr=subprocess.PIPE).decode('UTF-8')
-    except subprocess.CalledProcessError as e:
-        raise exceptions.SubprocessError(e.stderr.decode())
+#==============================================================================
+def region_index(fastafile=None):
+    '''Builds (once per process) an index of fasta header names to their
+        position (rank) within the fasta file.
+
+    Parameters
+    ----------
+    fastafile : str
+        full path to a fasta file
+
+    Returns
+    -------
+    index : tuple
+        (dict of header name to position of its first occurrence, list of 
+        (position, first occurrence position) tuples for repeated headers, 
+        number of sequences)
+    '''
+    key = str(fastafile)
+    if key not in _REGION_INDEX:
+        positions = dict()
+        duplicates = list()
+        region_count = 0
+        for name in fasta_names(fastafile=fastafile):
+            if name in positions:
+                duplicates.append((region_count, positions[name]))
+            else:
+                positions[name] = region_count
+            region_count += 1
+        _REGION_INDEX[key] = (positions, duplicates, region_count)
+
+    return _REGION_INDEX[key]
+
+#==============================================================================
+def fimo_parse_stream(fimo_stream=None, largewindow=None, motifs=None, 
+                        index=None):
+    '''Parses fimo --text output line by line retaining only the highest 
+        scoring hit for each motif and region.
+
+    Parameters
+    ----------
+    fimo_stream : iterable
+        an iterable of fimo output lines (e.g. a pipe from a fimo process)
+    largewindow : int
+        half-length of scanned regions
+    motifs : list
+        motif names in the fimo output. Hits are assigned using either the
+        motif id or alternate id.
+    index : tuple
+        a region index created by region_index
+
+    Returns
+    -------
+    best_hits : dict
+        motif names as keys and a tuple of (best score, best distance) arrays
+        with one value per region (in fasta order) as values. Regions without
+        a hit have a score of -inf.
+    '''
+    positions, _, region_count = index
+    best_hits = dict()
+    for motif in motifs:
+        best_hits[motif] = (np.full(region_count, -np.inf), 
+                            np.zeros(region_count))
+
+    header = None
+    for line in fimo_stream:
+        line_list = line.rstrip('\n').split('\t')
+        if header is None:
+            header = line_list
+            (id_index, alt_id_index, name_index, start_index, stop_index, 
+                score_index, _) = fimo_columns(header=header)
+            continue
+        if len(line_list) < len(header):
+            continue
+        if line_list[id_index] in best_hits:
+            scores, distances = best_hits[line_list[id_index]]
+        elif line_list[alt_id_index] in best_hits:
+            scores, distances = best_hits[line_list[alt_id_index]]
+        else:
+            continue
+        i = positions.get(line_list[name_index])
+        if i is None:
+            continue
+        score = float(line_list[score_index])
+        if score > scores[i]:
+            scores[i] = score
+            distances[i] = ((int(line_list[start_index])
+                            +int(line_list[stop_index]))/2)-int(largewindow)
+
+    return best_hits
+
+#==============================================================================
+def fimo_columns(header=None):
+    '''Finds the column indexes needed to parse fimo output from its header.
+        Supports both current (motif_id) and older (#pattern name) headers.
+
+    Returns
+    -------
+    columns : tuple
+        indexes of motif id, motif alt id, sequence name, start, stop, score
+        and strand columns
+    '''
+    header = [x.strip('#').strip().replace(' ', '_') for x in header]
+    header = ['motif_id' if x == 'pattern_name' else x for x in header]
+    id_index = header.index('motif_id')
+    alt_id_index = header.index('motif_alt_id') if 'motif_alt_id' in header else id_index
+
+    return (id_index, alt_id_index, header.index('sequence_name'), 
+            header.index('start'), header.index('stop'), header.index('score'),
+            header.index('strand'))
+
+#==============================================================================
+def fimo_parse_hits(fimo_stream=None, motifs=None):
+    '''Parses fimo --text output line by line retaining all hits for each
+        motif
 
-    # fasta_count = fasta_linecount(fastafile=fasta_file)
-    names = fasta_names(fastafile=fasta_file)
-    distances = fimo_parse_stdout(fimo_stdout=fimo_out, 
-                                    largewindow=largewindow, 
-                                    names=names)
-                                    # linecount=fasta_count)
+    Parameters
+    ----------
+    fimo_stream : iterable
+        an iterable of fimo output lines (e.g. a pipe from a fimo process)
+    motifs : list
+        motif names in the fimo output. Hits are assigned using either the
+        motif id or alternate id.
 
-    del fimo_out
+    Returns
+    -------
+    hits : dict
+        motif names as keys and (sequence names, starts, stops, scores, 
+        strands) lists as values. starts and stops are 1-based and inclusive
+        as in fimo output. Strands are 1 (+) or -1 (-).
+    '''
+    hits = dict((motif, ([], [], [], [], [])) for motif in motifs)
+    header = None
+    for line in fimo_stream:
+        line_list = line.rstrip('\n').split('\t')
+        if header is None:
+            header = line_list
+            (id_index, alt_id_index, name_index, start_index, stop_index, 
+                score_index, strand_index) = fimo_columns(header=header)
+            continue
+        if len(line_list) < len(header):
+            continue
+        if line_list[id_index] in hits:
+            motif_hits = hits[line_list[id_index]]
+        elif line_list[alt_id_index] in hits:
+            motif_hits = hits[line_list[alt_id_index]]
+        else:
+            continue
+        motif_hits[0].append(line_list[name_index])
+        motif_hits[1].append(int(line_list[start_index]))
+        motif_hits[2].append(int(line_list[stop_index]))
+        motif_hits[3].append(float(line_list[score_index]))
+        motif_hits[4].append(-1 if line_list[strand_index] == '-' else 1)
 
-    return [motif] + distances
+    return hits
+
+#==============================================================================
+def region_distances(scores=None, distances=None, index=None):
+    '''Converts best hit arrays (see fimo_parse_stream) into an array of 
+        distances in fasta order where np.nan means the region had no hit
+    '''
+    _, duplicates, _ = index
+    distances = np.where(scores == -np.inf, np.nan, distances)
+    for i, first in duplicates:
+        distances[i] = distances[first]
+
+    return distances
 
 #==============================================================================
 def fimo_motif_names(motifdatabase=None):
@@ -614,15 +1452,7 @@ def fimo_motif_names(motifdatabase=None):
     motif_list : list
         a list of motif names to be analyzed in TFEA
     '''
-    motif_list = list()
-    with open(motifdatabase) as F:
-        for line in F:
-            if 'MOTIF' in line:
-                line = line.strip('\n').split()
-                motif_name = line[-1]
-                motif_list.append(motif_name)
-
-    return motif_list
+    return list(motif_index.load(motifdatabase=motifdatabase).names)
 
 #==============================================================================
 def fimo_parse(fimo_file=None, largewindow=None, retain='distance', 
@@ -731,7 +1561,7 @@ def fimo_parse_stdout(fimo_stdout=None, largewindow=None, retain='score',
 
 
     # distances = np.empty(len(names), dtype=object)
-    distances = [] 
+    distances = []
     for name in names:
         if name in d:
             distances.append(d[name][1])
@@ -741,83 +1571,989 @@ def fimo_parse_stdout(fimo_stdout=None, largewindow=None, retain='score',
     return distances
 
 #==============================================================================
-def bedtools_closest(motif, genomehits=None, ranked_center_file=None, 
-                        tempdir=None, distance_cutoff=None, rank_index=None):
-    '''Calculates nearest motif hit from a bed file. TFEA provides this 
-        function with a bed file containing the center of the inputted regions.
+#Alphabet used for numpy scanning. Any other character (e.g. N) is encoded as
+#len(ALPHABET) and can never be part of a motif hit
+ALPHABET = 'ACGT'
+
+#Number of integer bins used to discretize the total log-odds score range of a
+#motif when computing p-values
+PWM_BINS = 10000
+
+#Lookahead scanning scores columns for all positions until fewer than this 
+#fraction of positions remain and then only for the remaining positions
+LOOKAHEAD_DENSE_FRACTION = 0.5
+
+#Largest p-value kept in cached p-value tables. Thresholds above this are
+#computed without the cache.
+PVALUE_TABLE_MAX = 0.01
+
+#Encoded fasta files loaded by each process, keyed by file path
+_ENCODED = dict()
+
+#==============================================================================
+def fasta_encode(fastafile=None, tempdir=None):
+    '''Encodes all sequences within a fasta file as a 2D uint8 array where
+        each row is a sequence (in fasta order) and each base is an index into
+        ALPHABET. Sequences are padded to equal length with non-ACGT values.
+        The array is saved once in tempdir so that all processes can memory
+        map it instead of re-reading the fasta file.
 
     Parameters
     ----------
-    TFresults : list of lists
-        contains calculated enrichment scores for all TFs of interest specified
-        by the user
-        
+    fastafile : str
+        full path to a fasta file
+    tempdir : str
+        full path to temp directory in output directory (created by TFEA)
+
     Returns
     -------
-    motif_distance_bed_sorted : string
-        full path to where the sorted motif distance file was outputted
+    encoded_file : str
+        full path to a .npy file containing the encoded sequences
     '''
-    try:
-        motif_path = genomehits / motif
-        if os.stat(motif_path).st_size == 0:
-            return [motif] + ['.' for i in range(os.stat(ranked_center_file).st_size)]
+    table = encoding_table()
+    sequences = fasta_sequences(fastafile=fastafile)
 
-        command = ("bedtools", "closest", "-D", "ref", "-t", "first", "-a", 
-                    ranked_center_file, "-b", motif_path)
-        closest_out = tempdir / (motif + '.closest.bed')
+    length = max([len(sequence) for sequence in sequences])
+    encoded = np.full((len(sequences), length), len(ALPHABET), dtype=np.uint8)
+    for i, sequence in enumerate(sequences):
+        sequence = np.frombuffer(sequence.encode(), dtype=np.uint8)
+        encoded[i, :len(sequence)] = table[sequence]
 
-        # import sys
-        # print(' '.join([str(c) for c in command]) + ' > ' + closest_out.as_posix(), file=sys.stderr)
+    encoded_file = Path(tempdir) / (Path(fastafile).name + '.npy')
+    np.save(encoded_file, encoded)
 
-        try:
-            closest_out.write_bytes(subprocess.check_output(command, stderr=subprocess.PIPE))
-        except subprocess.CalledProcessError as e:
-            raise exceptions.SubprocessError(e.stderr.decode())
-        
-        
-        distances = list()
-        ranks = list()
-        with open(closest_out) as F:
-            for line in F:
-                linelist = line.strip('\n').split('\t')
-                distance = int(linelist[-1])
-                if rank_index is not None:
-                    rank = int(linelist[rank_index].split(',')[-1])
-                    ranks.append(rank)
-                if abs(distance) <= distance_cutoff:
-                    distances.append(distance)
-                else:
-                    distances.append('.')
-        if rank_index is not None:
-            distances = [x for i,x in sorted(zip(ranks,distances))]
-        closest_out.unlink()
+    return encoded_file
+
+#==============================================================================
+def encoding_table():
+    '''Returns a lookup table from ascii codes to ALPHABET indexes. Any
+        other character is encoded as len(ALPHABET).
+    '''
+    table = np.full(256, len(ALPHABET), dtype=np.uint8)
+    for i, base in enumerate(ALPHABET):
+        table[ord(base)] = i
+        table[ord(base.lower())] = i
 
-    except Exception as e:
-        # This prints the type, value, and stack trace of the
-        # current exception being handled.
-        print(traceback.print_exc())
-        raise e
+    return table
+
+#==============================================================================
+def fasta_sequences(fastafile=None):
+    '''Reads all sequences within a fasta file (in fasta order)
+    '''
+    sequences = list()
+    with open(fastafile) as F:
+        lines = list()
+        for line in F:
+            if line[0] == '>':
+                if len(sequences) != 0 or len(lines) != 0:
+                    sequences.append(''.join(lines))
+                lines = list()
+            else:
+                lines.append(line.strip())
+        sequences.append(''.join(lines))
 
-    return [motif.strip('.bed')] + distances
+    return sequences
 
 #==============================================================================
-def get_center(bedfile=None, outname=None):
-    '''This function takes a bed file and returns the center for all regions
-        in the bed file.
+def fasta_encode_flat(fastafile=None):
+    '''Encodes all sequences within a fasta file as a single 1D uint8 array
+        where sequences are separated by a non-ACGT value. Unlike fasta_encode
+        sequences are not padded so this is suited to sequences of very 
+        different lengths.
+
+    Returns
+    -------
+    encoded : np.ndarray
+        encoded sequences
+    offsets : np.ndarray
+        the position of the first base of each sequence within encoded
+    '''
+    table = encoding_table()
+    sequences = fasta_sequences(fastafile=fastafile)
+    lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+    offsets = np.cumsum(lengths + 1) - (lengths + 1)
+    encoded = np.full(int(np.sum(lengths + 1)), len(ALPHABET), dtype=np.uint8)
+    for offset, sequence in zip(offsets, sequences):
+        sequence = np.frombuffer(sequence.encode(), dtype=np.uint8)
+        encoded[offset:offset+len(sequence)] = table[sequence]
+
+    return encoded, offsets
+
+#==============================================================================
+def load_encoded(encoded_file=None):
+    '''Memory maps an encoded fasta file created by fasta_encode. Each process
+        only loads a given file once.
+    '''
+    encoded_file = str(encoded_file)
+    if encoded_file not in _ENCODED:
+        _ENCODED[encoded_file] = np.load(encoded_file, mmap_mode='r')
+
+    return _ENCODED[encoded_file]
+
+#==============================================================================
+def meme_pssms(motifdatabase=None, motifs=None):
+    '''Returns probability matrices for desired motifs from the compiled
+        index of a MEME formatted motif database (see motif_index)
 
     Parameters
     ----------
-    bedfile : str
-        full path to a bed file
-    outname : str
-        full path to the output centered bed file
+    motifdatabase : str
+        full path to a meme formatted file
+    motifs : list or None
+        motif names to retain. If None, all motifs are retained.
+
+    Returns
+    -------
+    pssms : dict
+        motif names as keys and a tuple of (PSSM array with shape (width, 4),
+        nsites) as values
+    '''
+    index = motif_index.load(motifdatabase=motifdatabase)
+    if motifs is None:
+        motifs = [name for row in range(len(index))
+                    for name in index.motif_names(row=row)]
+    missing = [motif for motif in motifs if motif not in index]
+    if len(missing) != 0:
+        raise exceptions.InputError("Motifs not found in motif database: "
+                                    + ','.join(missing))
+
+    return dict((motif, index.pssm(motif=motif)) for motif in motifs)
+
+#==============================================================================
+def meme_background(motifdatabase=None):
+    '''Returns the background letter frequencies specified in a MEME formatted
+        motif database. Uniform frequencies are returned if none specified.
+    '''
+    return motif_index.load(motifdatabase=motifdatabase).background
+
+#==============================================================================
+def markov_background(background_file=None):
+    '''Returns the 0-order letter frequencies from a markov background file
+        (as generated by fasta-get-markov). Like fimo, only 0-order
+        frequencies are used when scoring.
+    '''
+    frequencies = dict()
+    with open(background_file) as F:
+        for line in F:
+            values = line.split()
+            if len(values) == 2 and line[0] != '#' and len(values[0]) == 1:
+                frequencies[values[0].upper()] = float(values[1])
+    background = np.array([frequencies[base] for base in ALPHABET])
+
+    return background/background.sum()
+
+#==============================================================================
+def pwm_log_odds(pssm=None, nsites=None, background=None, pseudocount=0.1):
+    '''Converts a PSSM into an integer log-odds matrix. Like fimo, a
+        pseudocount is applied to motif frequencies. Log-odds scores are then
+        discretized into PWM_BINS integer bins (offset so that each column
+        minimum is 0) which allows exact score distributions to be computed.
+
+    Parameters
+    ----------
+    pssm : array
+        a (width, 4) array of letter probabilities
+    nsites : float
+        number of sites used to build the motif, used to weight pseudocounts
+    background : array
+        background letter frequencies in ALPHABET order
+    pseudocount : float
+        pseudocount added to motif frequencies (fimo default: 0.1)
 
     Returns
     -------
-    outname : str
-        full path to the output centered bed file
+    matrix : array
+        a (width, 4) integer array of discretized log-odds scores
     '''
-    outbed = BedTool(str(bedfile)).each(featurefuncs.center).sort()
-    outbed.saveas(outname)
+    probabilities = ((pssm*nsites + pseudocount*background)
+                        /(nsites + pseudocount))
+    log_odds = np.log2(probabilities/background)
+    log_odds = log_odds - log_odds.min(axis=1)[:, None]
+    score_range = log_odds.max(axis=1).sum()
+    scale = PWM_BINS/score_range if score_range > 0 else 1.0
+    matrix = np.rint(log_odds*scale).astype(np.int64)
+
+    return matrix
+
+#==============================================================================
+def pwm_score_cutoff(log_odds=None, background=None, thresh=None):
+    '''Calculates the minimum integer score a motif hit must reach to have a
+        p-value below thresh. The exact score distribution of a random
+        sequence under the background model is calculated by dynamic
+        programming over motif columns (see pwm_pvalue_table).
+
+    Parameters
+    ----------
+    log_odds : array
+        a (width, 4) integer log-odds matrix (see pwm_log_odds)
+    background : array
+        background letter frequencies in ALPHABET order
+    thresh : float
+        p-value threshold (same semantics as the fimo --thresh flag)
+
+    Returns
+    -------
+    cutoff : int
+        the lowest score with a p-value below thresh
+    '''
+    table = pwm_pvalue_table(log_odds=log_odds, background=background)
+    return table_score_cutoff(table=table, thresh=thresh)
+
+#==============================================================================
+def pwm_pvalue_table(log_odds=None, background=None, max_pvalue=1.0):
+    '''Calculates the p-value of every integer score of a motif. The exact
+        score distribution of a random sequence under the background model
+        is calculated by dynamic programming over motif columns.
+
+    Parameters
+    ----------
+    log_odds : array
+        a (width, 4) integer log-odds matrix (see pwm_log_odds)
+    background : array
+        background letter frequencies in ALPHABET order
+    max_pvalue : float
+        scores with a p-value above max_pvalue are left out of the table
+
+    Returns
+    -------
+    table : tuple
+        (first score, p-values) where p-values[i] is the probability of a
+        random site scoring at least first score + i
+    '''
+    distribution = np.ones(1)
+    for column in log_odds:
+        new_distribution = np.zeros(len(distribution) + column.max())
+        for score, probability in zip(column, background):
+            new_distribution[score:score+len(distribution)] += distribution*probability
+        distribution = new_distribution
+
+    pvalues = np.minimum(np.cumsum(distribution[::-1])[::-1], 1.0)
+    first = int(np.count_nonzero(pvalues > max_pvalue))
 
-    return outname
\ No newline at end of file
+    return first, pvalues[first:]
+
+#==============================================================================
+def table_score_cutoff(table=None, thresh=None):
+    '''Returns the lowest score with a p-value below thresh from a p-value
+        table (see pwm_pvalue_table). thresh must not be above the max_pvalue
+        of the table.
+    '''
+    first, pvalues = table
+    passing = np.nonzero(pvalues < float(thresh))[0]
+    if len(passing) == 0:
+        return first + len(pvalues)
+
+    return first + int(passing[0])
+
+#==============================================================================
+def table_pvalues(table=None, scores=None):
+    '''Looks up the p-values of integer scores in a p-value table (see
+        pwm_pvalue_table). Scores below the table have p-values above its
+        max_pvalue and are returned as 1.
+    '''
+    first, pvalues = table
+    positions = np.asarray(scores, dtype=np.int64) - first
+    return np.where(positions >= 0,
+                    pvalues[np.clip(positions, 0, len(pvalues) - 1)], 1.0)
+
+#==============================================================================
+def motif_pvalue_tables(motifdatabase=None, motifs=None, background=None,
+                        pseudocount=0.1):
+    '''Returns integer log-odds matrices and p-value tables for motifs under
+        a background. Tables for every motif in the database are built once
+        per background and cached in the motif index (see motif_index). Only
+        scores with p-values up to PVALUE_TABLE_MAX are kept.
+
+    Returns
+    -------
+    tables : dict
+        motif names as keys and (log-odds matrix, p-value table) tuples as
+        values
+    '''
+    index = motif_index.load(motifdatabase=motifdatabase)
+    background = np.asarray(background, dtype=float)
+    key = hit_cache.cache_key('pvalues', background, pseudocount, PWM_BINS,
+                                PVALUE_TABLE_MAX)
+
+    def build(index):
+        log_odds = list()
+        firsts = list()
+        pvalues = list()
+        for row in range(len(index)):
+            pssm, nsites = index.pssm(motif=index.motif_names(row=row)[0])
+            matrix = pwm_log_odds(pssm=pssm, nsites=nsites,
+                                    background=background,
+                                    pseudocount=pseudocount)
+            first, row_pvalues = pwm_pvalue_table(log_odds=matrix,
+                                                    background=background,
+                                                    max_pvalue=PVALUE_TABLE_MAX)
+            log_odds.append(matrix)
+            firsts.append(first)
+            pvalues.append(row_pvalues)
+        lengths = np.array([len(x) for x in pvalues], dtype=np.int64)
+        return dict(log_odds=(np.concatenate(log_odds) if len(log_odds) != 0
+                                else np.zeros((0, len(ALPHABET)), dtype=np.int64)),
+                    firsts=np.array(firsts, dtype=np.int64),
+                    offsets=np.concatenate([[0], np.cumsum(lengths)]),
+                    pvalues=(np.concatenate(pvalues) if len(pvalues) != 0
+                                else np.zeros(0)))
+
+    arrays = index.tables(key=key, build=build)
+    tables = dict()
+    for motif in motifs:
+        i = index.row(motif=motif)
+        start = index.arrays['offsets'][i]
+        stop = start + index.arrays['widths'][i]
+        first, last = arrays['offsets'][i:i+2]
+        tables[motif] = (arrays['log_odds'][start:stop],
+                            (int(arrays['firsts'][i]),
+                            arrays['pvalues'][first:last]))
+
+    return tables
+
+#==============================================================================
+def numpy_scan(pwm, encoded_file=None, largewindow=None, block_size=2**22,
+                pwm_scan='full'):
+    '''Scans encoded sequences for a single motif on both strands using
+        vectorized log-odds scoring. For each sequence, the highest scoring
+        hit passing the score cutoff is retained (as with fimo_parse_stdout).
+
+    Parameters
+    ----------
+    pwm : tuple
+        (motif name, integer log-odds matrix, score cutoff)
+    encoded_file : str
+        full path to an encoded fasta file (see fasta_encode)
+    largewindow : int
+        half-length of the scanned regions, used to convert hit positions to
+        distances from region centers
+    block_size : int
+        maximum number of sequence positions to score at once. Limits memory.
+    pwm_scan : str
+        'full' scores every position in full. 'lookahead' abandons positions
+        that can no longer pass the cutoff (see lookahead_scan_hits).
+
+    Returns
+    -------
+    motif_distances : tuple
+        the motif name and an array of the distance of the best motif hit for 
+        each sequence (in fasta order). np.nan means there was no hit.
+    '''
+    motif, log_odds, cutoff = pwm
+    encoded = load_encoded(encoded_file=encoded_file)
+    sequence_n, length = encoded.shape
+    width = len(log_odds)
+    positions = length - width + 1
+    distances = np.full(sequence_n, np.nan)
+    if positions < 1:
+        return motif, distances
+
+    if pwm_scan == 'lookahead':
+        #Rows are separated by a non-ACGT column so that no hit spans two
+        #sequences
+        flat = np.hstack([encoded, np.full((sequence_n, 1), len(ALPHABET),
+                                            dtype=encoded.dtype)]).ravel()
+        hit_positions, scores = lookahead_scan_hits(pwm, encoded=flat,
+                                                    block_size=block_size)
+        rows, columns = np.divmod(hit_positions, length + 1)
+        #Best score per sequence, first position if tied (as argmax)
+        order = np.lexsort((columns, -scores, rows))
+        rows = rows[order]
+        first = np.flatnonzero(np.diff(rows, prepend=-1) != 0)
+        best = columns[order][first]
+        distances[rows[first]] = ((best+1+best+width)/2)-int(largewindow)
+        return motif, distances
+
+    forward, reverse = pwm_strands(log_odds=log_odds)
+
+    rows = max(1, block_size//positions)
+    for start in range(0, sequence_n, rows):
+        codes = encoded[start:start+rows]
+        forward_scores = np.zeros((len(codes), positions), dtype=np.int32)
+        reverse_scores = np.zeros((len(codes), positions), dtype=np.int32)
+        for j in range(width):
+            window = codes[:, j:j+positions]
+            forward_scores += forward[j][window]
+            reverse_scores += reverse[j][window]
+        scores = np.maximum(forward_scores, reverse_scores)
+        best = scores.argmax(axis=1)
+        best_scores = scores[np.arange(len(codes)), best]
+        hits = np.nonzero(best_scores >= cutoff)[0]
+        #Same coordinates as fimo output (1-based, inclusive)
+        hit_start = best[hits] + 1
+        hit_stop = best[hits] + width
+        distances[start+hits] = ((hit_start+hit_stop)/2)-int(largewindow)
+
+    return motif, distances
+
+#==============================================================================
+def pwm_strands(log_odds=None):
+    '''Creates forward and reverse strand scoring matrices with an extra 
+        column for non-ACGT characters. These get a score low enough that no
+        window containing one can pass any cutoff.
+
+    Returns
+    -------
+    forward, reverse : np.ndarray
+        int32 arrays of shape (motif width, len(ALPHABET)+1)
+    '''
+    width = len(log_odds)
+    floor = -(int(log_odds.max(axis=1).sum()) + 1)
+    forward = np.hstack([log_odds, np.full((width, 1), floor)]).astype(np.int32)
+    reverse = forward[::-1][:, [3, 2, 1, 0, 4]]
+
+    return forward, reverse
+
+#==============================================================================
+def numpy_scan_hits(pwm, encoded=None, block_size=2**22, pwm_scan='full'):
+    '''Scans a 1D encoded sequence (see fasta_encode_flat) for a single motif
+        on both strands and returns all positions passing the score cutoff.
+        At each position the higher scoring strand is retained.
+
+    Parameters
+    ----------
+    pwm : tuple
+        (motif name, integer log-odds matrix, score cutoff)
+    encoded : np.ndarray
+        1D encoded sequence
+    block_size : int
+        maximum number of sequence positions to score at once. Limits memory.
+    pwm_scan : str
+        'full' scores every position in full. 'lookahead' abandons positions
+        that can no longer pass the cutoff (see lookahead_scan_hits).
+
+    Returns
+    -------
+    positions : np.ndarray
+        0-based start of each hit within encoded
+    scores : np.ndarray
+        integer log-odds score of each hit
+    '''
+    if pwm_scan == 'lookahead':
+        return lookahead_scan_hits(pwm, encoded=encoded, block_size=block_size)
+
+    motif, log_odds, cutoff = pwm
+    width = len(log_odds)
+    forward, reverse = pwm_strands(log_odds=log_odds)
+    positions = list()
+    scores = list()
+    total = len(encoded) - width + 1
+    for start in range(0, max(total, 0), block_size):
+        n = min(block_size, total - start)
+        forward_scores = np.zeros(n, dtype=np.int32)
+        reverse_scores = np.zeros(n, dtype=np.int32)
+        for j in range(width):
+            window = encoded[start+j:start+j+n]
+            forward_scores += forward[j][window]
+            reverse_scores += reverse[j][window]
+        block_scores = np.maximum(forward_scores, reverse_scores)
+        hits = np.flatnonzero(block_scores >= cutoff)
+        positions.append(start + hits)
+        scores.append(block_scores[hits])
+
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    return np.concatenate(positions), np.concatenate(scores)
+
+#==============================================================================
+def hit_strands(log_odds=None, encoded=None, positions=None, scores=None):
+    '''Finds the strand of hits returned by numpy_scan_hits by rescoring the
+        forward strand at each hit. Hits scoring equally on both strands 
+        (e.g. palindromes) are assigned to the forward strand.
+
+    Returns
+    -------
+    strands : np.ndarray
+        int8 array of 1 (+) or -1 (-) for each hit
+    '''
+    forward, _ = pwm_strands(log_odds=log_odds)
+    width = len(log_odds)
+    windows = encoded[np.asarray(positions, dtype=np.int64)[:, None] 
+                        + np.arange(width)]
+    forward_scores = forward[np.arange(width), windows].sum(axis=1)
+    return np.where(forward_scores == scores, 1, -1).astype(np.int8)
+
+#==============================================================================
+def lookahead_order(matrix=None):
+    '''Orders the columns of a strand scoring matrix (see pwm_strands) by 
+        information content, taken as the difference between the best and
+        the mean ACGT score of each column
+
+    Returns
+    -------
+    order : np.ndarray
+        column indices, most informative first
+    remaining : np.ndarray
+        the best score achievable from the columns after each column in order
+    '''
+    best = matrix.max(axis=1)
+    information = best - matrix[:, :len(ALPHABET)].mean(axis=1)
+    order = np.argsort(-information, kind='stable')
+    remaining = np.cumsum(best[order][::-1])[::-1]
+    remaining = np.append(remaining[1:], 0)
+
+    return order, remaining
+
+#==============================================================================
+def lookahead_scan_hits(pwm, encoded=None, block_size=2**22):
+    '''Scans a 1D encoded sequence for a single motif on both strands using
+        lookahead filtering (as in MOODS). Matrix columns are scored in order 
+        of information content and a position is abandoned as soon as its 
+        score plus the best achievable score of the remaining columns cannot 
+        reach the cutoff. Columns are scored for all positions at once until
+        LOOKAHEAD_DENSE_FRACTION of positions have been abandoned and then 
+        only for the remaining positions. Results are identical to 
+        numpy_scan_hits but much faster at strict thresholds where almost all
+        positions are abandoned after a few columns.
+
+    Parameters
+    ----------
+    pwm : tuple
+        (motif name, integer log-odds matrix, score cutoff)
+    encoded : np.ndarray
+        1D encoded sequence
+    block_size : int
+        maximum number of sequence positions to score at once. Limits memory.
+
+    Returns
+    -------
+    positions : np.ndarray
+        0-based start of each hit within encoded
+    scores : np.ndarray
+        integer log-odds score of each hit
+    '''
+    motif, log_odds, cutoff = pwm
+    width = len(log_odds)
+    strands = [(matrix,) + lookahead_order(matrix=matrix)
+                for matrix in pwm_strands(log_odds=log_odds)]
+    positions = list()
+    scores = list()
+    total = len(encoded) - width + 1
+    for start in range(0, max(total, 0), block_size):
+        n = min(block_size, total - start)
+        strand_hits = list()
+        for matrix, order, remaining in strands:
+            block_scores = np.zeros(n, dtype=np.int32)
+            for k, j in enumerate(order):
+                block_scores += matrix[j][encoded[start+j:start+j+n]]
+                passing = block_scores >= cutoff - remaining[k]
+                if np.count_nonzero(passing) < n*LOOKAHEAD_DENSE_FRACTION:
+                    break
+            candidates = np.flatnonzero(passing)
+            block_scores = block_scores[candidates]
+            for k in range(k+1, width):
+                j = order[k]
+                block_scores += matrix[j][encoded[start+j+candidates]]
+                passing = block_scores >= cutoff - remaining[k]
+                candidates = candidates[passing]
+                block_scores = block_scores[passing]
+            strand_hits.append((candidates, block_scores))
+
+        #At each position the higher scoring strand is retained. A strand 
+        #that was abandoned scored below the cutoff and so below the other.
+        hits = np.union1d(strand_hits[0][0], strand_hits[1][0])
+        hit_scores = np.full(len(hits), np.iinfo(np.int32).min, dtype=np.int32)
+        for candidates, block_scores in strand_hits:
+            i = np.searchsorted(hits, candidates)
+            hit_scores[i] = np.maximum(hit_scores[i], block_scores)
+        positions.append(start + hits)
+        scores.append(hit_scores)
+
+    if len(positions) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+    return np.concatenate(positions), np.concatenate(scores)
+
+#==============================================================================
+def numpy_pwms(motif_list=None, fimo_motifs=None, background_file=None, 
+                fimo_thresh=None):
+    '''Computes integer log-odds matrices and score cutoffs for numpy 
+        scanning
+
+    Parameters
+    ----------
+    motif_list : list
+        motif names within fimo_motifs
+    fimo_motifs : str
+        full path to a .meme formatted motif database
+    background_file : str or None
+        full path to a markov background file. If None, the background within
+        the motif database is used.
+    fimo_thresh : float
+        p-value threshold for motif hits
+
+    Returns
+    -------
+    pwm_list : list
+        (motif name, integer log-odds matrix, score cutoff) tuples
+    '''
+    tables = numpy_pvalue_tables(motif_list=motif_list, 
+                                    fimo_motifs=fimo_motifs, 
+                                    background_file=background_file, 
+                                    max_pvalue=fimo_thresh)
+    pwm_list = list()
+    for motif in motif_list:
+        log_odds, table = tables[motif]
+        cutoff = table_score_cutoff(table=table, thresh=fimo_thresh)
+        pwm_list.append((motif, log_odds, cutoff))
+
+    return pwm_list
+
+#==============================================================================
+def numpy_pvalue_tables(motif_list=None, fimo_motifs=None, 
+                        background_file=None, max_pvalue=None):
+    '''Computes integer log-odds matrices and p-value tables for numpy 
+        scanning. Tables are read from the motif index (see 
+        motif_pvalue_tables) if max_pvalue is at most PVALUE_TABLE_MAX.
+
+    Parameters
+    ----------
+    background_file : str or None
+        full path to a markov background file. If None, the background within
+        the motif database is used.
+    max_pvalue : float
+        the loosest p-value threshold the tables will be used for
+
+    Returns
+    -------
+    tables : dict
+        motif names as keys and (log-odds matrix, p-value table) tuples as
+        values
+    '''
+    if background_file is not None:
+        background = markov_background(background_file=background_file)
+    else:
+        background = meme_background(motifdatabase=fimo_motifs)
+
+    if float(max_pvalue) <= PVALUE_TABLE_MAX:
+        return motif_pvalue_tables(motifdatabase=fimo_motifs, 
+                                    motifs=motif_list, background=background)
+
+    pwms = meme_pssms(motifdatabase=fimo_motifs, motifs=motif_list)
+    tables = dict()
+    for motif in motif_list:
+        pssm, nsites = pwms[motif]
+        log_odds = pwm_log_odds(pssm=pssm, nsites=nsites,
+                                background=background)
+        tables[motif] = (log_odds, pwm_pvalue_table(log_odds=log_odds, 
+                                                    background=background,
+                                                    max_pvalue=float(max_pvalue)))
+
+    return tables
+
+#==============================================================================
+def read_bed_regions(bedfile=None):
+    '''Reads the chromosome, start and stop of each region in a bed file (in
+        file order)
+
+    Returns
+    -------
+    chroms : np.ndarray
+        chromosome names
+    starts, stops : np.ndarray
+        0-based, half-open coordinates
+    '''
+    chroms = list()
+    starts = list()
+    stops = list()
+    with open(bedfile) as F:
+        for line in F:
+            if (line[0] == '#' or line.strip() == '' 
+                    or line.startswith(('track', 'browser'))):
+                continue
+            chrom, start, stop = line.split('\t')[:3]
+            chroms.append(chrom)
+            starts.append(int(start))
+            stops.append(int(stop))
+
+    return (np.array(chroms, dtype=str), np.array(starts, dtype=np.int64),
+            np.array(stops, dtype=np.int64))
+
+#==============================================================================
+def merged_scan(motifs, bedfiles=None, genomefasta=None, tempdir=None, 
+                largewindow=None, scanner=None, bg_file=None, 
+                motifdatabase=None, thresh=None, pwms=None, scan_cache=None, 
+                cache_keys=None, pad=0, pwm_scan='full', windows=None, 
+                threshs=None, tables=None, all_hits=False):
+    '''Returns motif distances for a batch of motifs to regions within any 
+        number of bed files. Regions from all bed files are merged into a set
+        of non-redundant genomic intervals which is scanned once and each 
+        region is then assigned its best hit using an interval lookup.
+
+        If scan_cache is specified, previously scanned intervals are loaded 
+        from the cache (see hit_cache module), only intervals not yet in the 
+        cache for any motif in the batch are scanned, and new hits are added 
+        to the cache.
+
+    Parameters
+    ----------
+    motifs : list
+        motif names
+    bedfiles : list
+        full paths to bed files of regions (e.g. ranked_file, md_bedfile1)
+    scanner : str
+        'fimo' or 'numpy'
+    pwms : dict or None
+        motif names as keys and (log_odds, cutoff) as values. Only required 
+        for the numpy scanner.
+    scan_cache : str or None
+        full path to the cache directory. None if not desired.
+    cache_keys : dict or None
+        motif names as keys and cache keys as values
+    pad : int
+        scanned intervals are extended by this amount on each side. When 
+        caching this must be at least the maximum motif width - 1 so that all
+        hits overlapping cached intervals are found.
+    pwm_scan : str
+        scanning algorithm for the numpy scanner (see numpy_scan_hits)
+    windows : list or None
+        large window sizes (half-widths) to return distances for. Bed file 
+        regions must be 2*largewindow wide and are shrunk around their 
+        centers for smaller windows. The best hit within each window is found
+        from the same set of hits. Default: [largewindow]
+    threshs : list or None
+        p-value thresholds to return distances for. Regions are scanned at 
+        thresh which must be the loosest. For stricter thresholds, regions 
+        whose best hit has a p-value above the threshold have no hit. 
+        Default: [thresh]
+    tables : dict or None
+        motif names as keys and p-value tables (see pwm_pvalue_table) as 
+        values used to look up best hit p-values from their scores. Only 
+        supported for the numpy scanner. Required if threshs are given.
+    all_hits : boolean
+        whether to also return every hit within each region
+
+    Returns
+    -------
+    motif_distances : list
+        for each window, then each threshold and then each bed file, a list 
+        of (motif, distances) tuples where distances is an array in bed file 
+        order with np.nan for regions without a hit. If all_hits, tuples are
+        (motif, distances, hits) where hits are (region indexes, distances, 
+        scores, strands) arrays of all hits (see distance_matrix.HitMatrix).
+    '''
+    region_sets = [read_bed_regions(bedfile=bedfile) for bedfile in bedfiles]
+    chroms = np.concatenate([region_set[0] for region_set in region_sets])
+    starts = np.concatenate([region_set[1] for region_set in region_sets])
+    stops = np.concatenate([region_set[2] for region_set in region_sets])
+    regions = dict()
+    for chrom in np.unique(chroms):
+        chrom_regions = chroms == chrom
+        regions[chrom] = hit_cache.merge_intervals(starts[chrom_regions], 
+                                                    stops[chrom_regions])
+
+    #Find intervals that have not been scanned for at least one motif
+    cached_hits = dict((motif, dict()) for motif in motifs)
+    uncovered = regions
+    if scan_cache:
+        uncovered = dict()
+        for motif in motifs:
+            coverage, hits, _ = hit_cache.load(cache_dir=scan_cache, 
+                                                key=cache_keys[motif])
+            cached_hits[motif] = hits
+            for chrom, (region_starts, region_stops) in regions.items():
+                remove_starts, remove_stops = coverage.get(chrom, ([], []))
+                missing = hit_cache.subtract_intervals(starts=region_starts, 
+                                                stops=region_stops, 
+                                                remove_starts=remove_starts,
+                                                remove_stops=remove_stops)
+                uncovered.setdefault(chrom, ([], []))
+                uncovered[chrom][0].append(missing[0])
+                uncovered[chrom][1].append(missing[1])
+        for chrom in list(uncovered):
+            uncovered[chrom] = hit_cache.merge_intervals(
+                                        np.concatenate(uncovered[chrom][0]),
+                                        np.concatenate(uncovered[chrom][1]))
+            if len(uncovered[chrom][0]) == 0:
+                del uncovered[chrom]
+
+    if len(uncovered) != 0:
+        coverage, new_hits = scan_intervals(motifs=motifs, 
+                                            intervals=uncovered,
+                                            genomefasta=genomefasta, 
+                                            tempdir=tempdir, pad=pad, 
+                                            scanner=scanner, bg_file=bg_file, 
+                                            motifdatabase=motifdatabase, 
+                                            thresh=thresh, pwms=pwms,
+                                            pwm_scan=pwm_scan)
+        for motif in motifs:
+            if scan_cache:
+                hit_cache.save(cache_dir=scan_cache, key=cache_keys[motif], 
+                                coverage=coverage, hits=new_hits[motif])
+            for chrom, hits in new_hits[motif].items():
+                if chrom in cached_hits[motif]:
+                    hits = [np.concatenate([old, new]) for old, new 
+                            in zip(cached_hits[motif][chrom], hits)]
+                cached_hits[motif][chrom] = hit_cache.unique_hits(*hits)
+
+    if windows is None:
+        windows = [largewindow]
+    if threshs is None:
+        threshs = [thresh]
+    if len(threshs) > 1 and tables is None:
+        raise exceptions.InputError("P-value tables are required for "
+                                    "multiple thresholds.")
+    motif_distances = list()
+    for window in windows:
+        shrink = int(largewindow) - int(window)
+        window_distances = [[list() for _ in region_sets] for _ in threshs]
+        for i, (region_chroms, region_starts, region_stops) in enumerate(
+                                                                region_sets):
+            region_starts = region_starts + shrink
+            region_stops = region_stops - shrink
+            for motif in motifs:
+                hit_starts, hit_stops, hit_scores = hit_cache.best_hits(
+                                                    chroms=region_chroms, 
+                                                    starts=region_starts, 
+                                                    stops=region_stops, 
+                                                    hits=cached_hits[motif])
+                distances = (((hit_starts - region_starts + 1) 
+                                + (hit_stops - region_starts))/2 - window)
+                distances[hit_starts == -1] = np.nan
+                if all_hits:
+                    (hit_regions, all_starts, all_stops, all_scores, 
+                        all_strands) = hit_cache.region_hits(
+                                                    chroms=region_chroms, 
+                                                    starts=region_starts, 
+                                                    stops=region_stops, 
+                                                    hits=cached_hits[motif])
+                    hit_offsets = region_starts[hit_regions]
+                    all_distances = (((all_starts - hit_offsets + 1) 
+                                    + (all_stops - hit_offsets))/2 - window)
+                if tables is not None:
+                    pvalues = table_pvalues(table=tables[motif], 
+                                            scores=np.where(hit_starts == -1, 
+                                                            0, hit_scores))
+                    if all_hits:
+                        all_pvalues = table_pvalues(table=tables[motif], 
+                                                    scores=all_scores)
+                for j, thresh_value in enumerate(threshs):
+                    row = (motif, distances)
+                    if tables is not None:
+                        row = (motif, np.where(pvalues < float(thresh_value), 
+                                                distances, np.nan))
+                    if all_hits:
+                        keep = np.ones(len(hit_regions), dtype=bool)
+                        if tables is not None:
+                            keep = all_pvalues < float(thresh_value)
+                        row += ((hit_regions[keep], all_distances[keep], 
+                                all_scores[keep], all_strands[keep]),)
+                    window_distances[j][i].append(row)
+        motif_distances += [region_set for thresh_distances in window_distances
+                            for region_set in thresh_distances]
+
+    return motif_distances
+
+#==============================================================================
+def scan_intervals(motifs=None, intervals=None, genomefasta=None, 
+                    tempdir=None, pad=None, scanner=None, bg_file=None, 
+                    motifdatabase=None, thresh=None, pwms=None, 
+                    pwm_scan='full'):
+    '''Scans genomic intervals for a batch of motifs and returns all hits in
+        genomic coordinates
+
+    Parameters
+    ----------
+    intervals : dict
+        chromosome names as keys and merged (starts, stops) arrays as values
+    pad : int
+        intervals are extended by this amount on each side before scanning
+    pwm_scan : str
+        scanning algorithm for the numpy scanner (see numpy_scan_hits)
+
+    Returns
+    -------
+    coverage : dict
+        chromosome names as keys and (starts, stops) of intervals for which
+        all hits were found
+    hits : dict
+        motif names as keys and dicts of chromosome names to (starts, stops,
+        scores, strands) arrays as values (0-based, half-open)
+    '''
+    #Pad and clip intervals to the genome. Intervals on chromosomes not in 
+    #the genome are not scanned and so are not covered.
+    sizes = genome_fasta.chrom_sizes(genomefasta=genomefasta)
+    coverage = dict()
+    sequence_chroms = list()
+    sequence_starts = list()
+    sequence_stops = list()
+    for chrom, (starts, stops) in intervals.items():
+        if chrom not in sizes:
+            continue
+        starts, stops = hit_cache.merge_intervals(
+                                        np.clip(starts - pad, 0, sizes[chrom]),
+                                        np.clip(stops + pad, 0, sizes[chrom]))
+        coverage[chrom] = hit_cache.intersect_intervals(
+                                        starts=intervals[chrom][0], 
+                                        stops=intervals[chrom][1],
+                                        other_starts=starts,
+                                        other_stops=stops)
+        sequence_chroms += [chrom]*len(starts)
+        sequence_starts.append(starts)
+        sequence_stops.append(stops)
+    sequence_chroms = np.array(sequence_chroms, dtype=str)
+    sequence_starts = np.concatenate([np.zeros(0, dtype=np.int64)] 
+                                        + sequence_starts)
+    sequence_stops = np.concatenate([np.zeros(0, dtype=np.int64)] 
+                                        + sequence_stops)
+
+    #Hits as (sequence index, genomic start, genomic stop, score)
+    motif_hits = dict()
+    if scanner == 'fimo':
+        fasta_file = Path(tempdir) / ('scan_' + uuid.uuid4().hex + '.fa')
+        genome_fasta.write_fasta(genomefasta=genomefasta, 
+                                    chroms=sequence_chroms, 
+                                    starts=sequence_starts, 
+                                    stops=sequence_stops, outfile=fasta_file)
+        sequence_index = dict((f'{chrom}:{start}-{stop}', i) for i, 
+                                (chrom, start, stop) in enumerate(zip(
+                                sequence_chroms, sequence_starts, 
+                                sequence_stops)))
+        parsed = run_fimo(motifs, bg_file=bg_file, fasta_file=fasta_file, 
+                            motifdatabase=motifdatabase, thresh=thresh, 
+                            parser=fimo_parse_hits)
+        for motif, (names, starts, stops, scores, strands) in parsed.items():
+            index = np.array([sequence_index[name] for name in names], 
+                                dtype=np.int64)
+            hit_starts = sequence_starts[index] + np.array(starts, 
+                                                    dtype=np.int64) - 1
+            hit_stops = sequence_starts[index] + np.array(stops, 
+                                                    dtype=np.int64)
+            motif_hits[motif] = (index, hit_starts, hit_stops, 
+                                np.array(scores, dtype=float), 
+                                np.array(strands, dtype=np.int8))
+        os.remove(fasta_file)
+    elif scanner == 'numpy':
+        encoded, offsets = genome_fasta.encode_regions(genomefasta=genomefasta,
+                                                        chroms=sequence_chroms,
+                                                        starts=sequence_starts,
+                                                        stops=sequence_stops,
+                                                        table=encoding_table())
+        for motif in motifs:
+            log_odds, cutoff = pwms[motif]
+            positions, scores = numpy_scan_hits((motif, log_odds, cutoff), 
+                                                encoded=encoded, 
+                                                pwm_scan=pwm_scan)
+            index = np.searchsorted(offsets, positions, side='right') - 1
+            hit_starts = sequence_starts[index] + positions - offsets[index]
+            hit_stops = hit_starts + len(log_odds)
+            strands = hit_strands(log_odds=log_odds, encoded=encoded, 
+                                    positions=positions, scores=scores)
+            motif_hits[motif] = (index, hit_starts, hit_stops, 
+                                scores.astype(float), strands)
+    else:
+        raise exceptions.InputError("Scanner not recognized for cached "
+                                    "scanning.")
+
+    hits = dict()
+    for motif, (index, hit_starts, hit_stops, scores, 
+                strands) in motif_hits.items():
+        hits[motif] = dict()
+        hit_chroms = sequence_chroms[index]
+        for chrom in coverage:
+            chrom_hits = hit_chroms == chrom
+            hits[motif][chrom] = hit_cache.unique_hits(hit_starts[chrom_hits], 
+                                                        hit_stops[chrom_hits], 
+                                                        scores[chrom_hits],
+                                                        strands[chrom_hits])
+
+    return coverage, hits
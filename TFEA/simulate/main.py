@@ -23,6 +23,7 @@ import numpy as np
 from scipy import stats
 
 
+from TFEA import motif_index
 from TFEA.simulate import pull_sequences
 from TFEA.simulate import motif_insert
 
@@ -165,12 +166,7 @@ def parse_arguments():
 
 #==============================================================================
 def get_motifs(motif_database):
-    motif_list = list()
-    with open(motif_database,'r') as F:
-        for line in F:
-            if 'MOTIF' in line:
-                motif_list.append(line.strip().split()[-1])
-    return motif_list
+    return list(motif_index.load(motifdatabase=motif_database).names)
 
 #==============================================================================
 def write_fasta(sequences=None, outputpath=None):
@@ -15,6 +15,8 @@ __email__ = 'Jonathan.Rubin@colorado.edu'
 #==============================================================================
 import numpy as np
 
+from TFEA import motif_index
+
 #==============================================================================
 def insert_single_motif(sequences=None, sequence_n=None, motif_database=None, 
                         motif=None, rank_pdf=None, rank_inserts=None, 
@@ -48,8 +50,8 @@ def insert_single_motif(sequences=None, sequence_n=None, motif_database=None,
 #==============================================================================
 def get_PSSM(motif_database=None, motif=None):
     '''
-    Obtain a pssm model from a meme formatted database file. Warning: If there are multiple
-    motif matches, this function will return the last match in the database.
+    Obtain a pssm model from the compiled index of a meme formatted database 
+    file (see motif_index)
     
     Parameters
     ----------
@@ -63,22 +65,9 @@ def get_PSSM(motif_database=None, motif=None):
     PSSM : list or array
         a list of lists where each corresponding to position then alphabet probability
     '''
-    motif_hit = False
-    PSSM = list()
-    with open(motif_database,'r') as F:
-        for line in F:
-            if 'MOTIF' in line:
-                if motif in line:
-                    motif_hit = True
-                else:
-                    motif_hit = False
-            elif motif_hit and 'URL' not in line and 'letter-probability' not in line and line != '\n':
-                acgt_probabilities = [float(x) for x in line.strip('\n').split()]
-                total_prob = sum(acgt_probabilities)
-                acgt_probabilities = [x/total_prob for x in acgt_probabilities] #Convert to probabilities
-                PSSM.append(acgt_probabilities)
+    PSSM, _ = motif_index.load(motifdatabase=motif_database).pssm(motif=motif)
             
-    return PSSM
+    return PSSM.tolist()
 
 #==============================================================================
 def get_rank_inserts(sequence_n=None, rank_pdf=None, seed=None):
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains unit tests for the build_genome_hits module.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import sys
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+
+from TFEA import scanner
+from TFEA import genome_hits
+from TFEA import genome_fasta
+from TFEA import motif_index
+from TFEA import build_genome_hits
+
+#Tests
+#==============================================================================
+class TestBuildGenomeHits(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = Path(tempfile.mkdtemp())
+        self.motifdatabase = self.tempdir / 'database.meme'
+        shutil.copy(Path(__file__).parent / 'test_files' / 'test_database.meme',
+                    self.motifdatabase)
+        np.random.seed(0)
+        self.genomefasta = self.tempdir / 'genome.fa'
+        self.sizes = dict(chr1=5000, chr2=3200)
+        with open(self.genomefasta, 'w') as outfile:
+            for chrom, size in self.sizes.items():
+                sequence = ''.join(np.random.choice(list('ACGT'), size=size))
+                outfile.write(f'>{chrom}\n{sequence}\n')
+
+    def tearDown(self):
+        genome_fasta._GENOMES.clear()
+        motif_index._INDEXES.clear()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_main(self):
+        output = self.tempdir / 'index'
+        argv = ['TFEA-genomehits', '--output', str(output),
+                '--genomefasta', str(self.genomefasta),
+                '--motifs', str(self.motifdatabase), '--scanner', 'numpy',
+                '--fimo_thresh', '0.001', '--chunk_size', '1500',
+                '--task', '0', '--tasks', '1']
+        with mock.patch.object(sys, 'argv', argv):
+            build_genome_hits.main()
+        self.assertFalse((output / 'parts').exists())
+
+        #Chunked hits match a single scan of each chromosome
+        motifs = scanner.fimo_motif_names(motifdatabase=self.motifdatabase)
+        index = genome_hits.load_index(index_dir=output)
+        self.assertEqual(sorted(index), sorted(motifs))
+        keywords = build_genome_hits.scan_settings(motif_list=motifs,
+                                            motifdatabase=self.motifdatabase,
+                                            thresh=0.001,
+                                            scanner_option='numpy',
+                                            pwm_scan='lookahead')
+        del keywords['pad']
+        scan_dir = self.tempdir / 'scan'
+        scan_dir.mkdir()
+        _, expected = scanner.scan_intervals(motifs=motifs,
+                            intervals=dict((chrom, (np.array([0]),
+                                                    np.array([size])))
+                                            for chrom, size in self.sizes.items()),
+                            genomefasta=self.genomefasta, tempdir=scan_dir,
+                            pad=0, scanner=keywords.pop('scanner_option'),
+                            **keywords)
+        hits_found = 0
+        for motif in motifs:
+            hits = np.load(output / (motif + '.npy'))
+            for chrom in self.sizes:
+                first, last = index[motif].get(chrom, [0, 0])
+                starts = expected[motif].get(chrom, [np.zeros(0)])[0]
+                np.testing.assert_array_equal(hits['start'][first:last],
+                                                np.sort(starts))
+                hits_found += len(starts)
+        self.assertGreater(hits_found, 0)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
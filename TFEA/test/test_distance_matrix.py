@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains unit tests for the DistanceMatrix class used to pass
+    motif distances between TFEA modules.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from TFEA import distance_matrix
+from TFEA import exceptions
+
+#Tests
+#==============================================================================
+class TestDistanceMatrix(unittest.TestCase):
+    def setUp(self):
+        self.rows = [('motif1', [0.0, '.', -10.5, 1500.0]),
+                     ('motif2', np.array([np.nan, np.nan, np.nan, -3.0])),
+                     ('motif3', ['.', '.', '.', '.'])]
+
+    def test_backends(self):
+        for backend in ['dense', 'sparse', 'auto']:
+            matrix = distance_matrix.DistanceMatrix.from_rows(self.rows,
+                                                            backend=backend)
+            self.assertEqual(matrix.shape, (3, 4))
+            self.assertEqual(matrix.motifs, ['motif1', 'motif2', 'motif3'])
+            np.testing.assert_array_equal(matrix['motif1'],
+                                            [0.0, np.nan, -10.5, 1500.0])
+            np.testing.assert_array_equal(matrix.hit_counts(), [3, 1, 0])
+            for (motif, distances), (_, expected) in zip(matrix, self.rows):
+                expected = [np.nan if x == '.' else x for x in expected]
+                np.testing.assert_array_equal(distances, expected)
+            np.testing.assert_array_equal(matrix.rows(1, 3),
+                                    [matrix.row(1), matrix.row(2)])
+            self.assertEqual(matrix.rows(3).shape, (0, 4))
+        self.assertEqual(matrix.backend, 'sparse')
+        self.assertEqual(matrix.to_dense().backend, 'dense')
+        np.testing.assert_array_equal(matrix.to_dense().row(1),
+                                        matrix.to_sparse().row(1))
+
+    def test_save_load(self):
+        tempdir = Path(tempfile.mkdtemp())
+        try:
+            for backend in ['dense', 'sparse']:
+                matrix = distance_matrix.DistanceMatrix.from_rows(self.rows,
+                                                            backend=backend)
+                matrix.save(tempdir / 'matrix')
+                loaded = distance_matrix.load(tempdir / 'matrix')
+                self.assertEqual(loaded.backend, backend)
+                self.assertEqual(loaded.motifs, matrix.motifs)
+                for i in range(len(matrix)):
+                    np.testing.assert_array_equal(loaded.row(i), matrix.row(i))
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+    def test_region_mismatch(self):
+        with self.assertRaises(exceptions.InputError):
+            distance_matrix.DistanceMatrix.from_rows(self.rows + 
+                                                [('motif4', [1.0, 2.0])])
+
+class TestHitMatrix(unittest.TestCase):
+    def setUp(self):
+        #(region indexes, distances, scores, strands)
+        self.rows = [('motif1', ([2, 0, 2, 2], [-10.5, 4.0, 3.0, 20.0], 
+                                [5.0, 1.0, 5.0, 2.0], [1, -1, -1, 1])),
+                     ('motif2', ([], [], [], []))]
+        self.matrix = distance_matrix.HitMatrix.from_rows(self.rows, 
+                                                            regions=4)
+
+    def test_rows(self):
+        self.assertEqual(self.matrix.shape, (2, 4))
+        regions, distances, scores, strands = self.matrix['motif1']
+        np.testing.assert_array_equal(regions, [0, 2, 2, 2])
+        np.testing.assert_array_equal(distances, [4.0, -10.5, 3.0, 20.0])
+        np.testing.assert_array_equal(scores, [1.0, 5.0, 5.0, 2.0])
+        np.testing.assert_array_equal(strands, [-1, 1, -1, 1])
+        np.testing.assert_array_equal(self.matrix.hit_counts(), [4, 0])
+        np.testing.assert_array_equal(self.matrix.counts(0), [1, 0, 3, 0])
+
+    def test_summary(self):
+        expected = dict(best=[4.0, np.nan, -10.5, np.nan], 
+                        closest=[4.0, np.nan, 3.0, np.nan],
+                        average=[4.0, np.nan, 11.0, np.nan])
+        for retain, distances in expected.items():
+            summary = self.matrix.summary(retain=retain)
+            np.testing.assert_array_equal(summary['motif1'], distances)
+            np.testing.assert_array_equal(summary['motif2'], [np.nan]*4)
+        with self.assertRaises(exceptions.InputError):
+            self.matrix.summary(retain='count')
+
+    def test_summary_opposite_sides(self):
+        #Hits on both sides of the center do not average to the center
+        matrix = distance_matrix.HitMatrix.from_rows(
+                    [('motif1', ([0, 0, 1], [-1400.0, 1400.0, 900.0], 
+                                [1.0, 1.0, 1.0], [1, 1, -1]))], regions=3)
+        np.testing.assert_array_equal(matrix.summary(retain='average').rows(),
+                                        [[1400.0, 900.0, np.nan]])
+
+    def test_save_load(self):
+        tempdir = Path(tempfile.mkdtemp())
+        try:
+            self.matrix.save(tempdir / 'hits')
+            loaded = distance_matrix.load(tempdir / 'hits')
+            self.assertIsInstance(loaded, distance_matrix.HitMatrix)
+            self.assertEqual(loaded.motifs, self.matrix.motifs)
+            for (_, hits), (_, expected) in zip(loaded, self.matrix):
+                for array, expected_array in zip(hits, expected):
+                    np.testing.assert_array_equal(array, expected_array)
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
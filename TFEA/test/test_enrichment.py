@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains unit tests for the enrichment module.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import unittest
+import itertools
+
+import numpy as np
+from scipy import stats
+
+from TFEA import enrichment
+from TFEA import distance_matrix
+
+#Tests
+#==============================================================================
+def area(y):
+    '''Trapezoidal area under y, one interval at a time'''
+    return sum((y[i] + y[i+1])/2 for i in range(len(y) - 1))
+
+def running_sum(hits):
+    '''GSEA running sum of a hit vector, one region at a time'''
+    pos = float(sum(hits))
+    neg = float(len(hits) - sum(hits))
+    value = 0
+    running = list()
+    for hit in hits:
+        value += 1.0/pos if hit else -1.0/neg
+        running.append(value)
+
+    return running
+
+class TestPermuteAUC(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+        n = 500
+        score = np.zeros(n)
+        hits = np.random.random(n) < 0.5
+        score[hits] = np.random.random(np.count_nonzero(hits))
+        self.distances = score/np.sum(score)/n
+        self.trend = np.append(np.arange(0, 1, 1.0/(n - 1)), 1.0)/n
+
+    def test_auc_score(self):
+        distances = np.where(np.random.random(200) < 0.3,
+                                np.random.normal(0, 300, 200), np.nan)
+        hits, score, normalized_score, trend, auc = enrichment.auc_score(distances)
+        self.assertEqual(hits, np.count_nonzero(~np.isnan(distances)))
+        self.assertAlmostEqual(np.sum(score), 1)
+        self.assertAlmostEqual(auc, (area(np.cumsum(normalized_score))
+                                        - area(trend))*2)
+        #No hits in the middle two quartiles
+        distances[50:150] = np.nan
+        self.assertIsNone(enrichment.auc_score(distances)[-1])
+
+    def test_auc_table(self):
+        rows = [('motif' + str(i), np.where(np.random.random(200) < 0.1*i,
+                                    np.random.normal(0, 300, 200), np.nan))
+                for i in range(6)]
+        rows[1][1][50:150] = np.nan
+        matrix = distance_matrix.DistanceMatrix.from_rows(rows)
+        block = enrichment.SCORE_BLOCK
+        try:
+            enrichment.SCORE_BLOCK = 4*200
+            results = enrichment.auc_table(motif_distances=matrix, 
+                                            motif_fpkm={})
+        finally:
+            enrichment.SCORE_BLOCK = block
+        self.assertEqual([result[0] for result in results], matrix.motifs)
+        for (motif, auc, hits, _, _, mu, sigma, _), (_, distances) in zip(
+                                                            results, matrix):
+            self.assertEqual(hits, np.count_nonzero(~np.isnan(distances)))
+            if motif in ['motif0', 'motif1']:
+                self.assertEqual(auc, 0)
+                self.assertTrue(np.isnan(mu))
+                continue
+            _, _, normalized_score, trend, expected = enrichment.auc_score(
+                                                                    distances)
+            self.assertAlmostEqual(auc, expected)
+            self.assertAlmostEqual(auc, (area(np.cumsum(normalized_score))
+                                            - area(trend))*2)
+            moments = enrichment.auc_moments(distances=normalized_score, 
+                                                trend=trend)
+            np.testing.assert_allclose([mu, sigma], moments)
+
+    def test_auc_weights(self):
+        for n in [1, 2, 7, 500]:
+            x = np.random.random(n)
+            self.assertAlmostEqual(np.dot(x, enrichment.auc_weights(n)),
+                                    area(np.cumsum(x)))
+            self.assertAlmostEqual(enrichment.trapz(x), area(x))
+
+    def test_permute_auc(self):
+        permutations = 50
+        np.random.seed(1)
+        triangle_area = area(self.trend)
+        expected = [(area(np.cumsum(np.random.permutation(self.distances)))
+                        - triangle_area)*2 for _ in range(permutations)]
+
+        #Blocks smaller than, equal to and larger than the permutation count
+        block = enrichment.PERMUTATION_BLOCK
+        try:
+            for block_size in [7, permutations, 1000]:
+                enrichment.PERMUTATION_BLOCK = block_size*len(self.distances)
+                np.random.seed(1)
+                sim_auc = enrichment.permute_auc(distances=self.distances,
+                                                    trend=self.trend,
+                                                    permutations=permutations)
+                np.testing.assert_allclose(sim_auc, expected, atol=1e-12)
+        finally:
+            enrichment.PERMUTATION_BLOCK = block
+
+    def test_sample_positions(self):
+        positions = enrichment.sample_positions(n=50, k=20, size=2000)
+        self.assertEqual(positions.shape, (2000, 20))
+        self.assertTrue(np.all((positions >= 0) & (positions < 50)))
+        for sample in positions:
+            self.assertEqual(len(set(sample)), 20)
+        #Every position is equally likely to receive each score
+        for column in [positions[:, 0], positions[:, -1]]:
+            counts = np.bincount(column, minlength=50)
+            self.assertGreater(stats.chisquare(counts)[1], 0.001)
+
+    def test_permute_auc_hits(self):
+        distances = np.where(np.random.random(len(self.distances)) < 0.05,
+                                self.distances, 0)
+        self.assertLess(np.count_nonzero(distances),
+                        enrichment.SPARSE_HITS*len(distances))
+        sparse = enrichment.permute_auc(distances=distances, trend=self.trend,
+                                        permutations=5000)
+        weights = enrichment.auc_weights(len(distances))
+        dense = [(np.dot(np.random.permutation(distances), weights)
+                    - area(self.trend))*2 for _ in range(5000)]
+        self.assertGreater(stats.ks_2samp(sparse, dense)[1], 0.001)
+
+    def test_auc_moments(self):
+        #Exact over all permutations of a short score vector
+        distances = np.array([0.0, 0.3, 0.0, 0.1, 0.6, 0.0])/6
+        trend = np.linspace(0, 1, 6)/6
+        sim_auc = [(area(np.cumsum(distances[list(order)])) - area(trend))*2
+                    for order in itertools.permutations(range(6))]
+        mu, sigma = enrichment.auc_moments(distances=distances, trend=trend)
+        self.assertAlmostEqual(mu, np.mean(sim_auc))
+        self.assertAlmostEqual(sigma, np.std(sim_auc))
+
+    def test_permute_auc_adaptive(self):
+        mu, sigma = enrichment.auc_moments(distances=self.distances,
+                                            trend=self.trend)
+        keywords = dict(distances=self.distances, trend=self.trend,
+                        permutations=10000, batch=100, tests=100,
+                        p_cutoff=np.log(0.1))
+        #Motifs near the null mean stop after the first few batches
+        sim_auc = enrichment.permute_auc_adaptive(aucs=[mu], **keywords)
+        self.assertLess(len(sim_auc), 1000)
+        #Significant motifs receive all permutations
+        sim_auc = enrichment.permute_auc_adaptive(aucs=[mu, mu + 10*sigma],
+                                                    **keywords)
+        self.assertEqual(len(sim_auc), 10000)
+        self.assertAlmostEqual(np.std(sim_auc)/sigma, 1, places=1)
+
+    def test_permute_auc_range(self):
+        keywords = dict(distances=self.distances, trend=self.trend)
+        sim_auc = enrichment.permute_auc_range(start=0, stop=250,
+                            seed_sequence=np.random.SeedSequence(42), **keywords)
+        self.assertEqual(len(sim_auc), 250)
+        #Permutations do not depend on how the range is split
+        split = [enrichment.permute_auc_range(start=start, stop=stop,
+                            seed_sequence=np.random.SeedSequence(42), **keywords)
+                    for start, stop in [(0, 130), (130, 250)]]
+        np.testing.assert_array_equal(np.concatenate(split), sim_auc)
+        #Adaptive batches draw each stream once and the same permutations
+        drawn = list()
+        permute_auc = enrichment.permute_auc
+        try:
+            enrichment.permute_auc = lambda **kw: (drawn.append(1) 
+                                                    or permute_auc(**kw))
+            adaptive = enrichment.permute_auc_adaptive(batch=10, 
+                            permutations=250, aucs=[np.inf], tests=1,
+                            p_cutoff=np.log(0.1),
+                            seed_sequence=np.random.SeedSequence(42), 
+                            **keywords)
+        finally:
+            enrichment.permute_auc = permute_auc
+        np.testing.assert_array_equal(adaptive, sim_auc)
+        self.assertEqual(len(drawn), 3)
+        other = enrichment.permute_auc_range(start=0, stop=250,
+                            seed_sequence=np.random.SeedSequence(43), **keywords)
+        self.assertFalse(np.array_equal(other, sim_auc))
+
+class TestMaxGSEA(unittest.TestCase):
+    def setUp(self):
+        np.random.seed(0)
+
+    def test_max_GSEA(self):
+        hits = np.random.random((30, 40)) < np.linspace(0.1, 0.9, 30)[:, None]
+        hits[0] = False
+        hits[-1] = True
+        es = enrichment.max_GSEA(hits)
+        self.assertTrue(np.isnan(es[0]) and np.isnan(es[-1]))
+        for row, x in zip(hits[1:-1], es[1:-1]):
+            running = np.array(running_sum(row))
+            self.assertAlmostEqual(abs(x), np.max(np.abs(running)))
+            #Ties of opposite sign resolve to the first peak
+            first = np.flatnonzero(np.isclose(np.abs(running), abs(x)))[0]
+            self.assertAlmostEqual(x, running[first])
+            positions = np.flatnonzero(row)[None]
+            self.assertEqual(enrichment.max_GSEA_positions(positions=positions,
+                                                            n=len(row))[0], x)
+
+    def test_permute_max_GSEA(self):
+        n = 300
+        for fraction in [0.03, 0.5, 0.97]:
+            hits = np.random.random(n) < fraction
+            sim_es = enrichment.permute_max_GSEA(hits=hits, permutations=2000,
+                                                rng=np.random.default_rng(0))
+            expected = [enrichment.max_GSEA(np.random.permutation(hits))[0]
+                        for _ in range(2000)]
+            self.assertGreater(stats.ks_2samp(sim_es, expected).pvalue, 0.001)
+        self.assertTrue(np.all(np.isnan(enrichment.permute_max_GSEA(
+                                        hits=np.zeros(n, dtype=bool),
+                                        permutations=10))))
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains unit tests for the genome_fasta module.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from TFEA import scanner
+from TFEA import genome_fasta
+
+#Tests
+#==============================================================================
+class TestGenomeFasta(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = Path(tempfile.mkdtemp())
+        np.random.seed(0)
+        self.genome = dict((chrom, ''.join(np.random.choice(list('ACGTNacgt'),
+                                                            size=size)))
+                            for chrom, size in [('chr1', 1000), ('chr2', 617)])
+        self.genomefasta = self.tempdir / 'genome.fa'
+        with open(self.genomefasta, 'w') as outfile:
+            for chrom, sequence in self.genome.items():
+                outfile.write(f'>{chrom} description\n')
+                for i in range(0, len(sequence), 60):
+                    outfile.write(sequence[i:i+60] + '\n')
+
+    def tearDown(self):
+        genome_fasta._GENOMES.clear()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_index_fasta(self):
+        fai = genome_fasta.read_fai(genomefasta=self.genomefasta)
+        self.assertEqual(fai['chr1'], (1000, 18, 60, 61))
+        self.assertEqual(fai['chr2'], (617, 18 + 1017 + 18, 60, 61))
+        self.assertTrue((self.tempdir / 'genome.fa.fai').exists())
+
+    def test_fetch(self):
+        for _ in range(100):
+            chrom = np.random.choice(['chr1', 'chr2'])
+            start = np.random.randint(0, len(self.genome[chrom]))
+            stop = np.random.randint(start + 1, len(self.genome[chrom]) + 1)
+            sequence = genome_fasta.fetch(genomefasta=self.genomefasta,
+                                            chrom=chrom, start=start,
+                                            stop=stop)
+            self.assertEqual(sequence.decode(),
+                                self.genome[chrom][start:stop])
+
+    def test_getfasta(self):
+        bedfile = self.tempdir / 'regions.bed'
+        bedfile.write_text('#chrom\tstart\tstop\n'
+                            'chr2\t100\t250\nchr1\t900\t1100\nchr1\t0\t60\n')
+        fasta_file = scanner.getfasta(bedfile=bedfile,
+                                        genomefasta=self.genomefasta,
+                                        tempdir=self.tempdir,
+                                        outname='regions.fa')
+        self.assertEqual(scanner.fasta_names(fastafile=fasta_file),
+                            ['chr2:100-250', 'chr1:0-60'])
+        self.assertEqual(scanner.fasta_sequences(fastafile=fasta_file),
+                            [self.genome['chr2'][100:250],
+                            self.genome['chr1'][:60]])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
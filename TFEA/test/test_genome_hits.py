@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains unit tests for the genome_hits module.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from TFEA import genome_hits
+
+#Tests
+#==============================================================================
+def brute_force_closest(hits=None, center=None):
+    '''bedtools closest -D ref -t first distance from a 1bp center to a list
+        of (start, stop) hits sorted by start
+    '''
+    best = None
+    for start, stop in hits:
+        if start <= center < stop:
+            distance = 0
+        elif stop <= center:
+            distance = -(center - stop + 1)
+        else:
+            distance = start - center
+        if best is None or abs(distance) < abs(best):
+            best = distance
+
+    return best
+
+class TestGenomeHits(unittest.TestCase):
+    def setUp(self):
+        self.srcdir = Path(__file__).parent
+        self.genomehits = self.srcdir / 'test_files' / 'test_genome_hits'
+        self.tempdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_nearest_hits(self):
+        np.random.seed(0)
+        starts = np.sort(np.random.randint(0, 10000, size=200))
+        stops = starts + np.random.randint(1, 40, size=200)
+        centers = np.random.randint(0, 10000, size=500)
+        distances = genome_hits.nearest_hits(starts=starts,
+                                        maxstops=np.maximum.accumulate(stops),
+                                        centers=centers)
+        expected = [brute_force_closest(hits=list(zip(starts, stops)),
+                                        center=center) for center in centers]
+        np.testing.assert_array_equal(distances, expected)
+
+    def test_build_index(self):
+        index_dir = genome_hits.get_index(genomehits=self.genomehits,
+                                            tempdir=self.tempdir)
+        index = genome_hits.load_index(index_dir=index_dir)
+        self.assertEqual(sorted(index), ['SOX10_HUMAN.H11MO.0.B'])
+        region_sets = [(np.array(['chr1', 'chr1', 'chrUn']),
+                        np.array([30850, 30900, 100]))]
+        motif_distances = genome_hits.closest_distances(
+                                            ['SOX10_HUMAN.H11MO.0.B'],
+                                            index_dir=index_dir, index=index,
+                                            region_sets=region_sets,
+                                            distance_cutoff=1500)
+        motif, distances = motif_distances[0][0]
+        self.assertEqual(motif, 'SOX10_HUMAN.H11MO.0.B')
+        np.testing.assert_array_equal(distances, [0, -45, np.nan])
+
+    def test_region_centers(self):
+        bedfile = self.tempdir / 'regions.bed'
+        with open(bedfile, 'w') as outfile:
+            outfile.write('track name=regions\nbrowser position chr1:1-100\n'
+                            '#header\nchr2\t100\t200\nchr1\t10\t21\n'
+                            'chr2\t50\t60\n')
+        chroms, centers = genome_hits.region_centers(bedfile=bedfile)
+        np.testing.assert_array_equal(chroms, ['chr2', 'chr1', 'chr2'])
+        np.testing.assert_array_equal(centers, [150, 15, 55])
+        regions = genome_hits.chrom_regions(chroms=chroms)
+        self.assertEqual(sorted(regions), ['chr1', 'chr2'])
+        np.testing.assert_array_equal(regions['chr1'], [1])
+        np.testing.assert_array_equal(regions['chr2'], [0, 2])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
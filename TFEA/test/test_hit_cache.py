@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains unit tests for the hit_cache module.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from TFEA import hit_cache
+
+#Tests
+#==============================================================================
+class TestIntervals(unittest.TestCase):
+    def test_merge_intervals(self):
+        starts, stops = hit_cache.merge_intervals([50, 0, 10, 30],
+                                                    [60, 10, 20, 40])
+        np.testing.assert_array_equal(starts, [0, 30, 50])
+        np.testing.assert_array_equal(stops, [20, 40, 60])
+
+    def test_subtract_intervals(self):
+        starts, stops = hit_cache.subtract_intervals(starts=np.array([0, 100]),
+                                            stops=np.array([50, 200]),
+                                            remove_starts=np.array([10, 150]),
+                                            remove_stops=np.array([20, 250]))
+        np.testing.assert_array_equal(starts, [0, 20, 100])
+        np.testing.assert_array_equal(stops, [10, 50, 150])
+
+    def test_intersect_intervals(self):
+        starts, stops = hit_cache.intersect_intervals(starts=np.array([0, 100]),
+                                            stops=np.array([50, 200]),
+                                            other_starts=np.array([40, 150]),
+                                            other_stops=np.array([120, 160]))
+        np.testing.assert_array_equal(starts, [40, 100, 150])
+        np.testing.assert_array_equal(stops, [50, 120, 160])
+
+class TestHitCache(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_save_load(self):
+        key = hit_cache.cache_key('numpy', 'genome', np.ones((4, 4)), 10)
+        self.assertNotEqual(key, hit_cache.cache_key('numpy', 'genome',
+                                                        np.ones((4, 4)), 11))
+        for i in range(hit_cache.MAX_CHUNKS + 1):
+            hit_cache.save(cache_dir=self.tempdir, key=key,
+                            coverage={'chr1': ([i*100], [i*100 + 100])},
+                            hits={'chr1': ([i*100 + 5, 0], [i*100 + 15, 10],
+                                            [float(i), 0.0])})
+        coverage, hits, chunk_files = hit_cache.load(cache_dir=self.tempdir,
+                                                        key=key)
+        self.assertEqual(len(chunk_files), 1)
+        np.testing.assert_array_equal(coverage['chr1'][0], [0])
+        np.testing.assert_array_equal(coverage['chr1'][1],
+                                        [(hit_cache.MAX_CHUNKS + 1)*100])
+        self.assertEqual(len(hits['chr1'][0]), hit_cache.MAX_CHUNKS + 2)
+
+    def test_best_hits(self):
+        hits = {'chr1': hit_cache.unique_hits([10, 20, 30, 95],
+                                                [20, 30, 40, 105],
+                                                [5.0, 9.0, 9.0, 20.0])}
+        hit_starts, hit_stops, hit_scores = hit_cache.best_hits(
+                                        chroms=np.array(['chr1', 'chr1', 'chr2']),
+                                        starts=np.array([0, 25, 0]),
+                                        stops=np.array([100, 100, 100]),
+                                        hits=hits)
+        np.testing.assert_array_equal(hit_starts, [20, 30, -1])
+        np.testing.assert_array_equal(hit_stops, [30, 40, -1])
+        np.testing.assert_array_equal(hit_scores, [9.0, 9.0, -np.inf])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
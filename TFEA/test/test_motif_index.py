@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains unit tests for the motif_index module.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from TFEA import motif_index
+from TFEA import exceptions
+
+#Tests
+#==============================================================================
+def parse_meme(motifdatabase=None):
+    '''Parses motif names and probability matrices one line at a time'''
+    motifs = list()
+    with open(motifdatabase) as F:
+        for line in F:
+            if line.startswith('MOTIF'):
+                motifs.append((line.split()[-1], list()))
+            elif (len(motifs) != 0 and len(line.split()) == 4
+                    and 'URL' not in line):
+                motifs[-1][1].append([float(x) for x in line.split()])
+
+    return motifs
+
+class TestMotifIndex(unittest.TestCase):
+    def setUp(self):
+        self.srcdir = Path(__file__).parent
+        self.tempdir = Path(tempfile.mkdtemp())
+        self.motifdatabase = self.tempdir / 'database.meme'
+        shutil.copy(self.srcdir / 'test_files' / 'test_database.meme',
+                    self.motifdatabase)
+
+    def tearDown(self):
+        motif_index._INDEXES.clear()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_compile(self):
+        index = motif_index.load(motifdatabase=self.motifdatabase)
+        expected = parse_meme(motifdatabase=self.motifdatabase)
+        self.assertEqual(index.names, [motif for motif, _ in expected])
+        for motif, pssm in expected:
+            pssm = np.array(pssm)
+            pssm = pssm/pssm.sum(axis=1)[:, None]
+            np.testing.assert_allclose(index.pssm(motif=motif)[0], pssm)
+            self.assertEqual(index.width(motif=motif), len(pssm))
+            self.assertAlmostEqual(index.gc(motif=motif),
+                                    np.mean(pssm[:, 1] + pssm[:, 2]))
+            self.assertEqual(index.consensus(motif=motif),
+                        ''.join('ACGT'[np.argmax(row)] for row in pssm))
+        np.testing.assert_allclose(index.background, [0.25]*4)
+        with self.assertRaises(exceptions.InputError):
+            index.pssm(motif='SP2')
+
+    def test_index_file(self):
+        index_file = motif_index.index_path(motifdatabase=self.motifdatabase)
+        index = motif_index.load(motifdatabase=self.motifdatabase)
+        self.assertTrue(os.path.exists(index_file))
+
+        #A fresh process reads the index file instead of the database
+        motif_index._INDEXES.clear()
+        os.utime(index_file, ns=(0, 0))
+        reloaded = motif_index.load(motifdatabase=self.motifdatabase)
+        self.assertEqual(reloaded.names, index.names)
+        self.assertEqual(os.stat(index_file).st_mtime_ns, 0)
+
+        #Touching the database keeps the index if the content is unchanged
+        stat = os.stat(self.motifdatabase)
+        os.utime(self.motifdatabase, ns=(stat.st_atime_ns,
+                                            stat.st_mtime_ns + 10**9))
+        touched = motif_index.load(motifdatabase=self.motifdatabase)
+        np.testing.assert_array_equal(touched.arrays['pssms'],
+                                        index.arrays['pssms'])
+
+        #Changing the database rebuilds the index
+        with open(self.motifdatabase, 'a') as outfile:
+            outfile.write('\nMOTIF NEW\nletter-probability matrix: alength= 4 '
+                            'w= 2 nsites= 10\n1 0 0 0\n0 0.5 0.5 0\n')
+        changed = motif_index.load(motifdatabase=self.motifdatabase)
+        self.assertEqual(changed.names, index.names + ['NEW'])
+        self.assertEqual(changed.consensus(motif='NEW'), 'AC')
+        self.assertEqual(changed.pssm(motif='NEW')[1], 10.0)
+
+    def test_write_meme(self):
+        outfile = self.tempdir / 'single.meme'
+        motif = motif_index.load(motifdatabase=self.motifdatabase).names[1]
+        motif_index.write_meme(motifdatabase=self.motifdatabase,
+                                motifs=[motif], outfile=outfile)
+        single = motif_index.load(motifdatabase=outfile)
+        self.assertEqual(single.names, [motif])
+        np.testing.assert_allclose(single.pssm(motif=motif)[0],
+            motif_index.load(motifdatabase=self.motifdatabase).pssm(motif=motif)[0])
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
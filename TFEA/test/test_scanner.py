@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''This module contains unit tests for the in-process motif scanning functions
+    within the SCANNER module.
+'''
+
+#==============================================================================
+__author__ = 'Jonathan D. Rubin and Rutendo F. Sigauke'
+__credits__ = ['Jonathan D. Rubin', 'Rutendo F. Sigauke', 'Jacob T. Stanley',
+                'Robin D. Dowell']
+__maintainer__ = 'Jonathan D. Rubin'
+__email__ = 'Jonathan.Rubin@colorado.edu'
+
+#Imports
+#==============================================================================
+import itertools
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+from TFEA import scanner
+from TFEA import exceptions
+from TFEA import distance_matrix
+from TFEA import motif_index
+from TFEA import genome_fasta
+
+#Tests
+#==============================================================================
+def brute_force_distances(sequences=None, log_odds=None, cutoff=None,
+                            largewindow=None):
+    '''Scores every position of every sequence on both strands one at a time
+    '''
+    complement = {'A':'T', 'C':'G', 'G':'C', 'T':'A'}
+    width = len(log_odds)
+    distances = list()
+    for sequence in sequences:
+        sequence = sequence.upper()
+        best_score = None
+        best_position = None
+        for i in range(len(sequence) - width + 1):
+            site = sequence[i:i+width]
+            if any(base not in complement for base in site):
+                continue
+            rc_site = ''.join(complement[base] for base in site[::-1])
+            for kmer in (site, rc_site):
+                score = sum(log_odds[j][scanner.ALPHABET.index(base)]
+                            for j, base in enumerate(kmer))
+                if score >= cutoff and (best_score is None or score > best_score):
+                    best_score = score
+                    best_position = i
+        if best_score is None:
+            distances.append('.')
+        else:
+            distances.append(((best_position+1+best_position+width)/2)-largewindow)
+
+    return distances
+
+class TestNumpyScanner(unittest.TestCase):
+    def setUp(self):
+        self.srcdir = Path(__file__).parent
+        self.testdir = self.srcdir / 'test_files'
+        self.tempdir = Path(tempfile.mkdtemp())
+        #Motif indexes are written next to the database, so use a copy
+        self.fimo_motifs = self.tempdir / 'test_database.meme'
+        shutil.copy(self.testdir / 'test_database.meme', self.fimo_motifs)
+        self.background = np.array([0.3, 0.2, 0.2, 0.3])
+        np.random.seed(0)
+        self.sequences = [''.join(np.random.choice(list('ACGTacgtN'), size=300))
+                            for _ in range(20)]
+        self.fasta_file = self.tempdir / 'sequences.fa'
+        with open(self.fasta_file, 'w') as outfile:
+            for i, sequence in enumerate(self.sequences):
+                outfile.write(f'>region{i}\n{sequence[:150]}\n{sequence[150:]}\n')
+
+    def tearDown(self):
+        motif_index._INDEXES.clear()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_score_cutoff(self):
+        pssm = np.random.dirichlet(np.ones(4), size=4)
+        log_odds = scanner.pwm_log_odds(pssm=pssm, nsites=20,
+                                        background=self.background)
+        for thresh in [0.5, 0.05, 0.004]:
+            cutoff = scanner.pwm_score_cutoff(log_odds=log_odds,
+                                                background=self.background,
+                                                thresh=thresh)
+            #Enumerate all possible 4-mers to get exact p-values
+            pvalue = 0.0
+            for kmer in itertools.product(range(4), repeat=4):
+                score = sum(log_odds[j][base] for j, base in enumerate(kmer))
+                if score >= cutoff:
+                    pvalue += np.prod(self.background[list(kmer)])
+            self.assertLess(pvalue, thresh)
+
+    def test_pvalue_tables(self):
+        motifdatabase = self.tempdir / 'database.meme'
+        shutil.copy(self.fimo_motifs, motifdatabase)
+        pssms = scanner.meme_pssms(motifdatabase=motifdatabase)
+        motifs = list(pssms)
+        tables = scanner.motif_pvalue_tables(motifdatabase=motifdatabase,
+                                                motifs=motifs,
+                                                background=self.background)
+        motif_index._INDEXES.clear()
+        cached = scanner.motif_pvalue_tables(motifdatabase=motifdatabase,
+                                                motifs=motifs,
+                                                background=self.background)
+        self.assertEqual(len(motif_index.load(
+                            motifdatabase=motifdatabase).arrays['table_keys']), 1)
+        for motif, (pssm, nsites) in pssms.items():
+            log_odds = scanner.pwm_log_odds(pssm=pssm, nsites=nsites,
+                                            background=self.background)
+            np.testing.assert_array_equal(tables[motif][0], log_odds)
+            np.testing.assert_array_equal(cached[motif][1][1],
+                                            tables[motif][1][1])
+            full_table = scanner.pwm_pvalue_table(log_odds=log_odds,
+                                                    background=self.background)
+            for thresh in [1e-3, 1e-4, 1e-6]:
+                self.assertEqual(scanner.table_score_cutoff(
+                                                table=tables[motif][1],
+                                                thresh=thresh),
+                                    scanner.pwm_score_cutoff(
+                                                log_odds=log_odds,
+                                                background=self.background,
+                                                thresh=thresh))
+            scores = np.arange(len(full_table[1]))
+            pvalues = scanner.table_pvalues(table=tables[motif][1],
+                                            scores=scores)
+            kept = full_table[1] <= scanner.PVALUE_TABLE_MAX
+            np.testing.assert_array_equal(pvalues[kept], full_table[1][kept])
+            self.assertTrue(np.all(pvalues[~kept] == 1.0))
+
+    def test_numpy_scan(self):
+        pssms = scanner.meme_pssms(motifdatabase=self.fimo_motifs)
+        encoded_file = scanner.fasta_encode(fastafile=self.fasta_file,
+                                            tempdir=self.tempdir)
+        for motif, (pssm, nsites) in pssms.items():
+            log_odds = scanner.pwm_log_odds(pssm=pssm, nsites=nsites,
+                                            background=self.background)
+            cutoff = scanner.pwm_score_cutoff(log_odds=log_odds,
+                                                background=self.background,
+                                                thresh=0.01)
+            expected = brute_force_distances(sequences=self.sequences,
+                                                log_odds=log_odds,
+                                                cutoff=cutoff, largewindow=150)
+            for pwm_scan in ['full', 'lookahead']:
+                scanned_motif, distances = scanner.numpy_scan(
+                                            (motif, log_odds, cutoff),
+                                            encoded_file=encoded_file,
+                                            largewindow=150, block_size=1000,
+                                            pwm_scan=pwm_scan)
+                self.assertEqual(scanned_motif, motif)
+                self.assertEqual(['.' if np.isnan(x) else x 
+                                    for x in distances], expected)
+
+    def test_numpy_scan_hits(self):
+        pssms = scanner.meme_pssms(motifdatabase=self.fimo_motifs)
+        encoded, offsets = scanner.fasta_encode_flat(fastafile=self.fasta_file)
+        np.testing.assert_array_equal(offsets, np.arange(20)*301)
+        for motif, (pssm, nsites) in pssms.items():
+            log_odds = scanner.pwm_log_odds(pssm=pssm, nsites=nsites,
+                                            background=self.background)
+            cutoff = scanner.pwm_score_cutoff(log_odds=log_odds,
+                                                background=self.background,
+                                                thresh=0.01)
+            positions, scores = scanner.numpy_scan_hits((motif, log_odds, cutoff),
+                                                        encoded=encoded,
+                                                        block_size=1000)
+            #Best hit per sequence matches numpy_scan
+            distances = np.full(len(offsets), np.nan)
+            best_scores = np.full(len(offsets), -np.inf)
+            for position, score in zip(positions, scores):
+                i = np.searchsorted(offsets, position, side='right') - 1
+                if score > best_scores[i]:
+                    best_scores[i] = score
+                    start = position - offsets[i]
+                    distances[i] = ((start+1+start+len(log_odds))/2)-150
+            expected = brute_force_distances(sequences=self.sequences,
+                                                log_odds=log_odds,
+                                                cutoff=cutoff, largewindow=150)
+            self.assertEqual(['.' if np.isnan(x) else x for x in distances],
+                                expected)
+
+    def test_lookahead_scan_hits(self):
+        pssms = scanner.meme_pssms(motifdatabase=self.fimo_motifs)
+        encoded = np.random.randint(0, 5, size=50000).astype(np.uint8)
+        for motif, (pssm, nsites) in pssms.items():
+            log_odds = scanner.pwm_log_odds(pssm=pssm, nsites=nsites,
+                                            background=self.background)
+            for thresh in [0.01, 1e-4, 1e-6]:
+                cutoff = scanner.pwm_score_cutoff(log_odds=log_odds,
+                                                background=self.background,
+                                                thresh=thresh)
+                full = scanner.numpy_scan_hits((motif, log_odds, cutoff),
+                                                encoded=encoded,
+                                                block_size=7000)
+                lookahead = scanner.numpy_scan_hits((motif, log_odds, cutoff),
+                                                encoded=encoded,
+                                                block_size=7000,
+                                                pwm_scan='lookahead')
+                np.testing.assert_array_equal(lookahead[0], full[0])
+                np.testing.assert_array_equal(lookahead[1], full[1])
+
+    def test_markov_background(self):
+        encoded, _ = scanner.fasta_encode_flat(fastafile=self.fasta_file)
+        complement = {'A':'T', 'C':'G', 'G':'C', 'T':'A'}
+        for k in [1, 2, 3]:
+            counts = scanner.markov_counts(encoded=encoded, k=k)
+            expected = dict((''.join(kmer), 0) for kmer
+                            in itertools.product(scanner.ALPHABET, repeat=k))
+            for sequence in self.sequences:
+                sequence = sequence.upper()
+                for i in range(len(sequence) - k + 1):
+                    kmer = sequence[i:i+k]
+                    if all(base in complement for base in kmer):
+                        expected[kmer] += 1
+                        expected[''.join(complement[base]
+                                        for base in kmer[::-1])] += 1
+            self.assertEqual(list(counts), list(expected.values()))
+
+        background_file = scanner.get_background_file(
+                                        fimo_background='largewindow',
+                                        fasta_file=self.fasta_file,
+                                        tempdir=self.tempdir, largewindow=150)
+        self.assertEqual(background_file, scanner.get_background_file(
+                                        fimo_background='largewindow',
+                                        fasta_file=self.fasta_file,
+                                        tempdir=self.tempdir, largewindow=150))
+        background = scanner.markov_background(background_file=background_file)
+        self.assertAlmostEqual(background[0], background[3], places=3)
+
+class TestMergedScan(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = Path(tempfile.mkdtemp())
+        self.fimo_motifs = self.tempdir / 'test_database.meme'
+        shutil.copy(Path(__file__).parent / 'test_files' / 'test_database.meme',
+                    self.fimo_motifs)
+        np.random.seed(0)
+        self.genomefasta = self.tempdir / 'genome.fa'
+        with open(self.genomefasta, 'w') as outfile:
+            for chrom in ['chr1', 'chr2']:
+                sequence = ''.join(np.random.choice(list('ACGT'), size=5000))
+                outfile.write(f'>{chrom}\n{sequence}\n')
+        self.centers = [('chr1', 500), ('chr1', 560), ('chr2', 4890), 
+                        ('chr2', 1000), ('chr1', 3000)]
+
+    def tearDown(self):
+        genome_fasta._GENOMES.clear()
+        motif_index._INDEXES.clear()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def bedfile(self, window=None):
+        bedfile = self.tempdir / f'regions_{window}.bed'
+        with open(bedfile, 'w') as outfile:
+            for chrom, center in self.centers:
+                outfile.write(f'{chrom}\t{center-window}\t{center+window}\n')
+        return bedfile
+
+    def test_windows(self):
+        motifs = scanner.fimo_motif_names(motifdatabase=self.fimo_motifs)
+        pwm_list = scanner.numpy_pwms(motif_list=motifs, 
+                                        fimo_motifs=self.fimo_motifs,
+                                        background_file=None, fimo_thresh=0.01)
+        keywords = dict(genomefasta=self.genomefasta, tempdir=self.tempdir, 
+                        scanner='numpy', motifdatabase=self.fimo_motifs,
+                        pwms=dict((motif, (log_odds, cutoff)) 
+                                    for motif, log_odds, cutoff in pwm_list))
+        windows = scanner.merged_scan(motifs, bedfiles=[self.bedfile(100)], 
+                                        largewindow=100, windows=[100, 60, 20],
+                                        **keywords)
+        self.assertEqual(len(windows), 3)
+        for window, results in zip([100, 60, 20], windows):
+            expected = scanner.merged_scan(motifs, 
+                                            bedfiles=[self.bedfile(window)],
+                                            largewindow=window, **keywords)[0]
+            for (motif, distances), (_, expected_distances) in zip(results, 
+                                                                    expected):
+                np.testing.assert_array_equal(distances, expected_distances)
+            self.assertTrue(all(np.nanmax(np.abs(distances)) < window
+                                for _, distances in results 
+                                if not np.all(np.isnan(distances))))
+
+    def test_all_hits(self):
+        motifs = scanner.fimo_motif_names(motifdatabase=self.fimo_motifs)
+        pwm_list = scanner.numpy_pwms(motif_list=motifs, 
+                                        fimo_motifs=self.fimo_motifs,
+                                        background_file=None, fimo_thresh=0.01)
+        results = scanner.merged_scan(motifs, bedfiles=[self.bedfile(100)], 
+                                genomefasta=self.genomefasta, 
+                                tempdir=self.tempdir, scanner='numpy', 
+                                motifdatabase=self.fimo_motifs, 
+                                largewindow=100, windows=[100, 60], 
+                                all_hits=True,
+                                pwms=dict((motif, (log_odds, cutoff)) 
+                                    for motif, log_odds, cutoff in pwm_list))
+        for window, rows in zip([100, 60], results):
+            distances, hits = scanner.scan_matrices(rows=rows)
+            self.assertEqual(hits.shape, distances.shape)
+            best = hits.summary(retain='best')
+            for i, motif in enumerate(motifs):
+                np.testing.assert_array_equal(best.row(i), distances.row(i))
+                regions, hit_distances, _, strands = hits.row(i)
+                width = len(pwm_list[i][1])
+                self.assertTrue(np.all(np.abs(hit_distances) 
+                                        <= window - width/2))
+                self.assertTrue(np.all(np.isin(strands, [1, -1])))
+                np.testing.assert_array_equal(hits.counts(i) > 0, 
+                                                ~np.isnan(distances.row(i)))
+
+    def test_threshs(self):
+        motifs = scanner.fimo_motif_names(motifdatabase=self.fimo_motifs)
+        tables = scanner.numpy_pvalue_tables(motif_list=motifs, 
+                                                fimo_motifs=self.fimo_motifs,
+                                                background_file=None, 
+                                                max_pvalue=0.01)
+        bedfile = self.bedfile(100)
+        keywords = dict(bedfiles=[bedfile, bedfile], 
+                        genomefasta=self.genomefasta, tempdir=self.tempdir, 
+                        scanner='numpy', motifdatabase=self.fimo_motifs, 
+                        largewindow=100)
+        threshs = [0.01, 1e-3, 1e-4]
+        results = scanner.merged_scan(motifs, thresh=threshs[0], 
+                                        threshs=threshs, windows=[100, 60], 
+                                        tables=dict((motif, table) for motif, 
+                                                    (_, table) in tables.items()),
+                                        pwms=dict((motif, (log_odds, 
+                                            scanner.table_score_cutoff(
+                                                table=table, thresh=threshs[0])))
+                                            for motif, (log_odds, table) 
+                                            in tables.items()), **keywords)
+        self.assertEqual(len(results), 2*3*2)
+        for i, (window, thresh) in enumerate([(window, thresh) 
+                                                for window in [100, 60] 
+                                                for thresh in threshs]):
+            pwm_list = scanner.numpy_pwms(motif_list=motifs, 
+                                            fimo_motifs=self.fimo_motifs,
+                                            background_file=None, 
+                                            fimo_thresh=thresh)
+            expected = scanner.merged_scan(motifs, windows=[window], 
+                                            pwms=dict((motif, (log_odds, cutoff)) 
+                                                for motif, log_odds, cutoff 
+                                                in pwm_list), **keywords)
+            for region_set, expected_set in zip(results[2*i:2*i+2], expected):
+                for (_, distances), (_, expected_distances) in zip(region_set, 
+                                                                expected_set):
+                    np.testing.assert_array_equal(distances, 
+                                                    expected_distances)
+
+class TestFimoParser(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = Path(tempfile.mkdtemp())
+        self.fasta_file = self.tempdir / 'sequences.fa'
+        with open(self.fasta_file, 'w') as outfile:
+            for name in ['region0', 'region1', 'region2', 'region0']:
+                outfile.write(f'>{name}\nACGT\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_fimo_parse_stream(self):
+        fimo_stream = ['motif_id\tmotif_alt_id\tsequence_name\tstart\tstop\t'
+                        'strand\tscore\tp-value\tq-value\tmatched_sequence\n',
+                        'M1\tA\tregion1\t11\t20\t+\t5.0\t1e-5\t\t\n',
+                        'M1\tA\tregion1\t1\t10\t-\t9.0\t1e-6\t\t\n',
+                        'M1\tA\tregion1\t21\t30\t+\t2.0\t1e-4\t\t\n',
+                        'M2\tB\tregion0\t101\t110\t+\t3.0\t1e-4\t\t\n',
+                        'M3\tC\tregion2\t101\t110\t+\t3.0\t1e-4\t\t\n']
+        index = scanner.region_index(fastafile=self.fasta_file)
+        best_hits = scanner.fimo_parse_stream(fimo_stream=fimo_stream,
+                                                largewindow=50,
+                                                motifs=['M1', 'B'], 
+                                                index=index)
+        self.assertEqual(sorted(best_hits), ['B', 'M1'])
+        np.testing.assert_array_equal(
+                    scanner.region_distances(*best_hits['M1'], index=index),
+                    [np.nan, -44.5, np.nan, np.nan])
+        np.testing.assert_array_equal(
+                    scanner.region_distances(*best_hits['B'], index=index),
+                    [55.5, np.nan, np.nan, 55.5])
+
+class TestScanResults(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_save_load_scan_results(self):
+        motif_distances = distance_matrix.DistanceMatrix.from_rows(
+                                [('motif1', [1.0, '.', -3.5]),
+                                ('motif2', ['.', '.', 20.0])])
+        scanner.save_scan_results(scan_results=self.tempdir / 'scan_results',
+                                    motif_distances=motif_distances,
+                                    pvals=[0.1, 0.5, 0.9], fcs=[2.0, 1.0, 0.5],
+                                    largewindow=1500, motif_fpkm={})
+        results = scanner.load_scan_results(use_config=False, 
+                                    scan_results=self.tempdir / 'scan_results',
+                                    md=False, mdd=False)
+        self.assertEqual(results['MOTIF_DISTANCES'].motifs, ['motif1', 'motif2'])
+        np.testing.assert_array_equal(results['MOTIF_DISTANCES']['motif2'],
+                                        [np.nan, np.nan, 20.0])
+        self.assertIsNone(results['MD_DISTANCES1'])
+        self.assertEqual(results['LARGEWINDOW'], 1500)
+        np.testing.assert_array_equal(results['PVALS'], [0.1, 0.5, 0.9])
+        with self.assertRaises(exceptions.InputError):
+            scanner.load_scan_results(use_config=False, 
+                                    scan_results=self.tempdir / 'scan_results',
+                                    md=True, mdd=False)
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -17,11 +17,12 @@ setuptools.setup(
     package_data={"": ["test/test_files/*", "*sbatch"]},
     long_description=long_description,
     long_description_content_type="text/markdown",
-    scripts=["bin/TFEA", "bin/TFEA-annotate", "bin/TFEA-simulate"],
+    scripts=["bin/TFEA", "bin/TFEA-annotate", "bin/TFEA-simulate",
+                "bin/TFEA-genomehits"],
     install_requires=[
         "matplotlib>=3.1.1",
         "scipy",
-        "numpy",
+        "numpy>=1.17",
         "pybedtools",
         "htseq",
         "psutil",